@@ -0,0 +1,72 @@
+import threading
+
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView
+
+from core.disk_scanner import DiskScanner, ScanProgress, format_size
+
+COLUMNS = ["Folder", "Size", "Share"]
+
+
+class DiskUsageDialog(QDialog):
+    # What uses the space of a disk, filled in while its folders are scanned
+    progress_updated = pyqtSignal(object)
+    scan_failed = pyqtSignal(str)
+
+    def __init__(self, device: str, mount_point: str, parent=None):
+        super().__init__(parent, flags=Qt.Window)
+
+        self.setWindowTitle(f"Space used on {device}")
+        self.setMinimumSize(600, 500)
+
+        layout = QVBoxLayout(self)
+
+        self.status_label = QLabel(f"Scanning {mount_point}...")
+        layout.addWidget(self.status_label)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        self.closed = False
+        self.progress_updated.connect(self.show_progress)
+        self.scan_failed.connect(self.status_label.setText)
+
+        # Not a QThread: a scan stuck on a hung mount point must not keep the ToolBox from closing
+        self.scanner = DiskScanner(mount_point)
+        threading.Thread(target=self.scan, daemon=True).start()
+
+    def scan(self):
+        try:
+            self.scanner.scan(on_progress=self.publish)
+        except OSError as e:
+            if not self.closed:
+                self.scan_failed.emit(f"Cannot scan {self.scanner.root}: {e}")
+
+    def publish(self, progress: ScanProgress):
+        if not self.closed:
+            self.progress_updated.emit(progress)
+
+    def show_progress(self, progress: ScanProgress):
+        self.table.setRowCount(len(progress.top))
+        for row, (name, size) in enumerate(progress.top):
+            share = size / progress.total_bytes if progress.total_bytes else 0.0
+            for column, value in enumerate([name, format_size(size), f"{share * 100:.1f}%"]):
+                item = QTableWidgetItem(value)
+                if column > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+        state = "Scanned" if progress.finished else "Scanning"
+        self.status_label.setText(f"{state} {progress.root}: {format_size(progress.total_bytes)} in "
+                                  f"{progress.directories} folders ({progress.directories - progress.listed} unchanged "
+                                  f"since the last scan), {progress.elapsed:.1f} s")
+
+    def done(self, result):
+        # Closing the dialog stops the scan, its threads finish the folders they are reading
+        self.closed = True
+        self.scanner.stop()
+        super().done(result)
@@ -0,0 +1,119 @@
+import time
+
+from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTabWidget, QTableWidget, \
+    QTableWidgetItem, QHeaderView, QAbstractItemView
+
+from core.disk_scanner import format_size
+from core.docker_usage import DockerUsage, DockerUsageCache
+from core.system_sampler import SystemSnapshot
+
+IMAGE_COLUMNS = ["Image", "Size", "Unique", "Containers", "Releases"]
+CONTAINER_COLUMNS = ["Container", "Image", "State", "Written"]
+VOLUME_COLUMNS = ["Volume", "Size", "Containers"]
+BUILD_CACHE_COLUMNS = ["Entry", "Type", "Size", "In use", "Last used"]
+
+
+class DockerUsageDialog(QDialog):
+    # What docker uses on the disk, from the readings of the system sampler (docker takes a while to answer, the
+    # dialog shows the last reading and the sampler reads it again in the background)
+    def __init__(self, usage_cache: DockerUsageCache, snapshot: SystemSnapshot, parent=None):
+        super().__init__(parent, flags=Qt.Window)
+
+        self.usage_cache = usage_cache
+        self.usage = None
+
+        self.setWindowTitle("Space used by docker")
+        self.setMinimumSize(900, 600)
+
+        layout = QVBoxLayout(self)
+
+        status_layout = QHBoxLayout()
+        self.status_label = QLabel("Reading the disk usage of docker...")
+        status_layout.addWidget(self.status_label, stretch=1)
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh)
+        status_layout.addWidget(refresh_button)
+        layout.addLayout(status_layout)
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+        tabs = QTabWidget()
+        self.images_table = self.create_table(IMAGE_COLUMNS)
+        tabs.addTab(self.images_table, "Images")
+        self.containers_table = self.create_table(CONTAINER_COLUMNS)
+        tabs.addTab(self.containers_table, "Containers")
+        self.volumes_table = self.create_table(VOLUME_COLUMNS)
+        tabs.addTab(self.volumes_table, "Volumes")
+        self.build_cache_table = self.create_table(BUILD_CACHE_COLUMNS)
+        tabs.addTab(self.build_cache_table, "Build cache")
+        layout.addWidget(tabs)
+
+        self.show_snapshot(snapshot)
+
+    @staticmethod
+    def create_table(columns):
+        table = QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        table.horizontalHeader().setStretchLastSection(True)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        return table
+
+    @staticmethod
+    def fill_table(table, rows, number_columns):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column in number_columns:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                table.setItem(row, column, item)
+
+    def refresh(self):
+        self.usage_cache.refresh()
+        self.status_label.setText("Reading the disk usage of docker again...")
+
+    @pyqtSlot(object)
+    def show_snapshot(self, snapshot: SystemSnapshot):
+        if "docker_usage" in snapshot.errors:
+            self.status_label.setText(f"Docker does not answer: {snapshot.errors['docker_usage']}")
+        if snapshot.docker_usage is None or snapshot.docker_usage is self.usage:
+            return
+        self.show_usage(snapshot.docker_usage)
+
+    def show_usage(self, usage: DockerUsage):
+        self.usage = usage
+        self.status_label.setText(f"Read at {time.strftime('%H:%M:%S', time.localtime(usage.time))} "
+                                  f"(docker answered in {usage.read_time:.1f} s), data in {usage.root_directory}")
+
+        reclaimable = usage.reclaimable
+        parts = [
+            f"Images {format_size(usage.layers_size)} ({format_size(reclaimable['images'])} reclaimable)",
+            f"Containers {format_size(usage.containers_size)} ({format_size(reclaimable['containers'])} reclaimable)",
+            f"Volumes {format_size(usage.volumes_size)} ({format_size(reclaimable['volumes'])} reclaimable)",
+            f"Build cache {format_size(usage.build_cache_size)} "
+            f"({format_size(reclaimable['build cache'])} reclaimable)",
+        ]
+        self.summary_label.setText(f"Total {format_size(usage.total)}:    " + "    ".join(parts))
+
+        self.fill_table(self.images_table, [
+            [image.name, format_size(image.size), format_size(image.unique_size), str(image.containers),
+             ", ".join(image.releases) or "not in a release file"]
+            for image in usage.images
+        ], number_columns={1, 2, 3})
+        self.fill_table(self.containers_table, [
+            [container.name, container.image, container.state, format_size(container.size)]
+            for container in usage.containers
+        ], number_columns={3})
+        self.fill_table(self.volumes_table, [
+            [volume.name, format_size(volume.size) if volume.size >= 0 else "unknown", str(volume.containers)]
+            for volume in usage.volumes
+        ], number_columns={1, 2})
+        self.fill_table(self.build_cache_table, [
+            [entry.id[:12], entry.type, format_size(entry.size), "yes" if entry.in_use else "no",
+             entry.last_used[:19].replace("T", " ")]
+            for entry in usage.build_cache
+        ], number_columns={2})
@@ -0,0 +1,94 @@
+import os
+import time
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView
+
+from core.run_history import RunHistory, RECENT_RUNS
+
+SUMMARY_COLUMNS = ["Script", "Runs", "Failed", "Timeouts", "p50 (s)", "p90 (s)", "p99 (s)",
+                   f"Last {RECENT_RUNS} p50 (s)", "CPU (s)", "Max RSS (MB)"]
+RUN_COLUMNS = ["Started", "Arguments", "Exit code", "Ended by", "Wall (s)", "User (s)", "Sys (s)", "Max RSS (MB)"]
+
+
+class HistoryDialog(QDialog):
+    def __init__(self, history: RunHistory, parent=None):
+        super().__init__(parent, flags=Qt.Window)
+
+        self.history = history
+
+        self.setWindowTitle("Run history")
+        self.setMinimumSize(900, 600)
+
+        layout = QVBoxLayout(self)
+
+        layout.addWidget(QLabel("Wall time percentiles per script"))
+        self.summary_table = self.create_table(SUMMARY_COLUMNS)
+        self.summary_table.itemSelectionChanged.connect(self.show_selected_script_runs)
+        layout.addWidget(self.summary_table)
+
+        self.runs_label = QLabel("Select a script to see its runs")
+        layout.addWidget(self.runs_label)
+        self.runs_table = self.create_table(RUN_COLUMNS)
+        layout.addWidget(self.runs_table)
+
+        self.populate_summary()
+
+    @staticmethod
+    def create_table(columns):
+        table = QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setSelectionMode(QAbstractItemView.SingleSelection)
+        return table
+
+    @staticmethod
+    def fill_row(table, row, values):
+        for column, value in enumerate(values):
+            item = QTableWidgetItem(value)
+            if column > 0:
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            table.setItem(row, column, item)
+
+    def populate_summary(self):
+        summaries = self.history.summary()
+        self.summary_table.setRowCount(len(summaries))
+        for row, summary in enumerate(summaries):
+            self.fill_row(self.summary_table, row, [
+                os.path.basename(summary.script),
+                str(summary.runs),
+                str(summary.failures),
+                str(summary.timeouts),
+                f"{summary.p50:.1f}",
+                f"{summary.p90:.1f}",
+                f"{summary.p99:.1f}",
+                f"{summary.recent_p50:.1f}",
+                f"{summary.mean_cpu:.1f}",
+                f"{summary.max_rss / 1024:.0f}",
+            ])
+            # Keep the full path to query the runs of the script
+            self.summary_table.item(row, 0).setData(Qt.UserRole, summary.script)
+            self.summary_table.item(row, 0).setToolTip(summary.script)
+
+    def show_selected_script_runs(self):
+        items = self.summary_table.selectedItems()
+        if not items:
+            return
+        script = self.summary_table.item(items[0].row(), 0).data(Qt.UserRole)
+
+        runs = self.history.runs(script)
+        self.runs_label.setText(f"Last {len(runs)} runs of {script}")
+        self.runs_table.setRowCount(len(runs))
+        for row, run in enumerate(runs):
+            self.fill_row(self.runs_table, row, [
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run.start_time)),
+                " ".join(run.args),
+                str(run.exit_code),
+                run.termination,
+                f"{run.wall_time:.1f}",
+                f"{run.user_cpu:.1f}",
+                f"{run.sys_cpu:.1f}",
+                f"{run.max_rss / 1024:.0f}",
+            ])
@@ -0,0 +1,69 @@
+import os
+import time
+
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QLabel, QProgressBar, QPushButton
+
+from core.eta import Prediction, estimate_progress, format_duration
+
+
+class JobProgressWidget(QWidget):
+    stop_signal = pyqtSignal()
+
+    def __init__(self, script: str, prediction: Prediction, start_time: float = None, parent=None):
+        super(JobProgressWidget, self).__init__(parent)
+
+        self.prediction = prediction
+        # Jobs started before the window was opened keep their own start time
+        self.start_time = start_time if start_time is not None else time.time()
+
+        self.main_layout = QHBoxLayout()
+        self.main_layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(self.main_layout)
+
+        self.name_label = QLabel(os.path.basename(script))
+        self.main_layout.addWidget(self.name_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.main_layout.addWidget(self.progress_bar)
+
+        self.eta_label = QLabel()
+        self.main_layout.addWidget(self.eta_label)
+
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.clicked.connect(self.emit_stop)
+        self.main_layout.addWidget(self.stop_button)
+
+        if prediction is None:
+            # Never ran before: show a busy indicator and the elapsed time only
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, 100)
+            runs = f"{prediction.samples} runs" if prediction.same_arguments else \
+                f"{prediction.samples} runs with other arguments"
+            self.name_label.setToolTip(f"Usually takes {format_duration(prediction.p50)} "
+                                       f"(90% within {format_duration(prediction.p90)}, {runs})")
+
+        self.update_progress()
+
+    def emit_stop(self):
+        self.stop_button.setEnabled(False)
+        self.stop_button.setText("Stopping...")
+        self.stop_signal.emit()
+
+    def update_progress(self):
+        elapsed = time.time() - self.start_time
+
+        if self.prediction is None:
+            self.eta_label.setText(f"{format_duration(elapsed)} elapsed, no previous runs")
+            return
+
+        estimate = estimate_progress(self.prediction, elapsed)
+        self.progress_bar.setValue(int(estimate.fraction * 100))
+        if estimate.overdue:
+            self.eta_label.setText(f"{format_duration(elapsed)} elapsed, longer than usual "
+                                   f"(90% of runs take under {format_duration(self.prediction.p90)})")
+        else:
+            self.eta_label.setText(f"{format_duration(elapsed)} elapsed, ~{format_duration(estimate.remaining)} left "
+                                   f"(usually {format_duration(self.prediction.p50)})")
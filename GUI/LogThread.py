@@ -1,29 +1,63 @@
-import subprocess
-
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from core.daemon import DaemonClient, Subscription
+
 
 class LogThread(QThread):
+    # Follows the jobs run by the ToolBox daemon, and reconnects (starting it again if needed) when it goes away
+    jobs_updated = pyqtSignal(object)  # Every job known by the daemon, when (re)connected to it
+    job_started = pyqtSignal(object)
     log_updated = pyqtSignal(str)
+    job_finished = pyqtSignal(object)
 
-    def __init__(self, script_path):
+    def __init__(self, client: DaemonClient):
         super().__init__()
-        self.script_path = script_path
+        self.client = client
+        self.subscription: Subscription = None
+        self.running = True
+        # Number of lines of each job already shown, so reconnecting does not show them twice
+        self.lines_shown = {}
 
-    def run(self):
-        process = subprocess.Popen(
-            [self.script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=1,
-        )
-
-        while True:
-            line = process.stdout.readline()
-            if not line:
-                break
+    def stop(self):
+        self.running = False
+        if self.subscription is not None:
+            self.subscription.close()
 
+    def run(self):
+        connected_once = False
+        while self.running:
+            try:
+                self.subscription = self.client.subscribe()
+                for event in self.subscription.events():
+                    self.handle_event(event)
+            except OSError as e:
+                if not self.running:
+                    return
+                if connected_once:
+                    self.log_updated.emit(f"Lost the connection to the ToolBox daemon ({e}), reconnecting...")
+                self.sleep(1)
+            connected_once = True
+
+    def handle_event(self, event: dict):
+        if event["event"] == "snapshot":
+            for job in event["jobs"]:
+                # Only show the output of the jobs running now, or of the ones this window saw running
+                if job["running"] or job["id"] in self.lines_shown:
+                    self.show_lines(job["id"], job["first_line"], job["lines"])
+                if not job["running"] and self.lines_shown.pop(job["id"], None) is not None:
+                    self.job_finished.emit(job)
+            self.jobs_updated.emit(event["jobs"])
+        elif event["event"] == "started":
+            self.lines_shown[event["job"]["id"]] = 0
+            self.job_started.emit(event["job"])
+        elif event["event"] == "output":
+            self.show_lines(event["job"], event["line_number"], [event["line"]])
+        elif event["event"] == "finished":
+            self.lines_shown.pop(event["job"]["id"], None)
+            self.job_finished.emit(event["job"])
+
+    def show_lines(self, job_id: int, first_line: int, lines: list):
+        shown = self.lines_shown.get(job_id, 0)
+        for line in lines[max(0, shown - first_line):]:
             self.log_updated.emit(line)
-
-        process.communicate()
+        self.lines_shown[job_id] = max(shown, first_line + len(lines))
@@ -1,17 +1,31 @@
 import os
 import re
-import shutil
+import shlex
 import subprocess
 import sys
+import time
 
-from PyQt5.QtCore import Qt, QSize, QProcess, pyqtSlot
+from PyQt5.QtCore import Qt, QSize, pyqtSlot
 from PyQt5.QtGui import QPixmap, QMouseEvent, QIcon
 from PyQt5.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, \
     QScrollArea, QProgressBar, QInputDialog, QFileDialog, QApplication
 
+from GUI.DiskUsageDialog import DiskUsageDialog
+from GUI.DockerUsageDialog import DockerUsageDialog
+from GUI.HistoryDialog import HistoryDialog
+from GUI.JobProgressWidget import JobProgressWidget
+from GUI.LogThread import LogThread
 from GUI.side_panel_dialog import PopUpDialog
+from GUI.SnapshotPublisher import SnapshotPublisher
 from GUI.ScriptEditorWidget import ScriptEditorWidget
-from config import base_path, release_directory, disk_devices
+from config import base_path, clear_scripts, release_directory, disk_devices
+from core.catalog import script_command
+from core.daemon import DaemonClient, DaemonError
+from core.disk_forecast import format_time_to_full
+from core.disk_scanner import format_size
+from core.docker_usage import docker_disk
+from core.run_history import RunHistory
+from core.system_sampler import SystemSampler, SystemSnapshot
 
 
 class MainWindow(QMainWindow):
@@ -21,6 +35,12 @@ class MainWindow(QMainWindow):
         self.setMinimumSize(750, 850)
         self.setWindowIcon(QIcon("../resources/images/toolbox_icon.ico"))
 
+        # Every script run is recorded in the local run history (by the daemon running the jobs)
+        self.history = RunHistory()
+
+        # The jobs run in the ToolBox daemon: they keep running when the window is closed, and every window shows them
+        self.daemon_client = DaemonClient()
+
         # Create a central widget and layout
         central_widget = QWidget()
         layout = QVBoxLayout(central_widget)
@@ -105,6 +125,11 @@ class MainWindow(QMainWindow):
         self.log_label.setAlignment(Qt.AlignTop)
         self.scroll_area.setWidget(self.log_label)  # Use instance variable here
 
+        # Create a layout for the progress of the running jobs
+        self.jobs_layout = QVBoxLayout()
+        layout.addLayout(self.jobs_layout)
+        self.job_progress_widgets = {}
+
         self.script_widget = ScriptEditorWidget(self)
         self.script_widget.log_signal.connect(self.log)
         layout.addWidget(self.script_widget)
@@ -117,18 +142,29 @@ class MainWindow(QMainWindow):
         clear_button = QPushButton("Clear logs")
         clear_button.clicked.connect(self.clear_logs)
 
-        # Add both buttons to a horizontal layout
+        # Create a History button
+        history_button = QPushButton("History")
+        history_button.clicked.connect(self.show_history)
+
+        # Add the buttons to a horizontal layout
         buttons_layout = QHBoxLayout()
         buttons_layout.addWidget(copy_button)
         buttons_layout.addWidget(clear_button)
+        buttons_layout.addWidget(history_button)
 
         # Add the horizontal layout to the main layout
         layout.addLayout(buttons_layout)
 
+        # Create a label for the CPU, memory, load and containers of the machine
+        self.system_label = QLabel()
+        layout.addWidget(self.system_label)
+
         # Create progress bars and disk space labels as instance variables
         self.disk_labels = {}
         self.progress_bars = {}
         self.clear_buttons = {}  # Store clear buttons in a dictionary
+        self.io_labels = {}
+        self.forecast_labels = {}
         for index, device in enumerate(disk_devices.keys()):
             label = QLabel()
             layout.addWidget(label)
@@ -142,25 +178,60 @@ class MainWindow(QMainWindow):
             row_layout.addWidget(progress_bar)
             self.progress_bars[device] = progress_bar
 
+            # Create a label for the time left before the disk is full, at the rate it filled up lately
+            forecast_label = QLabel()
+            row_layout.addWidget(forecast_label)
+            self.forecast_labels[device] = forecast_label
+
             # Create a Clear button for each progress bar
             clear_button = QPushButton("Clear")
             clear_button.clicked.connect(lambda _, dev=device: self.trigger_clear_script(dev))
             row_layout.addWidget(clear_button)
             self.clear_buttons[device] = clear_button
 
+            # Create a Usage button showing what uses the space of the disk
+            usage_button = QPushButton("Usage")
+            usage_button.clicked.connect(lambda _, dev=device: self.show_disk_usage(dev))
+            row_layout.addWidget(usage_button)
+
+            if device == "system":
+                # Create a Docker button showing the space used by the images, containers, volumes and build cache
+                docker_button = QPushButton("Docker")
+                docker_button.clicked.connect(self.show_docker_usage)
+                row_layout.addWidget(docker_button)
+
             # Add the QHBoxLayout to the main layout
             layout.addLayout(row_layout)
 
+            # Create a label for the live throughput of the device
+            io_label = QLabel()
+            io_label.setStyleSheet("color: gray")
+            layout.addWidget(io_label)
+            self.io_labels[device] = io_label
+
         # Set the central widget
         self.setCentralWidget(central_widget)
 
-        # Update disk space labels
-        self.update_disk_space_labels()
-        self.timer = self.startTimer(10000)  # Update every 10 seconds
+        # Disks, memory, CPU and containers are read by a background thread, the window only shows its snapshots
+        self.sampler = SystemSampler()
+        self.snapshot_publisher = SnapshotPublisher(self.sampler, self)
+        self.snapshot_publisher.snapshot_updated.connect(self.show_snapshot)
+        self.sampler.start()
+
+        # Update the progress estimate of the running jobs every second
+        self.progress_timer = self.startTimer(1000)
 
         # Populate the release combo box
         self.populate_release_combo_box()
 
+        # Follow the jobs of the daemon, starting with the ones already running
+        self.log_thread = LogThread(self.daemon_client)
+        self.log_thread.log_updated.connect(self.log)
+        self.log_thread.jobs_updated.connect(self.update_jobs)
+        self.log_thread.job_started.connect(self.add_job)
+        self.log_thread.job_finished.connect(self.finish_job)
+        self.log_thread.start()
+
     def toggle_side_panel(self, event: QMouseEvent):
         # Show the side panel dialog when the info icon is clicked
         side_panel_dialog = PopUpDialog(self)
@@ -205,40 +276,24 @@ class MainWindow(QMainWindow):
         project_name = project_name[:project_name.rfind(".")]
         project_name = project_name.strip()
 
-        # Stop the existing containers using docker-compose
-        stop_command = f"docker-compose -f \"{os.path.join(release_directory, selected_file)}\" stop"
-
-        stop_process = QProcess()
-        stop_process.setProcessChannelMode(QProcess.MergedChannels)
-        stop_process.readyRead.connect(lambda: self.append_log(stop_process))
-
-        # Start the stop command in a subprocess
-        stop_process.start(stop_command)
-        stop_process.waitForFinished(-1)
-
-        # Clear unused containers
-        clear_containers = f"docker system prune -a -f"
-
-        stop_process = QProcess()
-        stop_process.setProcessChannelMode(QProcess.MergedChannels)
-        stop_process.readyRead.connect(lambda: self.append_log(stop_process))
-
-        # Start the stop command in a subprocess
-        stop_process.start(clear_containers)
-        stop_process.waitForFinished(-1)
-
-        # Run the selected file using docker-compose up -d
-        up_command = f"docker-compose -f \"{os.path.join(release_directory, selected_file)}\" -p \"{project_name}\" up -d"
-
-        up_process = QProcess()
-        up_process.setProcessChannelMode(QProcess.MergedChannels)
-        up_process.readyRead.connect(lambda: self.append_log(up_process))
-
-        # Start the up command in a subprocess
-        up_process.start(up_command)
-        up_process.waitForFinished(-1)
-
-    def trigger_script(self, script_path):
+        compose_file = os.path.join(release_directory, selected_file)
+        commands = [
+            # Stop the existing containers using docker-compose
+            f"docker-compose -f {shlex.quote(compose_file)} stop",
+            # Remove the images no recent release needs (the installed and the selected ones are kept), so a rollback
+            # does not have to pull them again, then the stopped containers and unused networks
+            f"{shlex.quote(sys.executable)} -m core.image_cache --pin {shlex.quote(compose_file)} evict",
+            "docker container prune -f",
+            "docker network prune -f",
+            # Run the selected file using docker-compose up -d
+            f"docker-compose -f {shlex.quote(compose_file)} -p {shlex.quote(project_name)} up -d",
+        ]
+
+        # Run the whole installation as a single background job, so its duration can be predicted
+        self.start_job(["bash", "-c", "\n".join(commands)], script="release install", args=[selected_file])
+
+    def trigger_script(self, script_path, args=None):
+        # args are the arguments of the script, one per element, never split again
         self.clear_logs()  # Clear the log label
 
         if "backup_database.sh" in script_path:
@@ -265,20 +320,9 @@ class MainWindow(QMainWindow):
                 script_content = script_content.replace("{DB_NAME}", database_name)
                 script_content = script_content.replace("{DESTINATION}", file_path)
 
-                # Use subprocess.Popen to execute the script and capture the output
-                process = subprocess.Popen(
-                    ["bash"],  # Use the bash shell to interpret the script content
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True
-                )
-
-                # Execute the script and capture the output
-                output, _ = process.communicate(input=script_content)
-
-                # Append the output to the log label
-                self.log(output)
+                # Use the bash shell to interpret the script content
+                self.start_job(["bash"], script=script_path, args=[database_name, file_path],
+                               stdin_data=script_content)
         elif "update_database.sh" in script_path:
             # Show a file dialog for the user to select the origin file
             options = QFileDialog.Options()
@@ -301,41 +345,68 @@ class MainWindow(QMainWindow):
             script_content = script_content.replace("{ORIGIN}", origin_file)
             script_content = script_content.replace("{DB_NAME}", database_name)
 
-            # Use subprocess.Popen to execute the script and capture the output
-            process = subprocess.Popen(
-                ["bash"],  # Use the bash shell to interpret the script content
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True
-            )
+            # Use the bash shell to interpret the script content
+            self.start_job(["bash"], script=script_path, args=[origin_file, database_name],
+                           stdin_data=script_content)
+        else:
+            args = args if args is not None else []
 
-            # Execute the script and capture the output
-            output, _ = process.communicate(input=script_content)
+            # Start the script (or pipeline of scripts) in a background job
+            self.start_job(script_command(script_path, args), script=script_path, args=args)
 
-            # Append the output to the log label
-            self.log(output)
-        else:
-            # Use QProcess for other scripts
-            process = QProcess()
+    def start_job(self, argv, script=None, args=None, stdin_data=None):
+        # The progress of the job is shown when the daemon announces it, in every window
+        try:
+            self.daemon_client.start_job(argv, script=script, args=args, stdin_data=stdin_data)
+        except (OSError, DaemonError) as e:
+            self.log(f"Cannot start {script or argv[0]}: {e}")
 
-            # Connect process signals for log updates
-            process.setProcessChannelMode(QProcess.MergedChannels)
-            process.readyRead.connect(lambda: self.append_log(process))
-            process.finished.connect(lambda exit_code, exit_status: process.deleteLater())
+    def stop_job(self, job_id):
+        try:
+            self.daemon_client.stop_job(job_id)
+        except (OSError, DaemonError) as e:
+            self.log(f"Cannot stop the job: {e}")
 
-            # Start the shell script in a subprocess
-            if script_path.split(" ")[0].endswith(".py"):
-                process.start(f'"{sys.executable}" {script_path}')
-            else:
-                assert script_path.split(" ")[0].endswith(".sh")
-                # it's a bash script
-                process.start(script_path)
+    @pyqtSlot(object)
+    def add_job(self, job):
+        if job["id"] in self.job_progress_widgets:
+            return
 
-    def append_log(self, process):
-        # Read the available data from the subprocess
-        output = process.readAll().data().decode("utf-8")
-        self.log(output)
+        # Show the predicted duration and the live progress of the job
+        prediction = self.history.predict(job["script"], job["args"])
+        progress_widget = JobProgressWidget(job["script"], prediction, start_time=job["start_time"])
+        progress_widget.stop_signal.connect(lambda: self.stop_job(job["id"]))
+        self.jobs_layout.addWidget(progress_widget)
+        self.job_progress_widgets[job["id"]] = progress_widget
+
+    @pyqtSlot(object)
+    def update_jobs(self, jobs):
+        # (Re)connected to the daemon: show the jobs running now, drop the ones that ended in the meantime
+        running = {job["id"]: job for job in jobs if job["running"]}
+        for job_id in list(self.job_progress_widgets):
+            if job_id not in running:
+                self.remove_job_progress(job_id)
+        for job in running.values():
+            self.add_job(job)
+
+    @pyqtSlot(object)
+    def finish_job(self, job):
+        self.remove_job_progress(job["id"])
+
+    def remove_job_progress(self, job_id):
+        progress_widget = self.job_progress_widgets.pop(job_id, None)
+        if progress_widget is None:
+            return
+        self.jobs_layout.removeWidget(progress_widget)
+        progress_widget.setParent(None)
+        progress_widget.deleteLater()
+
+    def closeEvent(self, event):
+        # The jobs keep running in the daemon, only stop following them
+        self.sampler.stop()
+        self.log_thread.stop()
+        self.log_thread.wait()
+        super().closeEvent(event)
 
     @pyqtSlot(str)
     def log(self, message):
@@ -346,6 +417,20 @@ class MainWindow(QMainWindow):
         scroll_bar = self.scroll_area.verticalScrollBar()
         scroll_bar.setValue(scroll_bar.maximum())
 
+    def show_disk_usage(self, device):
+        disk_usage_dialog = DiskUsageDialog(device, disk_devices[device], self)
+        disk_usage_dialog.exec_()
+
+    def show_docker_usage(self):
+        docker_usage_dialog = DockerUsageDialog(self.sampler.docker_usage, self.sampler.latest(), self)
+        self.snapshot_publisher.snapshot_updated.connect(docker_usage_dialog.show_snapshot)
+        docker_usage_dialog.exec_()
+        self.snapshot_publisher.snapshot_updated.disconnect(docker_usage_dialog.show_snapshot)
+
+    def show_history(self):
+        history_dialog = HistoryDialog(self.history, self)
+        history_dialog.exec_()
+
     def copy_to_clipboard(self):
         # Copy the content of the log label to the clipboard
         clipboard = QApplication.clipboard()
@@ -355,41 +440,89 @@ class MainWindow(QMainWindow):
         # Clear the log label
         self.log_label.setText("")
 
-    def update_disk_space_labels(self):
-        for device, label in self.disk_labels.items():
-            # Get the mount point for the device
-            mount_point = disk_devices[device]
-
-            if os.path.exists(mount_point):
-                # Get disk usage information for the device
-                disk_usage = shutil.disk_usage(mount_point)
-                total_space = disk_usage.total // (1024 ** 3)  # Convert to gigabytes
-                available_space = disk_usage.free // (1024 ** 3)  # Convert to gigabytes
+    @pyqtSlot(object)
+    def show_snapshot(self, snapshot: SystemSnapshot):
+        # Show how much of its disk docker uses, it is usually what fills the system disk
+        docker_device = docker_disk(snapshot.docker_usage) if snapshot.docker_usage is not None else None
+        for disk in snapshot.disks:
+            label = self.disk_labels[disk.device]
+            if not disk.responding:
+                # Keep the last values read, the mount point may come back
+                since = f" since {time.strftime('%H:%M:%S', time.localtime(disk.sample_time))}" \
+                    if disk.sample_time else ""
+                label.setText(f"{disk.device.capitalize()}: not responding{since}")
+                label.setStyleSheet("color: red")
+                continue
+            label.setStyleSheet("")
+
+            if disk.mounted:
+                total_space = disk.total // (1024 ** 3)  # Convert to gigabytes
+                available_space = disk.free // (1024 ** 3)  # Convert to gigabytes
 
                 # Update the label with disk space information
-                label.setText(f"{device.capitalize()}: {available_space} GB / {total_space} GB")
+                text = f"{disk.device.capitalize()}: {available_space} GB / {total_space} GB"
+                if disk.device == docker_device:
+                    text += f" (docker uses {format_size(snapshot.docker_usage.total)}, " \
+                            f"{format_size(sum(snapshot.docker_usage.reclaimable.values()))} reclaimable)"
+                label.setText(text)
 
                 # Update the progress bar value
-                progress_bar = self.progress_bars[device]
-                progress_bar.setValue(int((disk_usage.used / disk_usage.total) * 100))
+                self.progress_bars[disk.device].setValue(int(disk.used_fraction * 100))
             else:
                 # Mount point does not exist
-                label.setText(f"{device.capitalize()}: Not mounted")
+                label.setText(f"{disk.device.capitalize()}: Not mounted")
+
+        forecasts = {forecast.device: forecast for forecast in snapshot.forecasts}
+        for device, forecast_label in self.forecast_labels.items():
+            forecast = forecasts.get(device)
+            if forecast is None or forecast.growth_rate is None:
+                # Not mounted, not responding, or not enough samples since the last cleanup
+                forecast_label.setText("")
+            elif forecast.time_to_full is None:
+                forecast_label.setText("stable")
+                forecast_label.setStyleSheet("color: gray")
+            else:
+                forecast_label.setText(f"full in ~{format_time_to_full(forecast.time_to_full)}")
+                forecast_label.setStyleSheet("color: red" if forecast.time_to_full < 3600 else "")
+
+        disk_io = {sample.device: sample for sample in snapshot.disk_io}
+        for device, io_label in self.io_labels.items():
+            sample = disk_io.get(device)
+            if sample is None:
+                io_label.setText("")
+                continue
+            read_speed = sample.read_bytes_per_second / 1024 ** 2
+            write_speed = sample.write_bytes_per_second / 1024 ** 2
+            io_label.setText(f"{sample.block_device}: read {read_speed:.1f} MB/s ({sample.read_iops:.0f} IOPS), "
+                             f"write {write_speed:.1f} MB/s ({sample.write_iops:.0f} IOPS), "
+                             f"await {sample.await_ms:.1f} ms, busy {sample.utilization * 100:.0f}%")
+            # A device busy all the time is saturated: the jobs using it wait for it
+            io_label.setStyleSheet("color: red" if sample.utilization > 0.9 else "color: gray")
+
+        parts = []
+        if snapshot.cpu_percent is not None:
+            parts.append(f"CPU {snapshot.cpu_percent:.0f}%")
+        if snapshot.memory is not None:
+            used_memory = (snapshot.memory.total - snapshot.memory.available) / 1024 ** 3
+            parts.append(f"Memory {used_memory:.1f} / {snapshot.memory.total / 1024 ** 3:.1f} GB")
+        if snapshot.load is not None:
+            parts.append("Load " + " ".join(f"{load:.2f}" for load in snapshot.load))
+        if snapshot.containers is not None:
+            running = sum(1 for container in snapshot.containers if container.state == "running")
+            parts.append(f"Containers {running} / {len(snapshot.containers)} running")
+        elif "containers" in snapshot.errors:
+            parts.append("Containers: docker not responding")
+        self.system_label.setText("    ".join(parts))
 
     def timerEvent(self, event):
-        if event.timerId() == self.timer:
-            self.update_disk_space_labels()
+        if event.timerId() == self.progress_timer:
+            for progress_widget in self.job_progress_widgets.values():
+                progress_widget.update_progress()
         else:
             super().timerEvent(event)
 
     def trigger_clear_script(self, device):
-        # Implement the action for the "Clear" button for each progress bar here
-        if device == "system":
-            script_path = os.path.join(base_path, "../scripts/clear_disks/clear_system.sh")
-            self.trigger_script(script_path)
-        elif device == "ramdisk":
-            script_path = os.path.join(base_path, "../scripts/clear_disks/clear_ramdisk.sh")
-            self.trigger_script(script_path)
-        elif device == "backup":
-            script_path = os.path.join(base_path, "../scripts/clear_disks/clear_backup.sh")
+        # Action of the "Clear" button of each progress bar, the same cleaner the daemon runs by itself
+        if device in clear_scripts:
+            script_path = os.path.join(base_path, clear_scripts[device])
             self.trigger_script(script_path)
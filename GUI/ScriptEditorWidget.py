@@ -1,20 +1,21 @@
-import re
-import subprocess
-import sys
-from dataclasses import dataclass
+import shlex
 from enum import Enum
-from pathlib import Path
-from typing import List, Optional, Union
+from typing import List
 
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt
 from PyQt5.QtWidgets import QWidget, QPushButton, QLineEdit, QHBoxLayout, QVBoxLayout, QSizePolicy, QLabel, QToolTip
 
-
-class ArgumentType(Enum):
-    UNKNOWN = 0
-    REQUIRED_WITH_VALUE = 1
-    OPTIONAL = 2
-    OPTIONAL_WITH_VALUE = 3
+from core.catalog import (
+    Argument,
+    ArgumentType,
+    Folder,
+    OrArgumentGroup,
+    RequiredArgumentGroup,
+    Script,
+    read_python_scripts,
+    read_shell_scripts,
+    validate_arguments,
+)
 
 
 class ArgumentStatus(Enum):
@@ -24,198 +25,6 @@ class ArgumentStatus(Enum):
     NOT_AVAILABLE = 4
 
 
-@dataclass
-class Argument:
-    name: str
-    name_repr: str = None
-    argument_type: ArgumentType = None
-    value_name: str = None
-    default_value: str = None
-    description: str = None
-
-    def __post_init__(self):
-        self.parse_name()
-
-    def parse_name(self):
-        if re.match(r"\[.* .*\]", self.name):
-            self.argument_type = ArgumentType.OPTIONAL_WITH_VALUE
-            self.name_repr = self.name[1:-1].split(" ")[0]
-        elif re.match(r"\[.*\]", self.name):
-            self.argument_type = ArgumentType.OPTIONAL
-            self.name_repr = self.name[1:-1]
-        elif re.match(r".* .*", self.name):
-            self.argument_type = ArgumentType.REQUIRED_WITH_VALUE
-            self.name_repr = self.name.split(" ")[0]
-        else:
-            self.argument_type = ArgumentType.UNKNOWN
-            self.name_repr = self.name
-
-    def __repr__(self):
-        return f"Argument({self.name} {self.value_name}={self.default_value}, {self.argument_type} ({self.description[:20]}...)"
-
-
-@dataclass
-class RequiredArgumentGroup:
-    arguments: List[Argument]
-
-    def __repr__(self):
-        return f"RequiredArgumentGroup({self.arguments})"
-
-
-@dataclass
-class OrArgumentGroup:
-    arguments: List[RequiredArgumentGroup]
-
-    def __init__(self, arguments: List[RequiredArgumentGroup], fix_first_argument: bool = False):
-        if fix_first_argument:
-            # Wrap the first argument in a RequiredArgumentGroup
-            arguments[0] = RequiredArgumentGroup([arguments[0]])
-        self.arguments = arguments
-
-    def __repr__(self):
-        return f"OrArgumentGroup({self.arguments})"
-
-
-def split_arguments(description: str) -> List[Argument | OrArgumentGroup]:
-    # Split the description into individual arguments
-    arguments = []
-    current_char = 0
-
-    while current_char < len(description):
-        if description[current_char] == "[":
-            # Start of optional argument
-            j = current_char + 1
-            while description[j] != "]":
-                j += 1
-            arguments.append(Argument(description[current_char : j + 1]))
-            current_char = j + 1
-
-        elif description[current_char] == "(":
-            # Start of required argument
-            j = current_char + 1
-            while description[j] != ")":
-                j += 1
-            arguments.append(OrArgumentGroup(split_arguments(description[current_char + 1 : j]), fix_first_argument=True))
-            current_char = j + 1
-
-        elif description[current_char] == "|":
-            # Start of alternative argument
-            j = current_char + 1
-            while j < len(description) and description[j] != "|":
-                j += 1
-            arguments.append(RequiredArgumentGroup(split_arguments(description[current_char + 1 : j + 1])))
-            current_char = j + 1
-
-        elif description[current_char] == " ":
-            # Skip whitespace
-            current_char += 1
-
-        elif description[current_char] == "-":
-            # Start of required argument
-            j = current_char + 1
-            while description[j] not in [" ", "]", ")", "|"]:
-                j += 1
-            # print("name:" + description[current_char:j])
-
-            if description[j + 1] in ["]", ")", "|"]:
-                # Argument has no value
-                # print("has no value")
-                pass
-            else:
-                # Argument has a value
-                j += 1  # Skip whitespace
-                start_of_value = j
-                while description[j] not in [" ", "]", ")", "|"]:
-                    j += 1
-                # print("value:" + description[start_of_value:j])
-
-            arguments.append(Argument(description[current_char:j]))
-            current_char = j + 1
-        else:
-            # Invalid character
-            raise ValueError("Invalid character in description: " + description[current_char])
-    return arguments
-
-
-def read_description_of_arguments(
-    command_arguments: List[Union[Argument, OrArgumentGroup]], description: list[str]
-) -> List[Union[Argument, OrArgumentGroup]]:
-
-    description = map(lambda x: x.strip(), description)
-    fixed_arguments = []
-
-    for argument in description:
-        if not argument.startswith("-"):
-            # Argument does not start with a dash, so it belongs to the previous argument
-            fixed_arguments[-1] += "  " + argument
-        else:
-            fixed_arguments.append(argument)
-
-    def extract_argument_properties(argument: str) -> Argument:
-        # Split fixed arguments into: name, value name, description, default value
-
-        name = argument.split("  ")[0]
-        value_name = None
-        # if a comma is found, pick the first part as the name
-        if "," in name:
-            name = name.split(",", 1)[0]
-        if " " in name:
-            name, value_name = name.split(" ")
-
-        description = argument.rsplit("  ", 1)[1]
-        default_value = None
-        if description[-1] == ")":
-            default_value = description.split("(default: ")[1].split(")")[0]
-            description = description.split("(default: ")[0]
-
-        return Argument(name=name, value_name=value_name, default_value=default_value, description=description)
-
-    fixed_arguments = list(map(extract_argument_properties, fixed_arguments))
-
-    def find_corresponding_argument(argument: Argument, argument_list: List[Argument]) -> Argument:
-        for arg in argument_list:
-            if arg.name_repr == argument.name_repr:
-                return arg
-
-        raise ValueError(f"Argument not found: {argument} in {argument_list}")
-
-    arguments_with_description = []
-    for argument in command_arguments:
-        if isinstance(argument, Argument):
-            argument_with_description = find_corresponding_argument(argument, fixed_arguments)
-            argument_with_description.argument_type = argument.argument_type
-            arguments_with_description.append(argument_with_description)
-        elif isinstance(argument, OrArgumentGroup):
-            required_groups = []
-            for required_argument_group in argument.arguments:
-                arguments = []
-                for arg in required_argument_group.arguments:
-                    argument_with_description = find_corresponding_argument(arg, fixed_arguments)
-                    argument_with_description.argument_type = arg.argument_type
-                    arguments.append(argument_with_description)
-                required_groups.append(RequiredArgumentGroup(arguments))
-            arguments_with_description.append(OrArgumentGroup(required_groups))
-        else:
-            raise ValueError("Invalid argument type")
-
-    return arguments_with_description
-
-
-@dataclass
-class Script:
-    name: str
-    path: Path
-    version: str
-    author: str
-    args: List[Argument]
-
-
-@dataclass
-class Folder:
-    name: str
-    scripts: List[Script]
-
-
 class DisplayArgumentOptionWidget(QPushButton):
     add_signal = pyqtSignal(QPushButton)
 
@@ -356,10 +165,11 @@ class ArgumentWidget(QWidget):
     def emit_delete(self):
         self.delete_signal.emit(self)
 
-    def get_command(self):
+    def get_command(self) -> List[str]:
+        # One argv element per argument: the value is passed as is, spaces included
         if self.argument.argument_type in (ArgumentType.REQUIRED_WITH_VALUE, ArgumentType.OPTIONAL_WITH_VALUE):
-            return self.argument.name_repr + "=" + self.input_widget.text()
-        return self.argument.name_repr
+            return [self.argument.name_repr + "=" + self.input_widget.text()]
+        return [self.argument.name_repr]
 
 
 class ScriptWidget(QWidget):
@@ -411,8 +221,8 @@ class ScriptEditorWidget(QWidget):
         super(ScriptEditorWidget, self).__init__(main_window)
         self.main_window = main_window
 
-        self.python_scripts: List[Script] = self.read_python_scripts()
-        self.shell_scripts: List[Folder] = self.read_shell_scripts()
+        self.python_scripts: List[Script] = read_python_scripts()
+        self.shell_scripts: List[Folder] = read_shell_scripts()
 
         self.selected_script: Script = None
 
@@ -581,67 +391,20 @@ class ScriptEditorWidget(QWidget):
                 widgets.append(widget)
         return widgets
 
-    def read_python_scripts(self) -> List[Script]:
-        # Get all .py files inside the scripts folder
-        python_scripts = Path("scripts").glob("*.py")
-        return [self.read_python_script(script) for script in python_scripts]
-
-    def read_shell_scripts(self) -> List[Folder]:
-        # Get all folders inside the scripts folder
-        subdirectories = [folder for folder in Path("scripts").iterdir() if folder.is_dir()]
-        folders = []
-        for folder in subdirectories:
-            shell_scripts = Path(folder).glob("*.sh")
-            folder_scripts = [self.read_shell_script(script) for script in shell_scripts]
-            folders.append(Folder(folder.name, folder_scripts))
-        return folders
-
-    @staticmethod
-    def read_shell_script(script: Path) -> Script:
-        # TODO: add documentation to shell scripts ?
-        return Script(
-            name=script.stem,
-            path=script,
-            version="",
-            author="",
-            args=[],
-        )
-
-    @staticmethod
-    def read_python_script(script: Path) -> Script:
-        # Get the output of the script's usage
-        command = f'"{sys.executable}" {script} --help'
-        lines = subprocess.check_output(command, shell=True, text=True).splitlines()
-
-        # Get the script name, which is before the version
-        name = lines[2].split("(")[0].strip()
-
-        # Get the script version, which is in the third line between parentheses
-        version = lines[2].split("(")[1].split(")")[0].strip()
-
-        # Get the script author, which is in the third line after the version
-        author = lines[2].split("maintained by")[1].strip()
-
-        usage = lines[0].split(".py")[1].strip()
-        i = 6
-        while lines[i]:
-            i += 1
-
-        args = split_arguments(usage)
-        args = read_description_of_arguments(args, lines[6:i])
-        return Script(name, script, version, author, args)
-
     def run_script(self):
-        command = f"{self.selected_script.path.absolute()} "
+        script_path = str(self.selected_script.path.absolute())
+        args = [part for widget in self.get_selected_arguments() for part in widget.get_command()]
 
-        for i in range(self.command_parts_layout.count()):
-            widget = self.command_parts_layout.itemAt(i).widget()
-            if isinstance(widget, ArgumentWidget):
-                command += widget.get_command() + " "
+        # Refuse what the script would refuse, before starting anything
+        errors = validate_arguments(self.selected_script, args)
+        if errors:
+            for error in errors:
+                self.log_signal.emit(f"{self.selected_script.name}: {error}")
+            return
 
-        print(f"Running {command}")
+        print(f"Running {shlex.join([script_path] + args)}")
 
-        self.main_window.trigger_script(command)
+        self.main_window.trigger_script(script_path, args)
 
     @pyqtSlot(DisplayScriptOptionWidget)
     def add_script(self, widget: DisplayScriptOptionWidget):
@@ -0,0 +1,12 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.system_sampler import SystemSampler
+
+
+class SnapshotPublisher(QObject):
+    # Brings the snapshots of the sampler thread to the GUI thread (the signal is queued across threads)
+    snapshot_updated = pyqtSignal(object)
+
+    def __init__(self, sampler: SystemSampler, parent=None):
+        super().__init__(parent)
+        sampler.subscribe(self.snapshot_updated.emit)
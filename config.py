@@ -14,3 +14,123 @@ base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
 
 # Define the release directory path
 release_directory = "/home/delvitech/work/sapiens-docker-compose/"
+
+# Maximum number of containers the maintenance engine restarts at the same time
+maintenance_max_workers = 4
+
+# Seconds to wait for a restarted container to become healthy before reporting it as failed
+maintenance_health_timeout = 120
+
+# Local directory where the ToolBox keeps its own data (run history, caches, ...)
+data_directory = os.path.expanduser("~/.toolbox")
+
+# SQLite database recording every script run launched from the ToolBox
+history_database = os.path.join(data_directory, "history.sqlite3")
+
+# Maximum number of pipeline steps running at the same time
+pipeline_max_workers = 4
+
+# Directory where every pipeline run keeps the output and artifacts of its steps
+pipeline_runs_directory = os.path.join(data_directory, "pipelines")
+
+# Seconds after which a job is stopped, by script file name; other jobs get default_job_timeout (None: no limit)
+job_timeouts = {
+    "release install": 30 * 60,
+    "backup_script.sh": 6 * 60 * 60,
+    "backup_database.sh": 2 * 60 * 60,
+    "update_database.sh": 2 * 60 * 60,
+    "line_recovery.json": 60 * 60,
+    "run_inspection.py": None,
+}
+default_job_timeout = 15 * 60
+
+# Seconds a stopped job gets to exit after SIGTERM before its processes are killed
+job_stop_grace_period = 10
+
+# Cache of the --help output of the python scripts, used to build the script catalog without running them
+catalog_cache = os.path.join(data_directory, "catalog_cache.json")
+
+# Unix socket of the ToolBox daemon, which runs the jobs for every ToolBox window and the command line
+daemon_socket = os.path.join(data_directory, "daemon.sock")
+
+# Lines of output the daemon keeps per job, sent to the windows opened while it runs
+daemon_log_lines = 5000
+
+# Number of finished jobs the daemon keeps (with their output) for the windows reconnecting to it
+daemon_finished_jobs = 20
+
+# Python interpreters the daemon keeps started, with the modules of the scripts already imported, to run python scripts
+worker_pool_size = 2
+
+# Modules imported by the waiting interpreters (the missing ones are skipped)
+worker_preload_modules = ["argparse", "json", "subprocess", "threading", "re", "requests", "matplotlib",
+                          "matplotlib.pyplot"]
+
+# Seconds between two samples of each kind of system data shown in the ToolBox
+sampler_intervals = {
+    "disks": 10,
+    "disk_io": 2,
+    "memory": 2,
+    "cpu": 2,
+    "load": 5,
+    "containers": 10,
+    "docker_usage": 10,
+}
+
+# Seconds before a mount point (or docker) that does not answer is shown as not responding
+sampler_timeout = 2
+
+# Threads listing directories at the same time when looking for what uses the space of a disk
+disk_scan_workers = 8
+
+# Size of the directories already scanned, by disk, so the next scans only list the directories that changed
+disk_scan_cache_directory = os.path.join(data_directory, "disk_scans")
+
+# Disk usage kept for the time-to-full forecast: one sample per interval (seconds), the last disk_forecast_samples
+disk_forecast_interval = 60
+disk_forecast_samples = 24 * 60
+disk_forecast_directory = os.path.join(data_directory, "disk_forecast")
+
+# Minutes over which the growth rate of a disk is averaged (older samples weigh exponentially less)
+disk_forecast_time_constant = 30
+
+# Cleaner of each disk, relative to the ToolBox directory (the "Clear" buttons and the automatic cleaning)
+clear_scripts = {
+    "system": "scripts/clear_disks/clear_system.sh",
+    "ramdisk": "scripts/clear_disks/clear_ramdisk.sh",
+    "backup": "scripts/clear_disks/clear_backup.sh",
+}
+
+# Disks the daemon cleans by itself: their cleaner runs when the used fraction goes over "high", and again (at most
+# every "min_interval" seconds) until it is under "low". With "evict", the oldest files are deleted down to "low"
+# instead (core.disk_eviction), keeping the recent acquisitions. The system disk is left out: its cleaner removes docker
+# images.
+autoclean_policies = {
+    "ramdisk": {"high": 0.85, "low": 0.60, "min_interval": 10 * 60, "evict": True},
+}
+
+# Seconds between two checks of the disks with an autoclean policy
+autoclean_interval = 10
+
+# Threads listing and deleting directories at the same time when cleaning a disk (core.disk_cleaner)
+disk_clean_workers = 8
+
+# Index of the files of each disk by last use, so an eviction only lists the folders that changed since the previous one
+disk_eviction_directory = os.path.join(data_directory, "disk_eviction")
+
+# Entries the eviction never deletes, by disk (patterns of core.disk_cleaner)
+eviction_excludes = {
+    "ramdisk": ["/background"],
+}
+
+# Unix socket of the Docker Engine API
+docker_socket = "/var/run/docker.sock"
+
+# Recent release compose files (in release_directory) whose images are kept when docker images are evicted, on top of
+# the ones of the installed release
+image_cache_keep_releases = 3
+
+# Seconds the disk usage of docker (GET /system/df) is kept before it is read again in the background, and seconds it
+# may take: docker computes it from every layer and volume
+docker_usage_ttl = 5 * 60
+docker_usage_timeout = 120
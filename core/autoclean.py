@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import (
+    autoclean_interval,
+    autoclean_policies,
+    clear_scripts,
+    disk_devices,
+    eviction_excludes,
+    history_database,
+)
+from core.catalog import script_command
+from core.jobs import JobResult
+from core.system_sampler import DiskSample, MountProbe
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS autoclean_actions (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    script TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    duration REAL NOT NULL,
+    total INTEGER NOT NULL,
+    used_before INTEGER NOT NULL,
+    used_after INTEGER NOT NULL,
+    exit_code INTEGER NOT NULL,
+    termination TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS autoclean_actions_by_device ON autoclean_actions (device, start_time);
+"""
+
+
+@dataclass(frozen=True)
+class AutocleanPolicy:
+    high: float  # Used fraction of the disk starting a cleaning
+    low: float  # Used fraction under which the cleaning is over
+    min_interval: float  # Seconds between the starts of two cleanings of the disk
+    evict: bool = False  # Delete the oldest files down to the low-water mark instead of running the cleaner
+
+
+@dataclass(frozen=True)
+class AutocleanAction:
+    device: str
+    script: str
+    start_time: float
+    duration: float  # Seconds
+    total: int  # Bytes
+    used_before: int
+    used_after: int
+    exit_code: int
+    termination: str  # As JobResult.termination
+
+    @property
+    def bytes_freed(self) -> int:
+        # Negative when the disk filled up faster than it was cleaned
+        return self.used_before - self.used_after
+
+
+def load_policies(policies: Dict[str, dict] = None) -> Dict[str, AutocleanPolicy]:
+    policies = autoclean_policies if policies is None else policies
+    loaded = {}
+    for device, values in policies.items():
+        policy = AutocleanPolicy(**values)
+        if device not in disk_devices or (device not in clear_scripts and not policy.evict):
+            raise ValueError(f"autoclean policy for {device}: no such disk or no cleaner for it")
+        if not 0 < policy.low < policy.high <= 1:
+            raise ValueError(f"autoclean policy for {device}: expected 0 < low < high <= 1")
+        loaded[device] = policy
+    return loaded
+
+
+class AutocleanHistory:
+    # Cleanings started by the policy engine, in the database of the run history
+    def __init__(self, path: str = history_database):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection:
+            with connection:
+                yield connection
+
+    def record(self, action: AutocleanAction):
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO autoclean_actions (device, script, start_time, duration, total, used_before, used_after, "
+                "exit_code, termination) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (action.device, action.script, action.start_time, action.duration, action.total, action.used_before,
+                 action.used_after, action.exit_code, action.termination),
+            )
+
+    def actions(self, device: Optional[str] = None, limit: int = 100) -> List[AutocleanAction]:
+        # Most recent first
+        query = ("SELECT device, script, start_time, duration, total, used_before, used_after, exit_code, termination "
+                 "FROM autoclean_actions")
+        parameters = ()
+        if device is not None:
+            query += " WHERE device = ?"
+            parameters = (device,)
+        query += " ORDER BY start_time DESC LIMIT ?"
+
+        with self.connect() as connection:
+            rows = connection.execute(query, parameters + (limit,)).fetchall()
+        return [AutocleanAction(*row) for row in rows]
+
+
+class DiskCleaning:
+    # A cleaning in progress: from the disk going over its high-water mark to it going under its low-water mark,
+    # possibly running the cleaner several times
+    def __init__(self, device: str):
+        self.device = device
+        self.daemon_job = None  # Cleaner running, if any
+        self.used_before: Optional[DiskSample] = None
+        self.last_start = 0.0  # time.monotonic() of the last cleaner started
+
+
+class AutoCleaner:
+    # Runs in the daemon: checks the disks with a policy every autoclean_interval seconds and runs their cleaner (or
+    # evicts their oldest files) as a job of the daemon, shown in every window, when they go over the high-water mark.
+    # Hysteresis: once started, the cleaner is run again (at most every min_interval seconds) until the disk is under
+    # the low-water mark, then nothing happens until it goes over the high-water mark again.
+    def __init__(self, daemon, policies: Dict[str, AutocleanPolicy] = None, interval: float = autoclean_interval,
+                 history: Optional[AutocleanHistory] = None):
+        self.daemon = daemon
+        self.policies = load_policies() if policies is None else policies
+        self.interval = interval
+        self.history = AutocleanHistory() if history is None else history
+        self.probes = {device: MountProbe(device, disk_devices[device]) for device in self.policies}
+        self.cleanings: Dict[str, DiskCleaning] = {}
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.policies:
+            self.thread = threading.Thread(target=self.run, name="autoclean", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def read_disk(self, device: str) -> Optional[DiskSample]:
+        probe = self.probes[device]
+        probe.start()
+        sample = probe.result(time.monotonic() + self.interval)
+        # A disk that is not mounted or does not answer is not cleaned
+        return sample if sample.mounted and sample.responding else None
+
+    def check(self, device: str):
+        policy = self.policies[device]
+        cleaning = self.cleanings.get(device)
+        if cleaning is not None and cleaning.daemon_job is not None:
+            if cleaning.daemon_job.running:
+                return
+            self.finish_cleaning(cleaning)
+
+        disk = self.read_disk(device)
+        if disk is None:
+            return
+        if cleaning is None:
+            if disk.used_fraction < policy.high:
+                return
+            cleaning = self.cleanings[device] = DiskCleaning(device)
+        elif disk.used_fraction <= policy.low:
+            print(f"Autoclean: {device} at {disk.used_fraction:.0%}, under its low-water mark", flush=True)
+            del self.cleanings[device]
+            return
+
+        # Rate limit: a cleaner that cannot free enough is not run over and over
+        if cleaning.last_start and time.monotonic() - cleaning.last_start < policy.min_interval:
+            return
+        self.start_cleaner(cleaning, disk)
+
+    def start_cleaner(self, cleaning: DiskCleaning, disk: DiskSample):
+        device = cleaning.device
+        if self.policies[device].evict:
+            script = "core/disk_eviction.py"
+            args = [disk_devices[device], "--budget", f"{self.policies[device].low:.0%}"]
+            for pattern in eviction_excludes.get(device, []):
+                args += ["--exclude", pattern]
+            argv = [sys.executable, "-m", "core.disk_eviction"] + args
+        else:
+            script, args = clear_scripts[device], []
+            argv = script_command(script, args)
+
+        print(f"Autoclean: {device} at {disk.used_fraction:.0%}, running {' '.join(argv)}", flush=True)
+        cleaning.used_before = disk
+        cleaning.last_start = time.monotonic()
+        cleaning.daemon_job = self.daemon.start_job(argv, script=script, args=args, stdin_data=None)
+
+    def finish_cleaning(self, cleaning: DiskCleaning):
+        result: Optional[JobResult] = cleaning.daemon_job.result
+        cleaning.daemon_job = None
+        if result is None:
+            print(f"Autoclean: the cleaner of {cleaning.device} failed to start", flush=True)
+            return
+
+        after = self.read_disk(cleaning.device) or cleaning.used_before
+        action = AutocleanAction(
+            device=cleaning.device,
+            script=result.script,
+            start_time=result.start_time,
+            duration=result.wall_time,
+            total=after.total,
+            used_before=cleaning.used_before.used,
+            used_after=after.used,
+            exit_code=result.exit_code,
+            termination=result.termination,
+        )
+        self.history.record(action)
+        print(f"Autoclean: {cleaning.device} cleaned in {action.duration:.1f} s, {action.bytes_freed} bytes freed "
+              f"(exit code {action.exit_code})", flush=True)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            for device in self.policies:
+                try:
+                    self.check(device)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Autoclean: {device}: {e}", flush=True)
+            self.stop_event.wait(self.interval)
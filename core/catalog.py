@@ -0,0 +1,436 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from config import catalog_cache
+
+# Folder containing the scripts shown in the ToolBox, relative to the ToolBox directory
+SCRIPTS_DIRECTORY = Path("scripts")
+
+
+class ArgumentType(Enum):
+    UNKNOWN = 0
+    REQUIRED_WITH_VALUE = 1
+    OPTIONAL = 2
+    OPTIONAL_WITH_VALUE = 3
+
+
+@dataclass
+class Argument:
+    name: str
+    name_repr: str = None
+    argument_type: ArgumentType = None
+    value_name: str = None
+    default_value: str = None
+    description: str = None
+
+    def __post_init__(self):
+        self.parse_name()
+
+    def parse_name(self):
+        if re.match(r"\[.* .*\]", self.name):
+            self.argument_type = ArgumentType.OPTIONAL_WITH_VALUE
+            self.name_repr = self.name[1:-1].split(" ")[0]
+        elif re.match(r"\[.*\]", self.name):
+            self.argument_type = ArgumentType.OPTIONAL
+            self.name_repr = self.name[1:-1]
+        elif re.match(r".* .*", self.name):
+            self.argument_type = ArgumentType.REQUIRED_WITH_VALUE
+            self.name_repr = self.name.split(" ")[0]
+        else:
+            self.argument_type = ArgumentType.UNKNOWN
+            self.name_repr = self.name
+
+    def __repr__(self):
+        return f"Argument({self.name} {self.value_name}={self.default_value}, {self.argument_type} ({self.description[:20]}...)"
+
+
+@dataclass
+class RequiredArgumentGroup:
+    arguments: List[Argument]
+
+    def __repr__(self):
+        return f"RequiredArgumentGroup({self.arguments})"
+
+
+@dataclass
+class OrArgumentGroup:
+    arguments: List[RequiredArgumentGroup]
+
+    def __init__(self, arguments: List[RequiredArgumentGroup], fix_first_argument: bool = False):
+        if fix_first_argument:
+            # Wrap the first argument in a RequiredArgumentGroup
+            arguments[0] = RequiredArgumentGroup([arguments[0]])
+        self.arguments = arguments
+
+    def __repr__(self):
+        return f"OrArgumentGroup({self.arguments})"
+
+
+def split_arguments(description: str) -> List[Argument | OrArgumentGroup]:
+    # Split the description into individual arguments
+    arguments = []
+    current_char = 0
+
+    while current_char < len(description):
+        if description[current_char] == "[":
+            # Start of optional argument
+            j = current_char + 1
+            while description[j] != "]":
+                j += 1
+            arguments.append(Argument(description[current_char : j + 1]))
+            current_char = j + 1
+
+        elif description[current_char] == "(":
+            # Start of required argument
+            j = current_char + 1
+            while description[j] != ")":
+                j += 1
+            arguments.append(OrArgumentGroup(split_arguments(description[current_char + 1 : j]), fix_first_argument=True))
+            current_char = j + 1
+
+        elif description[current_char] == "|":
+            # Start of alternative argument
+            j = current_char + 1
+            while j < len(description) and description[j] != "|":
+                j += 1
+            arguments.append(RequiredArgumentGroup(split_arguments(description[current_char + 1 : j + 1])))
+            current_char = j + 1
+
+        elif description[current_char] == " ":
+            # Skip whitespace
+            current_char += 1
+
+        elif description[current_char] == "-":
+            # Start of required argument
+            j = current_char + 1
+            while description[j] not in [" ", "]", ")", "|"]:
+                j += 1
+            # print("name:" + description[current_char:j])
+
+            if description[j + 1] in ["]", ")", "|"]:
+                # Argument has no value
+                # print("has no value")
+                pass
+            else:
+                # Argument has a value
+                j += 1  # Skip whitespace
+                start_of_value = j
+                while description[j] not in [" ", "]", ")", "|"]:
+                    j += 1
+                # print("value:" + description[start_of_value:j])
+
+            arguments.append(Argument(description[current_char:j]))
+            current_char = j + 1
+        else:
+            # Invalid character
+            raise ValueError("Invalid character in description: " + description[current_char])
+    return arguments
+
+
+def read_description_of_arguments(
+    command_arguments: List[Union[Argument, OrArgumentGroup]], description: list[str]
+) -> List[Union[Argument, OrArgumentGroup]]:
+
+    description = map(lambda x: x.strip(), description)
+    fixed_arguments = []
+
+    for argument in description:
+        if not argument.startswith("-"):
+            # Argument does not start with a dash, so it belongs to the previous argument
+            fixed_arguments[-1] += "  " + argument
+        else:
+            fixed_arguments.append(argument)
+
+    def extract_argument_properties(argument: str) -> Argument:
+        # Split fixed arguments into: name, value name, description, default value
+
+        name = argument.split("  ")[0]
+        value_name = None
+        # if a comma is found, pick the first part as the name
+        if "," in name:
+            name = name.split(",", 1)[0]
+        if " " in name:
+            name, value_name = name.split(" ")
+
+        description = argument.rsplit("  ", 1)[1]
+        default_value = None
+        if description[-1] == ")":
+            default_value = description.split("(default: ")[1].split(")")[0]
+            description = description.split("(default: ")[0]
+
+        return Argument(name=name, value_name=value_name, default_value=default_value, description=description)
+
+    fixed_arguments = list(map(extract_argument_properties, fixed_arguments))
+
+    def find_corresponding_argument(argument: Argument, argument_list: List[Argument]) -> Argument:
+        for arg in argument_list:
+            if arg.name_repr == argument.name_repr:
+                return arg
+
+        raise ValueError(f"Argument not found: {argument} in {argument_list}")
+
+    arguments_with_description = []
+    for argument in command_arguments:
+        if isinstance(argument, Argument):
+            argument_with_description = find_corresponding_argument(argument, fixed_arguments)
+            argument_with_description.argument_type = argument.argument_type
+            arguments_with_description.append(argument_with_description)
+        elif isinstance(argument, OrArgumentGroup):
+            required_groups = []
+            for required_argument_group in argument.arguments:
+                arguments = []
+                for arg in required_argument_group.arguments:
+                    argument_with_description = find_corresponding_argument(arg, fixed_arguments)
+                    argument_with_description.argument_type = arg.argument_type
+                    arguments.append(argument_with_description)
+                required_groups.append(RequiredArgumentGroup(arguments))
+            arguments_with_description.append(OrArgumentGroup(required_groups))
+        else:
+            raise ValueError("Invalid argument type")
+
+    return arguments_with_description
+
+
+@dataclass
+class Script:
+    name: str
+    path: Path
+    version: str
+    author: str
+    args: List[Argument]
+
+
+@dataclass
+class Folder:
+    name: str
+    scripts: List[Script]
+
+
+def read_python_scripts(scripts_directory: Path = SCRIPTS_DIRECTORY) -> List[Script]:
+    # Get all .py files inside the scripts folder
+    python_scripts = scripts_directory.glob("*.py")
+    return [read_python_script(script) for script in python_scripts]
+
+
+def read_shell_scripts(scripts_directory: Path = SCRIPTS_DIRECTORY) -> List[Folder]:
+    # Get all folders inside the scripts folder
+    subdirectories = [folder for folder in scripts_directory.iterdir() if folder.is_dir()]
+    folders = []
+    for folder in subdirectories:
+        shell_scripts = Path(folder).glob("*.sh")
+        folder_scripts = [read_shell_script(script) for script in shell_scripts]
+        # Pipelines chaining other scripts are listed next to the shell scripts
+        folder_scripts += [read_pipeline_script(pipeline) for pipeline in Path(folder).glob("*.json")]
+        folders.append(Folder(folder.name, folder_scripts))
+    return folders
+
+
+def read_shell_script(script: Path) -> Script:
+    # TODO: add documentation to shell scripts ?
+    return Script(
+        name=script.stem,
+        path=script,
+        version="",
+        author="",
+        args=[],
+    )
+
+
+def read_pipeline_script(pipeline: Path) -> Script:
+    with open(pipeline, "r") as pipeline_file:
+        definition = json.load(pipeline_file)
+    return Script(
+        name=definition.get("name", pipeline.stem),
+        path=pipeline,
+        version="",
+        author="",
+        args=[],
+    )
+
+
+def read_help_cache() -> dict:
+    try:
+        with open(catalog_cache, "r") as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_help_cache(cache: dict):
+    # Write to a temporary file first, so concurrent readers never see half a cache
+    os.makedirs(os.path.dirname(catalog_cache), exist_ok=True)
+    temporary_path = f"{catalog_cache}.{os.getpid()}"
+    with open(temporary_path, "w") as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(temporary_path, catalog_cache)
+
+
+def read_script_help(script: Path) -> List[str]:
+    # Running a script costs an interpreter start and its imports: keep its help until the file changes
+    stat = script.stat()
+    key = str(script.absolute())
+    stamp = [stat.st_mtime_ns, stat.st_size]
+
+    cache = read_help_cache()
+    if key in cache and cache[key]["stamp"] == stamp:
+        return cache[key]["lines"]
+
+    # Its error output is kept in the CalledProcessError raised when it cannot show its help
+    lines = subprocess.check_output([sys.executable, str(script), "--help"], stderr=subprocess.PIPE,
+                                    text=True).splitlines()
+    cache[key] = {"stamp": stamp, "lines": lines}
+    write_help_cache(cache)
+    return lines
+
+
+def read_python_script(script: Path) -> Script:
+    # Get the output of the script's usage
+    lines = read_script_help(script)
+
+    # Get the script name, which is before the version
+    name = lines[2].split("(")[0].strip()
+
+    # Get the script version, which is in the third line between parentheses
+    version = lines[2].split("(")[1].split(")")[0].strip()
+
+    # Get the script author, which is in the third line after the version
+    author = lines[2].split("maintained by")[1].strip()
+
+    usage = lines[0].split(".py")[1].strip()
+    i = 6
+    while lines[i]:
+        i += 1
+
+    args = split_arguments(usage)
+    args = read_description_of_arguments(args, lines[6:i])
+    return Script(name, script, version, author, args)
+
+
+def find_script(reference: str, scripts_directory: Path = SCRIPTS_DIRECTORY) -> Script:
+    # A reference is "<folder>/<name>" for the scripts in a folder and "<name>" for the python scripts,
+    # where the name is the file name without extension
+    if "/" in reference:
+        folder_name, script_name = reference.split("/", 1)
+        for folder in read_shell_scripts(scripts_directory):
+            if folder.name != folder_name:
+                continue
+            for script in folder.scripts:
+                if script.path.stem == script_name:
+                    return script
+    else:
+        script_path = scripts_directory / f"{reference}.py"
+        if script_path.is_file():
+            return read_python_script(script_path)
+
+    raise ValueError(f"Script not found: {reference}")
+
+
+def script_command(script_path: Union[str, Path], args: List[str]) -> List[str]:
+    # Build the command running a script of the catalog with the given arguments
+    script_path = str(script_path)
+    if script_path.endswith(".py"):
+        return [sys.executable, script_path] + args
+    if script_path.endswith(".json"):
+        return [sys.executable, "-m", "core.pipeline", script_path] + args
+    assert script_path.endswith(".sh")
+    # it's a bash script
+    return ["bash", script_path] + args
+
+
+def catalog_arguments(arguments: List[Union[Argument, OrArgumentGroup, RequiredArgumentGroup]]) -> Dict[str, Argument]:
+    # All the arguments of a grammar by name, whatever group they are in
+    flat = {}
+    for argument in arguments:
+        if isinstance(argument, Argument):
+            flat[argument.name_repr] = argument
+        else:
+            flat.update(catalog_arguments(argument.arguments))
+    return flat
+
+
+def takes_value(argument: Argument) -> bool:
+    return argument.value_name is not None or argument.argument_type in (
+        ArgumentType.REQUIRED_WITH_VALUE,
+        ArgumentType.OPTIONAL_WITH_VALUE,
+    )
+
+
+def is_required(argument: Argument) -> bool:
+    return argument.argument_type in (ArgumentType.REQUIRED_WITH_VALUE, ArgumentType.UNKNOWN)
+
+
+def parse_arguments(script: Script, args: List[str]) -> Dict[str, Optional[str]]:
+    # Map the given argument names to their value (None for flags), following the grammar of the script
+    known = catalog_arguments(script.args)
+    given = {}
+    errors = []
+
+    i = 0
+    while i < len(args):
+        name, has_value, value = args[i].partition("=")
+        i += 1
+
+        argument = known.get(name)
+        if argument is None:
+            errors.append(f"unknown argument {name}")
+            continue
+        if name in given:
+            errors.append(f"{name} given more than once")
+
+        if not takes_value(argument):
+            if has_value:
+                errors.append(f"{name} does not take a value")
+            value = None
+        elif not has_value:
+            # "--name value" form
+            if i < len(args):
+                value = args[i]
+                i += 1
+            else:
+                errors.append(f"{name} needs a value ({argument.value_name})")
+        elif not value:
+            errors.append(f"{name} has an empty value")
+        given[name] = value
+
+    if errors:
+        raise ValueError("; ".join(errors))
+    return given
+
+
+def validate_arguments(script: Script, args: List[str]) -> List[str]:
+    # Check the arguments against the grammar parsed from the script's usage, return the problems found
+    if script.path.suffix != ".py":
+        return []  # Shell scripts and pipelines do not describe their arguments
+
+    try:
+        given = parse_arguments(script, args)
+    except ValueError as e:
+        return str(e).split("; ")
+
+    errors = []
+    for argument in script.args:
+        if isinstance(argument, Argument):
+            if is_required(argument) and argument.name_repr not in given:
+                errors.append(f"missing {argument.name_repr}")
+            continue
+
+        # Exactly one path of an OrArgumentGroup must be used, with all its required arguments
+        groups = argument.arguments if isinstance(argument, OrArgumentGroup) else [argument]
+        paths = [" ".join(arg.name_repr for arg in group.arguments if is_required(arg)) for group in groups]
+        chosen = [group for group in groups if any(arg.name_repr in given for arg in group.arguments)]
+        if not chosen:
+            errors.append(f"one of ({' | '.join(paths)}) is required")
+        elif len(chosen) > 1:
+            errors.append(f"only one of ({' | '.join(paths)}) can be used")
+        else:
+            for arg in chosen[0].arguments:
+                if is_required(arg) and arg.name_repr not in given:
+                    errors.append(f"missing {arg.name_repr}")
+    return errors
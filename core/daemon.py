@@ -0,0 +1,466 @@
+import argparse
+import fcntl
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import asdict
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from config import daemon_finished_jobs, daemon_log_lines, daemon_socket
+from core.autoclean import AutoCleaner
+from core.eta import format_duration
+from core.jobs import Job, JobResult, job_timeout
+from core.run_history import RunHistory
+from core.worker_pool import WorkerPool
+
+# Every message is a JSON object preceded by its size, as a 4 bytes big endian unsigned integer
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# Events waiting to be sent to a client before it is considered stuck and disconnected
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+# Seconds a client waits for the daemon it started to accept connections
+DAEMON_START_TIMEOUT = 10
+
+# Timeout of a job started without one: the one configured for its script
+SCRIPT_TIMEOUT = "script"
+
+# The daemon runs from the ToolBox directory, like the GUI
+TOOLBOX_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ProtocolError(ConnectionError):
+    pass
+
+
+class DaemonError(Exception):
+    # The daemon refused a request
+    pass
+
+
+def send_message(connection: socket.socket, message: dict):
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    connection.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(connection: socket.socket) -> dict:
+    (size,) = HEADER.unpack(receive_exactly(connection, HEADER.size))
+    if size > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"message of {size} bytes is too large")
+    try:
+        return json.loads(receive_exactly(connection, size))
+    except ValueError as e:
+        raise ProtocolError(f"invalid message: {e}")
+
+
+def result_from_message(result: Optional[dict]) -> Optional[JobResult]:
+    return JobResult(**result) if result is not None else None
+
+
+class DaemonJob:
+    def __init__(self, job_id: int, job: Job):
+        self.id = job_id
+        self.job = job
+        self.start_time = time.time()
+        # Only the last lines are kept, line_count numbers them from the start of the job
+        self.lines = deque(maxlen=daemon_log_lines)
+        self.line_count = 0
+        self.running = True
+        self.result: Optional[JobResult] = None
+
+    def info(self, with_lines: bool = True) -> dict:
+        info = {
+            "id": self.id,
+            "script": self.job.script,
+            "args": self.job.args,
+            "start_time": self.start_time,
+            "running": self.running,
+            "result": asdict(self.result) if self.result is not None else None,
+        }
+        if with_lines:
+            info["first_line"] = self.line_count - len(self.lines)
+            info["lines"] = list(self.lines)
+        return info
+
+
+class Subscriber:
+    def __init__(self, job_id: Optional[int] = None):
+        self.job_id = job_id  # Only the events of this job, or of every job
+        self.events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+
+class JobDaemon:
+    # Owns the running jobs and their output, and publishes what happens to them to the subscribed clients
+    def __init__(self, history: RunHistory, worker_pool: Optional[WorkerPool] = None):
+        self.history = history
+        self.worker_pool = worker_pool
+        self.jobs: Dict[int, DaemonJob] = {}
+        self.next_id = 1
+        self.subscribers = set()
+        # Events are published while holding the lock, so a snapshot and the events after it never overlap
+        self.lock = threading.RLock()
+        self.threads = []
+
+    def publish(self, job_id: int, event: dict):
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                if subscriber.job_id is not None and subscriber.job_id != job_id:
+                    continue
+                try:
+                    subscriber.events.put_nowait(event)
+                except queue.Full:
+                    # The client does not read its events, it will get a new snapshot when it reconnects
+                    subscriber.dropped = True
+                    self.subscribers.discard(subscriber)
+
+    def subscribe(self, job_id: Optional[int] = None) -> Tuple[List[dict], Subscriber]:
+        subscriber = Subscriber(job_id)
+        with self.lock:
+            jobs = [job.info() for job in self.jobs.values() if job_id is None or job.id == job_id]
+            self.subscribers.add(subscriber)
+        return jobs, subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def start_job(self, argv: List[str], script: Optional[str], args: Optional[List[str]],
+                  stdin_data: Optional[str], timeout: Union[float, None, str] = SCRIPT_TIMEOUT) -> DaemonJob:
+        job = Job(argv, script=script, args=args, stdin_data=stdin_data, worker_pool=self.worker_pool)
+        job.timeout = job_timeout(job.script) if timeout == SCRIPT_TIMEOUT else timeout
+
+        with self.lock:
+            daemon_job = DaemonJob(self.next_id, job)
+            self.next_id += 1
+            self.jobs[daemon_job.id] = daemon_job
+
+            # Forget the oldest finished jobs
+            finished = [job_id for job_id, known_job in self.jobs.items() if not known_job.running]
+            for job_id in finished[:max(0, len(finished) - daemon_finished_jobs)]:
+                del self.jobs[job_id]
+
+            self.publish(daemon_job.id, {"event": "started", "job": daemon_job.info(with_lines=False)})
+
+            thread = threading.Thread(target=self.run_job, args=(daemon_job,), daemon=True)
+            self.threads = [known_thread for known_thread in self.threads if known_thread.is_alive()] + [thread]
+            thread.start()
+        return daemon_job
+
+    def output(self, daemon_job: DaemonJob, line: str):
+        with self.lock:
+            daemon_job.lines.append(line)
+            daemon_job.line_count += 1
+            self.publish(daemon_job.id, {"event": "output", "job": daemon_job.id,
+                                         "line_number": daemon_job.line_count - 1, "line": line})
+
+    def run_job(self, daemon_job: DaemonJob):
+        job = daemon_job.job
+        result = None
+        try:
+            try:
+                result = job.run(on_output=lambda line: self.output(daemon_job, line))
+            except OSError as e:
+                self.output(daemon_job, f"Failed to start {job.argv[0]}: {e}")
+
+            if result is not None:
+                if result.termination == "timeout":
+                    message = f"Timed out after {format_duration(result.wall_time)}, its processes were stopped"
+                    # Compare with how long the stuck runs an operator stopped by hand used to last
+                    manual_stop_time = self.history.manual_stop_time(job.script)
+                    if manual_stop_time is not None and manual_stop_time > result.wall_time:
+                        message += f" (saved ~{format_duration(manual_stop_time - result.wall_time)} " \
+                                   f"compared with stopping it by hand)"
+                    self.output(daemon_job, message)
+                elif result.termination == "stopped":
+                    self.output(daemon_job, f"Stopped after {format_duration(result.wall_time)}")
+                if result.leftovers:
+                    self.output(daemon_job, f"Stopped {result.leftovers} leftover process(es) started by the job")
+
+                self.history.record(result)
+                self.output(daemon_job, f"Finished in {result.wall_time:.1f} s (exit code {result.exit_code})")
+        except Exception:
+            # A failure of the daemon itself (e.g. the run history database is locked): shown with the job output,
+            # the job is still reported as finished below
+            for line in traceback.format_exc().splitlines():
+                self.output(daemon_job, line)
+        finally:
+            with self.lock:
+                daemon_job.running = False
+                daemon_job.result = result
+                self.publish(daemon_job.id, {"event": "finished", "job": daemon_job.info(with_lines=False)})
+
+    def stop_job(self, job_id: int) -> bool:
+        with self.lock:
+            daemon_job = self.jobs.get(job_id)
+        if daemon_job is None or not daemon_job.running:
+            return False
+        daemon_job.job.stop()
+        return True
+
+    def running_jobs(self) -> List[DaemonJob]:
+        with self.lock:
+            return [job for job in self.jobs.values() if job.running]
+
+    def stop_all(self):
+        # Stop the running jobs and wait for them, so their results are recorded
+        for daemon_job in self.running_jobs():
+            daemon_job.job.stop()
+        with self.lock:
+            threads = list(self.threads)
+        for thread in threads:
+            thread.join()
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                if request.get("op") == "subscribe":
+                    # The connection now only streams events, until the client closes it
+                    self.stream_events(request.get("job"))
+                    return
+                reply = self.reply(request)
+            except (KeyError, TypeError, ValueError) as e:
+                reply = {"error": f"invalid request: {e}"}
+
+            if reply is None:
+                return
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+    def reply(self, request: dict) -> Optional[dict]:
+        daemon: JobDaemon = self.server.daemon
+        operation = request["op"]
+        if operation == "start":
+            daemon_job = daemon.start_job(request["argv"], request.get("script"), request.get("args"),
+                                          request.get("stdin_data"), request.get("timeout", SCRIPT_TIMEOUT))
+            return {"job": daemon_job.id}
+        if operation == "stop":
+            return {"stopped": daemon.stop_job(request["job"])}
+        if operation == "jobs":
+            with daemon.lock:
+                return {"jobs": [job.info(with_lines=False) for job in daemon.jobs.values()]}
+        if operation == "ping":
+            return {"pid": os.getpid()}
+        if operation == "shutdown":
+            if daemon.running_jobs():
+                return {"error": "jobs are still running"}
+            # Answer before stopping, the daemon exits as soon as the server stops
+            send_message(self.request, {})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return None
+        return {"error": f"unknown operation {operation}"}
+
+    def stream_events(self, job_id: Optional[int]):
+        daemon: JobDaemon = self.server.daemon
+        jobs, subscriber = daemon.subscribe(job_id)
+        try:
+            send_message(self.request, {"event": "snapshot", "jobs": jobs})
+            while not subscriber.dropped:
+                try:
+                    event = subscriber.events.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                send_message(self.request, event)
+        except OSError:
+            pass  # The client went away
+        finally:
+            daemon.unsubscribe(subscriber)
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: JobDaemon):
+        self.daemon = daemon
+        super().__init__(path, RequestHandler)
+
+
+class Subscription:
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+
+    def events(self) -> Iterator[dict]:
+        # The first event is a snapshot of the jobs known by the daemon, with their output so far
+        while True:
+            yield receive_message(self.connection)
+
+    def close(self):
+        # Also wakes up a thread waiting for the next event
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class DaemonClient:
+    def __init__(self, path: str = daemon_socket, start_daemon: bool = True):
+        self.path = path
+        self.start_daemon = start_daemon
+
+    def connect(self) -> socket.socket:
+        deadline = None
+        while True:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.path)
+                return connection
+            except (FileNotFoundError, ConnectionRefusedError):
+                connection.close()
+                if not self.start_daemon:
+                    raise
+                if deadline is None:
+                    self.launch_daemon()
+                    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+                elif time.monotonic() > deadline:
+                    raise ConnectionError(f"the ToolBox daemon did not start, see {self.path}.log")
+                time.sleep(0.05)
+
+    def launch_daemon(self):
+        # In its own session, so it keeps running the jobs when the window that started it is closed
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.log", "a") as log_file:
+            subprocess.Popen(
+                [sys.executable, "-m", "core.daemon", "serve", "--socket", self.path],
+                cwd=TOOLBOX_DIRECTORY,
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+    def request(self, message: dict) -> dict:
+        connection = self.connect()
+        try:
+            send_message(connection, message)
+            reply = receive_message(connection)
+        finally:
+            connection.close()
+        if "error" in reply:
+            raise DaemonError(reply["error"])
+        return reply
+
+    def start_job(self, argv: List[str], script: Optional[str] = None, args: Optional[List[str]] = None,
+                  stdin_data: Optional[str] = None, timeout: Union[float, None, str] = SCRIPT_TIMEOUT) -> int:
+        # The timeout is in seconds, None for no timeout
+        return self.request({"op": "start", "argv": argv, "script": script, "args": args, "stdin_data": stdin_data,
+                             "timeout": timeout})["job"]
+
+    def stop_job(self, job_id: int) -> bool:
+        return self.request({"op": "stop", "job": job_id})["stopped"]
+
+    def jobs(self) -> List[dict]:
+        return self.request({"op": "jobs"})["jobs"]
+
+    def shutdown(self):
+        self.request({"op": "shutdown"})
+
+    def subscribe(self, job_id: Optional[int] = None) -> Subscription:
+        connection = self.connect()
+        send_message(connection, {"op": "subscribe", "job": job_id})
+        return Subscription(connection)
+
+
+def serve(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Only one daemon per socket: the lock is released by the kernel however the daemon exits
+    lock_file = open(f"{path}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print(f"A ToolBox daemon is already running on {path}", flush=True)
+        return
+
+    # Left behind by a daemon that did not exit cleanly
+    if os.path.exists(path):
+        os.unlink(path)
+
+    # Python scripts start in interpreters that already imported their modules
+    worker_pool = WorkerPool()
+    worker_pool.fill()
+    daemon = JobDaemon(RunHistory(), worker_pool)
+    server = DaemonServer(path, daemon)
+    os.chmod(path, 0o600)
+
+    # Disks with an autoclean policy are cleaned before they are full, with or without a window open
+    auto_cleaner = AutoCleaner(daemon)
+    auto_cleaner.start()
+
+    def stop(signal_number, frame):
+        # Stop the jobs first, the server stops serving once their results are recorded
+        def stop_jobs_and_server():
+            auto_cleaner.stop()
+            daemon.stop_all()
+            server.shutdown()
+
+        threading.Thread(target=stop_jobs_and_server, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"ToolBox daemon {os.getpid()} listening on {path}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        worker_pool.close()
+        os.unlink(path)
+        lock_file.close()
+    print(f"ToolBox daemon {os.getpid()} stopped", flush=True)
+
+
+def main(args):
+    if args.command == "serve":
+        serve(args.socket)
+        return
+
+    client = DaemonClient(args.socket, start_daemon=False)
+    try:
+        if args.command == "status":
+            jobs = client.jobs()
+            print(f"ToolBox daemon {client.request({'op': 'ping'})['pid']} on {args.socket}, "
+                  f"{sum(1 for job in jobs if job['running'])} job(s) running")
+        elif args.command == "shutdown":
+            client.shutdown()
+    except (OSError, DaemonError) as e:
+        print(f"ToolBox daemon on {args.socket}: {e}", flush=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ToolBox daemon running the jobs of every ToolBox window")
+    parser.add_argument("command", choices=["serve", "status", "shutdown"])
+    parser.add_argument("--socket", default=daemon_socket, help="path of the Unix socket")
+
+    main(parser.parse_args())
@@ -0,0 +1,289 @@
+import argparse
+import fnmatch
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from config import disk_clean_workers, disk_devices
+from core.disk_scanner import format_size
+
+
+@dataclass(frozen=True)
+class CleanProgress:
+    root: str
+    files: int  # Files (and symlinks) deleted, or that would be deleted in a dry run
+    bytes_freed: int  # Space they used on the disk
+    directories: int  # Directories listed
+    removed_directories: int  # Directories removed once emptied
+    kept: int  # Files and directories left in place by the rules
+    errors: int
+    elapsed: float
+    dry_run: bool
+    finished: bool
+
+
+def compile_rules(patterns: List[str]) -> Optional[re.Pattern]:
+    # Shell patterns on the path relative to the root (e.g. "/background", "*/raw/*.png"). Like .gitignore, a pattern
+    # without "/" matches the name of the entry in any folder. All the patterns are matched by a single regex.
+    if not patterns:
+        return None
+    alternatives = []
+    for pattern in patterns:
+        anchored = "/" in pattern
+        regex = fnmatch.translate(pattern.strip("/"))
+        alternatives.append(regex if anchored else f"(?:.*/)?{regex}")
+    return re.compile("|".join(f"(?:{alternative})" for alternative in alternatives))
+
+
+class CleanDirectory:
+    # A directory being cleaned, removed once all its subdirectories are done (if nothing was kept in it)
+    def __init__(self, path: str, relative_path: str, parent: Optional["CleanDirectory"]):
+        self.path = path
+        self.relative_path = relative_path
+        self.parent = parent
+        self.remaining = 1  # Itself (until listed) and its subdirectories not done yet
+        self.kept = False  # Something was left in it
+
+
+class DiskCleaner:
+    # Deletes the content of root with several threads listing and deleting directories at the same time. Entries
+    # matching an exclude rule are kept with everything under them; with include rules, only the files matching one
+    # are deleted. Directories are removed once emptied, the root itself is kept. Never crosses a mount point.
+    def __init__(self, root: str, include: List[str] = (), exclude: List[str] = (),
+                 workers: int = disk_clean_workers, dry_run: bool = False):
+        self.root = os.path.abspath(root)
+        if self.root == "/":
+            raise ValueError("refusing to clean /")
+        self.include = compile_rules(list(include))
+        self.exclude = compile_rules(list(exclude))
+        self.workers = workers
+        self.dry_run = dry_run
+
+        self.files = 0
+        self.bytes_freed = 0
+        self.directories = 0
+        self.removed_directories = 0
+        self.kept = 0
+        self.errors = 0
+        self.start_time = 0.0
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.pending = 0
+        self.done = threading.Event()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def progress(self, finished: bool = False) -> CleanProgress:
+        with self.lock:
+            return CleanProgress(self.root, self.files, self.bytes_freed, self.directories, self.removed_directories,
+                                 self.kept, self.errors, time.monotonic() - self.start_time, self.dry_run, finished)
+
+    def add(self, directory: CleanDirectory):
+        with self.lock:
+            self.pending += 1
+        self.queue.put(directory)
+
+    def worker(self, device: int):
+        while True:
+            directory = self.queue.get()
+            if directory is None:
+                return  # Cleaning finished
+            try:
+                if not self.stopped:
+                    self.clean_directory(directory, device)
+                else:
+                    self.directory_done(directory, removable=False)
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    if self.pending == 0:
+                        self.done.set()
+
+    def clean_directory(self, directory: CleanDirectory, device: int):
+        files = 0
+        bytes_freed = 0
+        kept = 0
+        errors = 0
+        subdirectories = []
+        directory_fd = None
+        try:
+            # Entries are stat'ed and unlinked relative to the directory, without resolving its path again every time
+            directory_fd = os.open(directory.path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+            with os.scandir(directory_fd) as entries:
+                for entry in entries:
+                    relative_path = f"{directory.relative_path}/{entry.name}" if directory.relative_path else entry.name
+                    if self.exclude is not None and self.exclude.fullmatch(relative_path):
+                        kept += 1
+                        continue
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            if stat.st_dev != device:
+                                kept += 1  # Another filesystem mounted in this one
+                            else:
+                                subdirectories.append(CleanDirectory(os.path.join(directory.path, entry.name),
+                                                                     relative_path, directory))
+                            continue
+                        if self.include is not None and not self.include.fullmatch(relative_path):
+                            kept += 1
+                            continue
+                        if not self.dry_run:
+                            os.unlink(entry.name, dir_fd=directory_fd)
+                        files += 1
+                        if stat.st_nlink <= 1:
+                            # Space used on the disk, like du; a file with other hard links frees nothing
+                            bytes_freed += stat.st_blocks * 512
+                    except FileNotFoundError:
+                        pass  # Removed in the meantime
+                    except OSError:
+                        errors += 1
+        except OSError:
+            errors += 1
+            kept += 1
+        finally:
+            if directory_fd is not None:
+                os.close(directory_fd)
+
+        with self.lock:
+            self.files += files
+            self.bytes_freed += bytes_freed
+            self.kept += kept
+            self.errors += errors
+            self.directories += 1
+            directory.remaining += len(subdirectories)
+        for subdirectory in subdirectories:
+            self.add(subdirectory)
+        self.directory_done(directory, removable=kept == 0)
+
+    def directory_done(self, directory: Optional[CleanDirectory], removable: bool):
+        # Called once for the directory itself and once for each of its subdirectories: the last call removes it
+        while directory is not None:
+            with self.lock:
+                directory.remaining -= 1
+                directory.kept = directory.kept or not removable
+                if directory.remaining > 0:
+                    return
+            if directory.parent is None:
+                return  # The root is kept
+            removable = not directory.kept
+            if removable and not self.dry_run:
+                try:
+                    os.rmdir(directory.path)
+                except OSError:
+                    removable = False  # Something was added to it meanwhile
+            if removable:
+                with self.lock:
+                    self.removed_directories += 1
+            directory = directory.parent
+
+    def clean(self, on_progress: Optional[Callable[[CleanProgress], None]] = None,
+              progress_interval: float = 1.0) -> CleanProgress:
+        self.start_time = time.monotonic()
+        device = os.lstat(self.root).st_dev
+
+        for _ in range(self.workers):
+            threading.Thread(target=self.worker, args=(device,), daemon=True).start()
+        self.add(CleanDirectory(self.root, "", None))
+
+        # Stream the progress while the threads are deleting
+        while not self.done.wait(progress_interval):
+            if on_progress is not None:
+                on_progress(self.progress())
+        for _ in range(self.workers):
+            self.queue.put(None)
+
+        progress = self.progress(finished=not self.stopped)
+        if on_progress is not None:
+            on_progress(progress)
+        return progress
+
+
+def format_progress(progress: CleanProgress) -> str:
+    verb = "Would delete" if progress.dry_run else "Deleted"
+    return (f"{verb} {progress.files} files ({format_size(progress.bytes_freed)}) and "
+            f"{progress.removed_directories} folders, kept {progress.kept}, {progress.errors} errors, "
+            f"{progress.elapsed:.1f} s")
+
+
+def create_tree(root: str, files: int, file_size: int, files_per_directory: int = 1000):
+    # Synthetic acquisition folder: many small images spread over folders, plus a background folder to keep
+    data = os.urandom(file_size)
+    for index in range(files):
+        directory = os.path.join(root, f"acquisition_{index // files_per_directory:04d}")
+        if index % files_per_directory == 0:
+            os.makedirs(directory)
+        with open(os.path.join(directory, f"image_{index:08d}.png"), "wb") as image_file:
+            image_file.write(data)
+    os.makedirs(os.path.join(root, "background"))
+    with open(os.path.join(root, "background", "background.png"), "wb") as image_file:
+        image_file.write(data)
+
+
+def benchmark(args):
+    results = []
+    for name in ("find", "python"):
+        root = tempfile.mkdtemp(prefix="toolbox_clean_", dir=args.directory)
+        try:
+            create_tree(root, args.files, args.file_size)
+            start = time.monotonic()
+            if name == "find":
+                # As clear_ramdisk.sh did, with the regex fixed to match the absolute paths find prints
+                exclude = f"^{re.escape(root)}/background\\(/.*\\)?"
+                subprocess.run(["find", root, "-mindepth", "1", "!", "-regex", exclude, "-delete"], check=True)
+            else:
+                DiskCleaner(root, exclude=["/background"], workers=args.workers).clean()
+            elapsed = time.monotonic() - start
+            kept = os.path.exists(os.path.join(root, "background", "background.png"))
+            results.append((name, elapsed, kept))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    for name, elapsed, kept in results:
+        print(f"{name:<7} {args.files} files in {elapsed:.2f} s ({args.files / elapsed:.0f} files/s), "
+              f"background {'kept' if kept else 'DELETED'}", flush=True)
+
+
+def clean(args):
+    root = disk_devices.get(args.root, args.root)
+    cleaner = DiskCleaner(root, include=args.include, exclude=args.exclude, workers=args.workers,
+                          dry_run=args.dry_run)
+    progress = cleaner.clean(on_progress=lambda progress: print(format_progress(progress), flush=True))
+    if progress.errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete the content of a disk with several threads")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    clean_parser = subparsers.add_parser("clean", help="delete the content of a folder, keeping the folder")
+    clean_parser.add_argument("root", help="folder, or name of a disk of the ToolBox (system, ramdisk, backup)")
+    clean_parser.add_argument("--include", action="append", default=[],
+                              help="only delete the files matching this pattern (can be repeated)")
+    clean_parser.add_argument("--exclude", action="append", default=[],
+                              help="keep what matches this pattern, e.g. /background (can be repeated)")
+    clean_parser.add_argument("--workers", type=int, default=disk_clean_workers,
+                              help="directories cleaned at the same time")
+    clean_parser.add_argument("--dry-run", action="store_true", help="only count what would be deleted")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="compare with find -delete on a synthetic folder")
+    benchmark_parser.add_argument("--files", type=int, default=100000)
+    benchmark_parser.add_argument("--file-size", type=int, default=4096, help="bytes per file")
+    benchmark_parser.add_argument("--workers", type=int, default=disk_clean_workers)
+    benchmark_parser.add_argument("--directory", help="where the synthetic folders are created, e.g. on the ramdisk")
+
+    parsed_args = parser.parse_args()
+    if parsed_args.command == "clean":
+        clean(parsed_args)
+    else:
+        benchmark(parsed_args)
@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+from config import disk_devices, disk_eviction_directory
+from core.disk_cleaner import compile_rules
+from core.disk_scanner import format_size
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent INTEGER,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_by_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS files (
+    directory INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    size INTEGER NOT NULL,
+    UNIQUE (directory, name)
+);
+CREATE INDEX IF NOT EXISTS files_by_age ON files (last_used);
+CREATE TABLE IF NOT EXISTS rules (
+    exclude TEXT NOT NULL
+);
+"""
+
+# Files examined per query when looking for the oldest ones
+EVICTION_BATCH = 1000
+
+
+@dataclass(frozen=True)
+class EvictionResult:
+    root: str
+    to_free: int  # Bytes over the budget when the eviction started
+    files: int  # Files deleted (or that would be in a dry run), oldest first
+    bytes_freed: int
+    examined: int  # Entries of the index looked at, deleted or not
+    listed: int  # Directories listed again because they changed since the previous run
+    refresh_time: float  # Seconds spent bringing the index up to date
+    elapsed: float
+    dry_run: bool
+
+
+def index_path(root: str, exclude: List[str] = ()) -> str:
+    # One index per root and exclude rules: an index never holds the files other rules exclude, so a manual run
+    # without exclusions cannot make them evictable by the autoclean runs
+    name = re.sub(r"\W", "_", root.strip("/")) or "root"
+    if exclude:
+        name += "-" + hashlib.sha1(json.dumps(sorted(exclude)).encode()).hexdigest()[:12]
+    return os.path.join(disk_eviction_directory, name) + ".sqlite3"
+
+
+def parse_budget(budget: str, total: int) -> int:
+    # "60%" of the disk, or a size like "20G" (K, M, G, T) or a number of bytes
+    budget = budget.strip().upper()
+    if budget.endswith("%"):
+        return int(total * float(budget[:-1]) / 100)
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if budget[-1:] in units:
+        return int(float(budget[:-1]) * units[budget[-1]])
+    return int(budget)
+
+
+def last_used(stat: os.stat_result) -> float:
+    # With relatime the access time is only updated by the first read after a write (or once a day), which is enough
+    # to tell the acquisitions that were inspected again from the ones nobody looked at
+    return max(stat.st_atime, stat.st_mtime)
+
+
+class EvictionIndex:
+    # Persistent index of the files under root with their size and last use, ordered by age. It is brought up to date
+    # by listing again only the directories whose modification time changed; an eviction then reads the oldest files
+    # from the index, so it takes a time proportional to what it deletes, not to the size of the tree.
+    def __init__(self, root: str, exclude: List[str] = (), path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        if self.root == "/":
+            raise ValueError("refusing to evict from /")
+        self.exclude = compile_rules(list(exclude))
+        self.path = path if path is not None else index_path(self.root, exclude)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+            # An index given by path and built with other rules is started again from scratch
+            rules = json.dumps(sorted(exclude))
+            if connection.execute("SELECT exclude FROM rules").fetchone() != (rules,):
+                connection.execute("DELETE FROM files")
+                connection.execute("DELETE FROM directories")
+                connection.execute("DELETE FROM rules")
+                connection.execute("INSERT INTO rules (exclude) VALUES (?)", (rules,))
+
+    @contextmanager
+    def connect(self):
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection:
+            with connection:
+                yield connection
+
+    def excluded(self, relative_path: str) -> bool:
+        return self.exclude is not None and self.exclude.fullmatch(relative_path) is not None
+
+    def refresh(self, connection: sqlite3.Connection) -> int:
+        # Returns the number of directories listed again
+        known = {}
+        children = {}
+        for directory_id, path, parent, mtime_ns in connection.execute(
+                "SELECT id, path, parent, mtime_ns FROM directories"):
+            known[path] = (directory_id, mtime_ns)
+            children.setdefault(parent, []).append(path)
+
+        device = os.lstat(self.root).st_dev
+        seen: Set[int] = set()
+        listed = 0
+        stack = [("", None)]
+        while stack:
+            relative_path, parent = stack.pop()
+            path = os.path.join(self.root, relative_path)
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue  # Removed since its parent was listed, forgotten below
+            if stat.st_dev != device:
+                continue
+
+            directory_id, mtime_ns = known.get(relative_path, (None, None))
+            if directory_id is not None and mtime_ns == stat.st_mtime_ns:
+                # Unchanged: same files, only its subdirectories can have changed
+                seen.add(directory_id)
+                stack.extend((child, directory_id) for child in children.get(directory_id, ()))
+                continue
+
+            files = []
+            subdirectories = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        entry_path = f"{relative_path}/{entry.name}" if relative_path else entry.name
+                        if self.excluded(entry_path):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirectories.append(entry_path)
+                            else:
+                                entry_stat = entry.stat(follow_symlinks=False)
+                                files.append((entry.name, last_used(entry_stat), entry_stat.st_blocks * 512))
+                        except OSError:
+                            pass  # Removed in the meantime
+            except OSError:
+                continue
+            listed += 1
+
+            if directory_id is None:
+                directory_id = connection.execute(
+                    "INSERT INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                    (relative_path, parent, stat.st_mtime_ns),
+                ).lastrowid
+            else:
+                connection.execute("UPDATE directories SET mtime_ns = ? WHERE id = ?",
+                                   (stat.st_mtime_ns, directory_id))
+                connection.execute("DELETE FROM files WHERE directory = ?", (directory_id,))
+            connection.executemany(
+                "INSERT INTO files (directory, name, last_used, size) VALUES (?, ?, ?, ?)",
+                ((directory_id, name, used, size) for name, used, size in files),
+            )
+            seen.add(directory_id)
+            stack.extend((subdirectory, directory_id) for subdirectory in subdirectories)
+
+        # Forget the directories that are gone (or excluded now)
+        gone = [(directory_id,) for directory_id, _ in known.values() if directory_id not in seen]
+        connection.executemany("DELETE FROM files WHERE directory = ?", gone)
+        connection.executemany("DELETE FROM directories WHERE id = ?", gone)
+        return listed
+
+    def remove_empty_directories(self, connection: sqlite3.Connection, directory_ids: Set[int]) -> int:
+        # The directories files were deleted from, and their parents, if they are empty now (never the root)
+        removed = 0
+        pending = set(directory_ids)
+        while pending:
+            directory_id = pending.pop()
+            row = connection.execute("SELECT path, parent FROM directories WHERE id = ?", (directory_id,)).fetchone()
+            if row is None or not row[0]:
+                continue
+            try:
+                os.rmdir(os.path.join(self.root, row[0]))
+            except OSError:
+                continue  # Not empty
+            connection.execute("DELETE FROM directories WHERE id = ?", (directory_id,))
+            removed += 1
+            if row[1] is not None:
+                pending.add(row[1])
+        return removed
+
+    def evict(self, budget: str, dry_run: bool = False) -> EvictionResult:
+        start_time = time.monotonic()
+        with self.connect() as connection:
+            listed = self.refresh(connection)
+        refresh_time = time.monotonic() - start_time
+
+        usage = shutil.disk_usage(self.root)
+        to_free = max(0, usage.used - parse_budget(budget, usage.total))
+
+        files = 0
+        bytes_freed = 0
+        examined = 0
+        touched: Set[int] = set()
+        position = (float("-inf"), 0)  # (last_used, rowid) of the last entry examined
+        with self.connect() as connection:
+            while bytes_freed < to_free:
+                rows = connection.execute(
+                    "SELECT files.rowid, files.directory, directories.path, files.name, files.last_used FROM files "
+                    "JOIN directories ON directories.id = files.directory "
+                    "WHERE (files.last_used, files.rowid) > (?, ?) ORDER BY files.last_used, files.rowid LIMIT ?",
+                    position + (EVICTION_BATCH,),
+                ).fetchall()
+                if not rows:
+                    break  # Everything that can be deleted was
+
+                for rowid, directory_id, directory_path, name, used in rows:
+                    position = (used, rowid)
+                    examined += 1
+                    path = os.path.join(self.root, directory_path, name)
+                    try:
+                        stat = os.lstat(path)
+                    except FileNotFoundError:
+                        connection.execute("DELETE FROM files WHERE rowid = ?", (rowid,))
+                        continue
+                    if last_used(stat) > used:
+                        # Read or rewritten since it was indexed: it gets its place among the recent ones
+                        connection.execute("UPDATE files SET last_used = ?, size = ? WHERE rowid = ?",
+                                           (last_used(stat), stat.st_blocks * 512, rowid))
+                        continue
+
+                    if not dry_run:
+                        try:
+                            os.unlink(path)
+                        except OSError:
+                            continue
+                        connection.execute("DELETE FROM files WHERE rowid = ?", (rowid,))
+                        touched.add(directory_id)
+                    files += 1
+                    if stat.st_nlink <= 1:
+                        bytes_freed += stat.st_blocks * 512
+                    if bytes_freed >= to_free:
+                        break
+
+            if not dry_run:
+                self.remove_empty_directories(connection, touched)
+
+        return EvictionResult(self.root, to_free, files, bytes_freed, examined, listed, refresh_time,
+                              time.monotonic() - start_time, dry_run)
+
+
+def format_result(result: EvictionResult) -> str:
+    if result.to_free == 0:
+        return f"{result.root} is within its budget, nothing deleted ({result.listed} folders indexed again)"
+    verb = "Would delete" if result.dry_run else "Deleted"
+    return (f"{verb} the {result.files} oldest files ({format_size(result.bytes_freed)} of "
+            f"{format_size(result.to_free)} over the budget), {result.examined} entries examined, "
+            f"{result.listed} folders indexed again in {result.refresh_time:.1f} s, {result.elapsed:.1f} s in total")
+
+
+def main(args):
+    root = disk_devices.get(args.root, args.root)
+    result = EvictionIndex(root, exclude=args.exclude).evict(args.budget, dry_run=args.dry_run)
+    print(format_result(result), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete the oldest files of a disk until it is within a budget")
+    parser.add_argument("root", help="folder, or name of a disk of the ToolBox (system, ramdisk, backup)")
+    parser.add_argument("--budget", required=True,
+                        help='space the disk may use once done, e.g. "60%%" of the disk or "20G"')
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="never delete what matches this pattern, e.g. /background (can be repeated)")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be deleted")
+
+    main(parser.parse_args())
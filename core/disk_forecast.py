@@ -0,0 +1,132 @@
+import math
+import os
+import re
+from array import array
+from dataclasses import dataclass
+from typing import Optional
+
+from config import (
+    disk_forecast_directory,
+    disk_forecast_interval,
+    disk_forecast_samples,
+    disk_forecast_time_constant,
+)
+
+# A drop of the used space larger than this fraction of the disk is a cleanup: the growth rate is measured again
+CLEANUP_FRACTION = 0.02
+
+
+@dataclass(frozen=True)
+class DiskForecast:
+    device: str
+    growth_rate: Optional[float]  # Bytes per minute, averaged, None until two samples were taken
+    time_to_full: Optional[float]  # Seconds, None when the disk is not filling up
+    samples: int
+
+
+class UsageHistory:
+    # Last samples of the used space of a disk (time, bytes) in a ring buffer, stored as doubles on disk
+    def __init__(self, device: str, capacity: int = disk_forecast_samples, directory: str = disk_forecast_directory):
+        self.device = device
+        self.capacity = capacity
+        self.path = os.path.join(directory, re.sub(r"\W", "_", device) + ".bin")
+        # Times and used bytes interleaved; start is the oldest sample once the buffer is full
+        self.values = array("d")
+        self.start = 0
+
+        self.growth_rate: Optional[float] = None
+        self.last_time: Optional[float] = None
+        self.last_used: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.values) // 2
+
+    def samples(self):
+        # Oldest first
+        count = len(self)
+        for i in range(count):
+            index = (self.start + i) % count
+            yield self.values[2 * index], self.values[2 * index + 1]
+
+    def load(self):
+        values = array("d")
+        try:
+            with open(self.path, "rb") as history_file:
+                values.frombytes(history_file.read())
+        except OSError:
+            return
+        # Saved oldest first: keep the most recent samples that fit
+        values = values[:len(values) - len(values) % 2][-2 * self.capacity:]
+        for i in range(0, len(values), 2):
+            self.add(values[i], values[i + 1], save=False)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        ordered = array("d")
+        for sample_time, used in self.samples():
+            ordered.extend((sample_time, used))
+        temporary_path = f"{self.path}.{os.getpid()}"
+        with open(temporary_path, "wb") as history_file:
+            ordered.tofile(history_file)
+        os.replace(temporary_path, self.path)
+
+    def add(self, sample_time: float, used: float, total: float = 0.0, save: bool = True):
+        if len(self) < self.capacity:
+            self.values.extend((sample_time, used))
+        else:
+            self.values[2 * self.start] = sample_time
+            self.values[2 * self.start + 1] = used
+            self.start = (self.start + 1) % self.capacity
+
+        if self.last_time is not None and sample_time > self.last_time:
+            minutes = (sample_time - self.last_time) / 60
+            if total and self.last_used - used > CLEANUP_FRACTION * total:
+                # Cleared: the rate before the cleanup says nothing about the one after it
+                self.growth_rate = None
+            else:
+                rate = (used - self.last_used) / minutes
+                # Exponential moving average weighted by the time between samples, so gaps (e.g. the ToolBox closed)
+                # count as much as the time they cover
+                weight = 1 - math.exp(-minutes / disk_forecast_time_constant)
+                self.growth_rate = rate if self.growth_rate is None else \
+                    self.growth_rate + weight * (rate - self.growth_rate)
+        self.last_time = sample_time
+        self.last_used = used
+
+        if save:
+            self.save()
+
+    def forecast(self, free: float) -> DiskForecast:
+        time_to_full = None
+        if self.growth_rate is not None and self.growth_rate > 0:
+            time_to_full = free / self.growth_rate * 60
+        return DiskForecast(self.device, self.growth_rate, time_to_full, len(self))
+
+
+class DiskForecaster:
+    # Keeps the usage history of the disks, one sample every disk_forecast_interval seconds
+    def __init__(self, interval: float = disk_forecast_interval):
+        self.interval = interval
+        self.histories = {}
+
+    def history(self, device: str) -> UsageHistory:
+        if device not in self.histories:
+            history = UsageHistory(device)
+            history.load()
+            self.histories[device] = history
+        return self.histories[device]
+
+    def update(self, device: str, sample_time: float, used: int, total: int, free: int) -> DiskForecast:
+        history = self.history(device)
+        if history.last_time is None or sample_time - history.last_time >= self.interval:
+            history.add(sample_time, used, total)
+        return history.forecast(free)
+
+
+def format_time_to_full(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} min"
+    if minutes < 48 * 60:
+        return f"{minutes // 60} h {minutes % 60:02d} min"
+    return f"{minutes // (24 * 60)} days"
@@ -0,0 +1,98 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# /proc/diskstats counts sectors of 512 bytes, whatever the sector size of the device
+SECTOR_SIZE = 512
+
+
+@dataclass(frozen=True)
+class DiskCounters:
+    # Cumulative counters of a block device since boot, from /proc/diskstats
+    reads: int
+    read_sectors: int
+    read_ms: int
+    writes: int
+    write_sectors: int
+    write_ms: int
+    busy_ms: int  # Time with at least one I/O in flight
+
+
+@dataclass(frozen=True)
+class DiskIoSample:
+    device: str  # Name in config.disk_devices
+    block_device: str  # e.g. nvme1n1
+    read_bytes_per_second: float
+    write_bytes_per_second: float
+    read_iops: float
+    write_iops: float
+    await_ms: float  # Mean time an I/O completed in the interval took, queueing included
+    utilization: float  # Fraction of the interval the device was busy, 1.0 when saturated
+
+
+def unescape_mount_point(mount_point: str) -> str:
+    # Spaces, tabs, newlines and backslashes are written as octal escapes (\040) in mountinfo
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), mount_point)
+
+
+def mount_block_devices(mount_points: Dict[str, str]) -> Dict[str, Tuple[int, int]]:
+    # Device numbers (major, minor) of the block device mounted on each mount point, by device name.
+    # A mount point that is not mounted (or on a device without statistics, like a tmpfs) is left out.
+    by_mount_point = {}
+    with open("/proc/self/mountinfo", "r") as mountinfo_file:
+        for line in mountinfo_file:
+            fields, _, filesystem = line.partition(" - ")
+            fields = fields.split()
+            major, minor = (int(number) for number in fields[2].split(":"))
+            source = filesystem.split()[1]
+            if major == 0 and source.startswith("/dev/"):
+                # Filesystems like btrfs show an anonymous device number, the statistics are the ones of their source
+                try:
+                    device_number = os.stat(source).st_rdev
+                except OSError:
+                    continue
+                major, minor = os.major(device_number), os.minor(device_number)
+            # A later line for the same mount point is mounted over the earlier one
+            by_mount_point[unescape_mount_point(fields[4])] = (major, minor)
+
+    return {device: by_mount_point[mount_point] for device, mount_point in mount_points.items()
+            if by_mount_point.get(mount_point, (0, 0))[0] != 0}
+
+
+def read_diskstats() -> Dict[Tuple[int, int], Tuple[str, DiskCounters]]:
+    stats = {}
+    with open("/proc/diskstats", "r") as diskstats_file:
+        for line in diskstats_file:
+            fields = line.split()
+            counters = DiskCounters(
+                reads=int(fields[3]),
+                read_sectors=int(fields[5]),
+                read_ms=int(fields[6]),
+                writes=int(fields[7]),
+                write_sectors=int(fields[9]),
+                write_ms=int(fields[10]),
+                busy_ms=int(fields[12]),
+            )
+            stats[(int(fields[0]), int(fields[1]))] = (fields[2], counters)
+    return stats
+
+
+def io_sample(device: str, block_device: str, before: DiskCounters, after: DiskCounters,
+              interval: float) -> Optional[DiskIoSample]:
+    reads = after.reads - before.reads
+    writes = after.writes - before.writes
+    if interval <= 0 or reads < 0 or writes < 0:
+        return None  # The device was replaced between the two readings
+    ios = reads + writes
+    io_ms = after.read_ms - before.read_ms + after.write_ms - before.write_ms
+    return DiskIoSample(
+        device=device,
+        block_device=block_device,
+        read_bytes_per_second=(after.read_sectors - before.read_sectors) * SECTOR_SIZE / interval,
+        write_bytes_per_second=(after.write_sectors - before.write_sectors) * SECTOR_SIZE / interval,
+        read_iops=reads / interval,
+        write_iops=writes / interval,
+        await_ms=io_ms / ios if ios else 0.0,
+        utilization=min(1.0, (after.busy_ms - before.busy_ms) / (interval * 1000)),
+    )
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from config import disk_devices, disk_scan_cache_directory, disk_scan_workers
+
+# Name shown for the files directly in the scanned folder, the other entries are its subfolders
+ROOT_FILES = "(files)"
+
+
+@dataclass(frozen=True)
+class ScanProgress:
+    root: str
+    top: Tuple[Tuple[str, int], ...]  # Largest subfolders of the root (name, bytes), largest first
+    total_bytes: int
+    directories: int  # Directories scanned so far
+    listed: int  # Directories listed again because they changed since the previous scan (or were never scanned)
+    errors: int  # Directories that could not be read
+    elapsed: float
+    finished: bool
+
+
+def cache_path(root: str) -> str:
+    return os.path.join(disk_scan_cache_directory, re.sub(r"\W", "_", root.strip("/")) or "root") + ".json"
+
+
+class DiskScanner:
+    # Size of every subfolder of root, read by several threads. For every directory, the size of the files it holds
+    # and its subfolders are kept with its modification time: a directory that did not change since the previous scan
+    # is not listed again (the files it holds are not stat'ed again), only its subfolders are checked.
+    # A file growing in place does not change the modification time of its directory, its size is updated when an
+    # entry of the directory is added, removed or renamed.
+    def __init__(self, root: str, workers: int = disk_scan_workers, top: int = 20):
+        self.root = os.path.abspath(root)
+        self.workers = workers
+        self.top = top
+
+        self.cache: Dict[str, list] = {}
+        self.new_cache: Dict[str, list] = {}
+        self.sizes: Dict[str, int] = {}  # Bytes found so far under each subfolder of the root
+        self.directories = 0
+        self.listed = 0
+        self.errors = 0
+        self.start_time = 0.0
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.pending = 0
+        self.done = threading.Event()
+        self.stopped = False
+
+    def load_cache(self):
+        try:
+            with open(cache_path(self.root), "r") as cache_file:
+                self.cache = json.load(cache_file)
+        except (OSError, ValueError):
+            self.cache = {}
+
+    def save_cache(self):
+        path = cache_path(self.root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, "w") as cache_file:
+            json.dump(self.new_cache, cache_file)
+        os.replace(temporary_path, path)
+
+    def stop(self):
+        self.stopped = True
+
+    def progress(self, finished: bool = False) -> ScanProgress:
+        with self.lock:
+            top = sorted(self.sizes.items(), key=lambda item: item[1], reverse=True)[:self.top]
+            return ScanProgress(self.root, tuple(top), sum(self.sizes.values()), self.directories, self.listed,
+                                self.errors, time.monotonic() - self.start_time, finished)
+
+    def add(self, path: str, top: str):
+        with self.lock:
+            self.pending += 1
+        self.queue.put((path, top))
+
+    def worker(self, device: int):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return  # Scan finished
+            path, top = item
+            try:
+                if not self.stopped:
+                    self.scan_directory(path, top, device)
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    if self.pending == 0:
+                        self.done.set()
+
+    def scan_directory(self, path: str, top: str, device: int):
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            with self.lock:
+                self.errors += 1
+            return
+        if stat.st_dev != device:
+            return  # Another filesystem mounted in this one, like du -x
+
+        cached = self.cache.get(path)
+        listed = cached is None or cached[0] != stat.st_mtime_ns
+        if listed:
+            files_size = 0
+            subdirectories = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirectories.append(entry.name)
+                            else:
+                                # Space used on the disk, like du (sparse files use less than their size)
+                                files_size += entry.stat(follow_symlinks=False).st_blocks * 512
+                        except OSError:
+                            pass  # Removed in the meantime
+            except OSError:
+                with self.lock:
+                    self.errors += 1
+                return
+        else:
+            _, files_size, subdirectories = cached
+
+        for name in subdirectories:
+            # The subfolders of the root are the entries of the breakdown
+            self.add(os.path.join(path, name), top if top is not None else name)
+
+        with self.lock:
+            self.new_cache[path] = [stat.st_mtime_ns, files_size, subdirectories]
+            entry = top if top is not None else ROOT_FILES
+            self.sizes[entry] = self.sizes.get(entry, 0) + files_size + stat.st_blocks * 512
+            self.directories += 1
+            self.listed += listed
+
+    def scan(self, on_progress: Optional[Callable[[ScanProgress], None]] = None,
+             progress_interval: float = 0.5) -> ScanProgress:
+        self.start_time = time.monotonic()
+        self.load_cache()
+        device = os.lstat(self.root).st_dev
+
+        for _ in range(self.workers):
+            threading.Thread(target=self.worker, args=(device,), daemon=True).start()
+        self.add(self.root, None)
+
+        # Send the partial breakdown while the threads are scanning
+        while not self.done.wait(progress_interval):
+            if on_progress is not None:
+                on_progress(self.progress())
+        for _ in range(self.workers):
+            self.queue.put(None)
+
+        if not self.stopped:
+            self.save_cache()
+        progress = self.progress(finished=not self.stopped)
+        if on_progress is not None:
+            on_progress(progress)
+        return progress
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_progress(progress: ScanProgress) -> str:
+    lines = [f"{format_size(size):>10}  {name}" for name, size in progress.top]
+    lines.append(f"{format_size(progress.total_bytes):>10}  total, {progress.directories} directories "
+                 f"({progress.listed} listed, {progress.directories - progress.listed} unchanged), "
+                 f"{progress.errors} unreadable, {progress.elapsed:.1f} s")
+    return "\n".join(lines)
+
+
+def main(args):
+    root = disk_devices.get(args.root, args.root)
+    scanner = DiskScanner(root, workers=args.workers, top=args.top)
+    progress = scanner.scan()
+    print(format_progress(progress), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show what uses the space of a disk")
+    parser.add_argument("root", help="folder, or name of a disk of the ToolBox (system, ramdisk, backup)")
+    parser.add_argument("--workers", type=int, default=disk_scan_workers, help="directories listed at the same time")
+    parser.add_argument("--top", type=int, default=20, help="number of subfolders shown")
+
+    main(parser.parse_args())
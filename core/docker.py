@@ -0,0 +1,103 @@
+import calendar
+import http.client
+import json
+import socket
+import subprocess
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from config import docker_socket
+
+
+class DockerError(Exception):
+    # The Docker Engine refused a request, with its HTTP status and message
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{message} (HTTP {status})")
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    # HTTP over the Unix socket of the Docker Engine
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def parse_docker_time(value: str) -> float:
+    # RFC 3339 with nanoseconds ("2024-03-01T10:00:00.123456789Z"), "0001-01-01T00:00:00Z" when never set
+    try:
+        return max(0.0, calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")))
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def list_containers(name_filter: str) -> List[str]:
+    # Same query the maintenance scripts use: docker ps -aqf "name=<filter>"
+    command = ["docker", "ps", "-aq", "--filter", f"name={name_filter}"]
+    output = subprocess.check_output(command, text=True)
+    return output.split()
+
+
+def inspect_container(container_id: str) -> dict:
+    # Get the low level information of a container (name, state, health, ...)
+    command = ["docker", "inspect", "--format", "{{json .}}", container_id]
+    output = subprocess.check_output(command, text=True)
+    return json.loads(output)
+
+
+def container_name(container_id: str) -> str:
+    command = ["docker", "inspect", "--format", "{{.Name}}", container_id]
+    output = subprocess.check_output(command, text=True)
+    return output.strip().lstrip("/")
+
+
+def restart_container(container_id: str):
+    # Raises CalledProcessError with docker's message in the output when the restart fails
+    subprocess.run(["docker", "restart", container_id], check=True, capture_output=True, text=True)
+
+
+def container_logs(container_id: str, since: Optional[str] = None, tail: Optional[int] = None) -> str:
+    # docker logs replays the container's stdout and stderr, so merge them back together
+    command = ["docker", "logs"]
+    if since is not None:
+        command += ["--since", since]
+    if tail is not None:
+        command += ["--tail", str(tail)]
+    command.append(container_id)
+    return subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True).stdout
+
+
+def container_states(timeout: Optional[float] = None) -> List[Tuple[str, str]]:
+    # Name and state ("running", "exited", "restarting", ...) of every container
+    command = ["docker", "ps", "-a", "--format", "{{.Names}}\t{{.State}}"]
+    output = subprocess.check_output(command, text=True, timeout=timeout)
+    return [tuple(line.split("\t", 1)) for line in output.splitlines() if "\t" in line]
+
+
+def docker_api(method: str, endpoint: str, timeout: Optional[float] = None):
+    # Request to the Docker Engine API, e.g. docker_api("GET", "/system/df"). The answer is decoded from JSON.
+    connection = UnixHTTPConnection(docker_socket, timeout=timeout)
+    try:
+        connection.request(method, endpoint)
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status >= 400:
+        try:
+            message = json.loads(body)["message"]
+        except (ValueError, KeyError, TypeError):
+            message = body.decode(errors="replace").strip()
+        raise DockerError(response.status, message)
+    return json.loads(body) if body else None
+
+
+def remove_image(image_id: str, timeout: Optional[float] = None) -> List[dict]:
+    # Untags and deletes the image, as docker image rm; refused (409) while a container uses it
+    return docker_api("DELETE", f"/images/{quote(image_id, safe='')}", timeout=timeout)
@@ -0,0 +1,224 @@
+import argparse
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import disk_devices, docker_usage_timeout, docker_usage_ttl
+from core.disk_scanner import format_size
+from core.docker import DockerError, docker_api
+from core.image_cache import compose_images, image_references, release_files
+
+
+@dataclass(frozen=True)
+class ImageUsage:
+    name: str
+    id: str
+    size: int  # Bytes, layers shared with other images included
+    unique_size: int
+    containers: int
+    releases: Tuple[str, ...]  # Release files of release_directory naming it
+
+
+@dataclass(frozen=True)
+class ContainerUsage:
+    name: str
+    image: str
+    state: str
+    size: int  # Bytes written by the container on top of its image
+
+
+@dataclass(frozen=True)
+class VolumeUsage:
+    name: str
+    size: int  # -1 when docker could not measure it
+    containers: int
+
+
+@dataclass(frozen=True)
+class BuildCacheUsage:
+    id: str
+    type: str
+    size: int
+    in_use: bool
+    shared: bool
+    last_used: str
+
+
+@dataclass(frozen=True)
+class DockerUsage:
+    # One reading of GET /system/df, with what could be freed in each category
+    time: float
+    root_directory: str  # Where docker keeps its data, e.g. /var/lib/docker
+    layers_size: int  # Bytes used by all the images, shared layers counted once
+    images: Tuple[ImageUsage, ...]  # Largest first
+    containers: Tuple[ContainerUsage, ...]
+    volumes: Tuple[VolumeUsage, ...]
+    build_cache: Tuple[BuildCacheUsage, ...]
+    read_time: float  # Seconds docker took to answer
+
+    @property
+    def containers_size(self) -> int:
+        return sum(container.size for container in self.containers)
+
+    @property
+    def volumes_size(self) -> int:
+        return sum(max(0, volume.size) for volume in self.volumes)
+
+    @property
+    def build_cache_size(self) -> int:
+        return sum(entry.size for entry in self.build_cache if not entry.shared)
+
+    @property
+    def total(self) -> int:
+        return self.layers_size + self.containers_size + self.volumes_size + self.build_cache_size
+
+    @property
+    def reclaimable(self) -> Dict[str, int]:
+        # Same rules as docker system df: unused images, stopped containers, unused volumes, idle build cache
+        return {
+            "images": sum(image.unique_size for image in self.images if image.containers == 0),
+            "containers": sum(container.size for container in self.containers if container.state != "running"),
+            "volumes": sum(max(0, volume.size) for volume in self.volumes if volume.containers == 0),
+            "build cache": sum(entry.size for entry in self.build_cache if not entry.in_use and not entry.shared),
+        }
+
+
+def release_references() -> Dict[str, List[str]]:
+    # Release files naming each image reference
+    releases = {}
+    for path in release_files():
+        try:
+            references = compose_images(path)
+        except OSError:
+            continue
+        for reference in references:
+            releases.setdefault(reference, []).append(os.path.basename(path))
+    return releases
+
+
+def read_docker_usage(timeout: float = docker_usage_timeout) -> DockerUsage:
+    start = time.monotonic()
+    df = docker_api("GET", "/system/df", timeout=timeout)
+    read_time = time.monotonic() - start
+    root_directory = docker_api("GET", "/info", timeout=timeout).get("DockerRootDir", "/var/lib/docker")
+    releases = release_references()
+
+    images = []
+    for image in df.get("Images") or []:
+        tags = [tag for tag in image.get("RepoTags") or [] if not tag.startswith("<none>")]
+        shared_size = image.get("SharedSize", -1)
+        image_releases = sorted({release for reference in image_references(image)
+                                 for release in releases.get(reference, [])})
+        images.append(ImageUsage(
+            name=tags[0] if tags else image["Id"][7:19],
+            id=image["Id"],
+            size=image["Size"],
+            unique_size=image["Size"] - shared_size if shared_size >= 0 else image["Size"],
+            containers=max(0, image.get("Containers", 0)),
+            releases=tuple(image_releases),
+        ))
+    images.sort(key=lambda image_usage: image_usage.size, reverse=True)
+
+    containers = tuple(ContainerUsage(
+        name=container["Names"][0].lstrip("/"),
+        image=container["Image"],
+        state=container["State"],
+        size=container.get("SizeRw", 0),
+    ) for container in df.get("Containers") or [])
+
+    volumes = tuple(VolumeUsage(
+        name=volume["Name"],
+        size=(volume.get("UsageData") or {}).get("Size", -1),
+        containers=max(0, (volume.get("UsageData") or {}).get("RefCount", 0)),
+    ) for volume in df.get("Volumes") or [])
+
+    build_cache = tuple(BuildCacheUsage(
+        id=entry["ID"],
+        type=entry.get("Type", ""),
+        size=entry.get("Size", 0),
+        in_use=entry.get("InUse", False),
+        shared=entry.get("Shared", False),
+        last_used=entry.get("LastUsedAt") or "",
+    ) for entry in df.get("BuildCache") or [])
+
+    return DockerUsage(time.time(), root_directory, df.get("LayersSize", 0), tuple(images), containers, volumes,
+                       build_cache, read_time)
+
+
+def docker_disk(usage: DockerUsage) -> Optional[str]:
+    # Disk of disk_devices holding the data of docker: the one with the longest mount point containing it
+    devices = [(mount_point, device) for device, mount_point in disk_devices.items()
+               if usage.root_directory == mount_point or
+               usage.root_directory.startswith(mount_point.rstrip("/") + "/")]
+    return max(devices)[1] if devices else None
+
+
+class DockerUsageCache:
+    # Last reading of the disk usage of docker, read again in the background once older than ttl seconds: docker
+    # takes up to tens of seconds to answer, nobody waits for it
+    def __init__(self, ttl: float = docker_usage_ttl, timeout: float = docker_usage_timeout):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.usage: Optional[DockerUsage] = None
+        self.error: Optional[str] = None  # Why the last reading failed
+        self.read_time: Optional[float] = None  # time.monotonic() of the last reading, failed or not
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def get(self) -> Optional[DockerUsage]:
+        # The last reading (None until the first one is done), starting a new one if it is too old
+        with self.lock:
+            if self.read_time is None or time.monotonic() - self.read_time >= self.ttl:
+                self.start_reading()
+            return self.usage
+
+    def refresh(self):
+        with self.lock:
+            self.start_reading()
+
+    def start_reading(self):
+        # Called with the lock held; a single reading at a time
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.read, name="docker usage", daemon=True)
+            self.thread.start()
+
+    def read(self):
+        usage, error = None, None
+        try:
+            usage = read_docker_usage(self.timeout)
+        except (OSError, DockerError, ValueError, KeyError) as e:
+            error = str(e) or type(e).__name__
+        with self.lock:
+            if usage is not None:
+                self.usage = usage
+            self.error = error
+            self.read_time = time.monotonic()
+            self.thread = None
+
+
+def format_usage(usage: DockerUsage) -> str:
+    reclaimable = usage.reclaimable
+    lines = [
+        f"{'Images':<12} {format_size(usage.layers_size):>10}  {format_size(reclaimable['images']):>10} reclaimable",
+        f"{'Containers':<12} {format_size(usage.containers_size):>10}  "
+        f"{format_size(reclaimable['containers']):>10} reclaimable",
+        f"{'Volumes':<12} {format_size(usage.volumes_size):>10}  {format_size(reclaimable['volumes']):>10} reclaimable",
+        f"{'Build cache':<12} {format_size(usage.build_cache_size):>10}  "
+        f"{format_size(reclaimable['build cache']):>10} reclaimable",
+        f"{'Total':<12} {format_size(usage.total):>10}  in {usage.root_directory}, read in {usage.read_time:.1f} s",
+        "",
+    ]
+    for image in usage.images:
+        releases = ", ".join(image.releases) or "-"
+        lines.append(f"{format_size(image.size):>10} {format_size(image.unique_size):>10}  {image.name:<50} "
+                     f"{image.containers} container(s), releases: {releases}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show what docker uses on the disk (docker system df)")
+    parser.add_argument("--timeout", type=float, default=docker_usage_timeout, help="seconds to wait for docker")
+    args = parser.parse_args()
+    print(format_usage(read_docker_usage(args.timeout)), flush=True)
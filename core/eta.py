@@ -0,0 +1,92 @@
+import json
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+
+from core.jobs import JobResult
+
+# Number of most recent successful durations kept for each script and argument set
+DURATION_WINDOW = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS durations (
+    key TEXT PRIMARY KEY,
+    wall_times TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class Prediction:
+    p50: float
+    p90: float
+    samples: int
+    same_arguments: bool  # False when only runs of the script with other arguments were available
+
+
+@dataclass
+class ProgressEstimate:
+    fraction: float  # Estimated completion between 0 and 1
+    remaining: float  # Estimated seconds left
+    overdue: bool  # The job is already running longer than 90% of the previous runs
+
+
+def duration_key(script: str, args: Optional[List[str]]) -> str:
+    # args=None is the key of all the runs of the script, whatever their arguments
+    return json.dumps([script, args])
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    # Linear interpolation between the closest ranks
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def update_durations(connection: sqlite3.Connection, result: JobResult):
+    # Failed or interrupted runs usually stop early, they would only make the predictions optimistic
+    if result.exit_code != 0 or result.termination != "exit":
+        return
+
+    for key in (duration_key(result.script, result.args), duration_key(result.script, None)):
+        row = connection.execute("SELECT wall_times FROM durations WHERE key = ?", (key,)).fetchone()
+        wall_times = json.loads(row[0]) if row else []
+        wall_times = (wall_times + [result.wall_time])[-DURATION_WINDOW:]
+        connection.execute("INSERT OR REPLACE INTO durations (key, wall_times) VALUES (?, ?)",
+                           (key, json.dumps(wall_times)))
+
+
+def load_prediction(connection: sqlite3.Connection, script: str, args: List[str]) -> Optional[Prediction]:
+    # Prefer the runs with the same arguments, fall back to all the runs of the script
+    for key, same_arguments in ((duration_key(script, args), True), (duration_key(script, None), False)):
+        row = connection.execute("SELECT wall_times FROM durations WHERE key = ?", (key,)).fetchone()
+        if row:
+            wall_times = sorted(json.loads(row[0]))
+            return Prediction(
+                p50=percentile(wall_times, 0.5),
+                p90=percentile(wall_times, 0.9),
+                samples=len(wall_times),
+                same_arguments=same_arguments,
+            )
+    return None
+
+
+def estimate_progress(prediction: Prediction, elapsed: float) -> ProgressEstimate:
+    # Aim for the median run, then for the 90th percentile, so the estimate only moves forward
+    if elapsed < prediction.p50:
+        return ProgressEstimate(fraction=0.9 * elapsed / prediction.p50, remaining=prediction.p50 - elapsed,
+                                overdue=False)
+    if elapsed < prediction.p90:
+        fraction = 0.9 + 0.09 * (elapsed - prediction.p50) / (prediction.p90 - prediction.p50)
+        return ProgressEstimate(fraction=fraction, remaining=prediction.p90 - elapsed, overdue=False)
+    return ProgressEstimate(fraction=0.99, remaining=0.0, overdue=True)
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
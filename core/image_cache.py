@@ -0,0 +1,277 @@
+import argparse
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import image_cache_keep_releases, release_directory
+from core.disk_eviction import parse_budget
+from core.disk_scanner import format_size
+from core.docker import DockerError, docker_api, parse_docker_time, remove_image
+
+# Same release files as the "Install Release" list of the ToolBox
+RELEASE_FILE = re.compile(r".*\d.*\.(yaml|yml)$")
+
+# "image:" line of a compose file (no YAML parser needed for this one key)
+IMAGE_LINE = re.compile(r"""^\s*image:\s*["']?([^"'\s#]+)""")
+
+# Label docker-compose puts on the containers it creates, with the compose files they come from
+COMPOSE_FILES_LABEL = "com.docker.compose.project.config_files"
+
+# Seconds given to the Docker Engine for each request (removing a large image takes a while)
+DOCKER_TIMEOUT = 120
+
+
+@dataclass(frozen=True)
+class CachedImage:
+    id: str
+    tags: Tuple[str, ...]
+    size: int  # Bytes, layers shared with other images included
+    unique_size: int  # Bytes freed by removing it alone
+    containers: int  # Containers using it, running or not
+    last_used: float  # Last time it was loaded, tagged, or used by a container or a release file
+    pinned_by: Optional[str]  # Why it is kept, None when it can be evicted
+    layers: Tuple[str, ...] = ()  # Ids of its layers (RootFS), from the base one
+
+    @property
+    def name(self) -> str:
+        return self.tags[0] if self.tags else self.id[7:19]
+
+
+@dataclass(frozen=True)
+class EvictedImage:
+    image: CachedImage
+    reclaimed: int  # Bytes freed on the disk by removing it, from its layers and the images still there
+    error: Optional[str]  # Why it could not be removed
+
+
+def normalize_reference(reference: str) -> str:
+    # "nginx" and "docker.io/library/nginx:latest" are the same image as the "nginx:latest" docker lists
+    for prefix in ("docker.io/library/", "docker.io/"):
+        if reference.startswith(prefix):
+            reference = reference[len(prefix):]
+    if "@" not in reference and ":" not in reference.rsplit("/", 1)[-1]:
+        reference += ":latest"
+    return reference
+
+
+def compose_images(path: str) -> Set[str]:
+    images = set()
+    with open(path, "r") as compose_file:
+        for line in compose_file:
+            match = IMAGE_LINE.match(line)
+            # An image built from variables (${TAG}) cannot be told from here
+            if match and "$" not in match.group(1):
+                images.add(normalize_reference(match.group(1)))
+    return images
+
+
+def release_files(directory: str = release_directory) -> List[str]:
+    # Most recent first
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if RELEASE_FILE.match(name)]
+    return sorted((path for path in paths if os.path.isfile(path)), key=os.path.getmtime, reverse=True)
+
+
+def image_references(image: dict) -> Set[str]:
+    references = (image.get("RepoTags") or []) + (image.get("RepoDigests") or [])
+    return {normalize_reference(reference) for reference in references if not reference.startswith("<none>")}
+
+
+def cached_images(keep_releases: int = image_cache_keep_releases, pin_files: List[str] = (),
+                  disk_usage: Optional[dict] = None) -> List[CachedImage]:
+    # Images of the Docker cache, least recently used first. Pinned: the images of the containers (the installed
+    # release, running or stopped), of the compose files of the installed release, of the keep_releases most recent
+    # release files and of pin_files. disk_usage is a /system/df answer already read (it can take tens of seconds).
+    pins: Dict[str, str] = {}  # Reference or image id: why it is kept
+    last_used: Dict[str, float] = {}  # Image id: last use by a container
+
+    containers = docker_api("GET", "/containers/json?all=1", timeout=DOCKER_TIMEOUT)
+    installed_files = set()
+    for container in containers:
+        pins.setdefault(container["ImageID"], f"used by container {container['Names'][0].lstrip('/')}")
+        last_used[container["ImageID"]] = max(last_used.get(container["ImageID"], 0.0), container["Created"])
+        config_files = (container.get("Labels") or {}).get(COMPOSE_FILES_LABEL)
+        if config_files:
+            installed_files.update(config_files.split(","))
+
+    for path in installed_files:
+        try:
+            for reference in compose_images(path):
+                pins.setdefault(reference, f"installed release {os.path.basename(path)}")
+        except OSError:
+            pass  # Removed since the release was installed, its containers pin their images anyway
+
+    releases = release_files()
+    reference_times: Dict[str, float] = {}  # When a release file naming the image last changed
+    for index, path in enumerate(releases):
+        try:
+            references = compose_images(path)
+        except OSError:
+            continue
+        for reference in references:
+            reference_times[reference] = max(reference_times.get(reference, 0.0), os.path.getmtime(path))
+            if index < keep_releases:
+                pins.setdefault(reference, f"recent release {os.path.basename(path)}")
+    for path in pin_files:
+        for reference in compose_images(path):
+            pins.setdefault(reference, f"release {os.path.basename(path)}")
+
+    if disk_usage is None:
+        disk_usage = docker_api("GET", "/system/df", timeout=DOCKER_TIMEOUT)
+    images = []
+    for image in disk_usage["Images"]:
+        references = image_references(image)
+        pinned_by = pins.get(image["Id"]) or next((pins[reference] for reference in sorted(references)
+                                                   if reference in pins), None)
+        # Docker does not record when an image was last used: take the last time it was loaded or tagged, used by a
+        # container, or named by a release file that changed
+        details = docker_api("GET", f"/images/{image['Id']}/json", timeout=DOCKER_TIMEOUT)
+        times = [image["Created"], parse_docker_time((details.get("Metadata") or {}).get("LastTagTime")),
+                 last_used.get(image["Id"], 0.0)]
+        times += [reference_times.get(reference, 0.0) for reference in references]
+        shared_size = image.get("SharedSize", -1)
+        images.append(CachedImage(
+            id=image["Id"],
+            tags=tuple(tag for tag in image.get("RepoTags") or [] if tag != "<none>:<none>"),
+            size=image["Size"],
+            unique_size=image["Size"] - shared_size if shared_size >= 0 else image["Size"],
+            containers=max(0, image.get("Containers", 0)),
+            last_used=max(times),
+            pinned_by=pinned_by,
+            layers=tuple((details.get("RootFS") or {}).get("Layers") or ()),
+        ))
+    return sorted(images, key=lambda cached_image: cached_image.last_used)
+
+
+def layers_size() -> int:
+    return docker_api("GET", "/system/df", timeout=DOCKER_TIMEOUT)["LayersSize"]
+
+
+def common_layers(first: Tuple[str, ...], second: Tuple[str, ...]) -> int:
+    count = 0
+    for first_layer, second_layer in zip(first, second):
+        if first_layer != second_layer:
+            break
+        count += 1
+    return count
+
+
+def chain_sizes(images: List[CachedImage]) -> Dict[Tuple[str, ...], int]:
+    # Bytes of the layer chains known from the /system/df reading. Images only share the first layers of their
+    # chains (a layer is reused on the same parent only): the size of an image is the one of its whole chain, and
+    # its shared size the one of the longest start of its chain another image has.
+    sizes = {(): 0}
+    for image in images:
+        if not image.layers:
+            continue
+        sizes[image.layers] = image.size
+        if image.size > image.unique_size:
+            shared = max((common_layers(image.layers, other.layers) for other in images if other is not image),
+                         default=0)
+            sizes.setdefault(image.layers[:shared], image.size - image.unique_size)
+    return sizes
+
+
+def reclaimed_size(image: CachedImage, remaining: List[CachedImage], sizes: Dict[Tuple[str, ...], int]) -> int:
+    # Bytes freed by removing the image while the remaining ones are kept: the layers of its chain after the longest
+    # start it has in common with one of them
+    if not image.layers:
+        return image.unique_size
+    kept = max((common_layers(image.layers, other.layers) for other in remaining), default=0)
+    # The size of that start is known, or else taken from the closest longer one known: less is counted as freed
+    kept_size = next(sizes[image.layers[:length]] for length in range(kept, len(image.layers) + 1)
+                     if image.layers[:length] in sizes)
+    return max(image.size - kept_size, 0)
+
+
+def evict_images(images: List[CachedImage], to_free: Optional[int], dry_run: bool = False) -> List[EvictedImage]:
+    # Removes the images that are not pinned, least recently used first, until to_free bytes are reclaimed (all of
+    # them when to_free is None). images are all the images of the cache: what removing one frees is computed from
+    # the layers it shares with the others, not measured with /system/df after each removal.
+    sizes = chain_sizes(images)
+    removed = set()
+    evicted = []
+    reclaimed = 0
+    for image in images:
+        if image.pinned_by is not None:
+            continue
+        if to_free is not None and reclaimed >= to_free:
+            break
+        # Removing an image also frees the layers it was the last one to share with images removed before
+        remaining = [other for other in images if other.id != image.id and other.id not in removed]
+        image_reclaimed = reclaimed_size(image, remaining, sizes)
+        if not dry_run:
+            try:
+                remove_image(image.id, timeout=DOCKER_TIMEOUT)
+            except DockerError as e:
+                evicted.append(EvictedImage(image, 0, str(e)))
+                continue
+        removed.add(image.id)
+        evicted.append(EvictedImage(image, image_reclaimed, None))
+        reclaimed += image_reclaimed
+    return evicted
+
+
+def format_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "never"
+
+
+def list_images(args):
+    print(f"{'Image':<60} {'Unique':>10} {'Size':>10}  {'Last used':<16}  Kept because")
+    for image in cached_images(args.keep_releases, args.pin):
+        print(f"{image.name:<60} {format_size(image.unique_size):>10} {format_size(image.size):>10}  "
+              f"{format_time(image.last_used):<16}  {image.pinned_by or '-'}")
+
+
+def evict(args):
+    disk_usage = docker_api("GET", "/system/df", timeout=DOCKER_TIMEOUT)
+    images = cached_images(args.keep_releases, args.pin, disk_usage)
+    to_free = parse_budget(args.free, disk_usage["LayersSize"]) if args.free else None
+
+    evicted = evict_images(images, to_free, dry_run=args.dry_run)
+    verb = "Would remove" if args.dry_run else "Removed"
+    for eviction in evicted:
+        if eviction.error is not None:
+            print(f"Kept {eviction.image.name}: {eviction.error}", flush=True)
+        else:
+            print(f"{verb} {eviction.image.name} (last used {format_time(eviction.image.last_used)}), "
+                  f"{format_size(eviction.reclaimed)} reclaimed", flush=True)
+
+    kept = sum(1 for image in images if image.pinned_by is not None)
+    reclaimed = sum(eviction.reclaimed for eviction in evicted)
+    if not args.dry_run and any(eviction.error is None for eviction in evicted):
+        # The total as measured by Docker
+        reclaimed = disk_usage["LayersSize"] - layers_size()
+    print(f"{verb} {sum(1 for eviction in evicted if eviction.error is None)} images, {format_size(reclaimed)} "
+          f"reclaimed, {kept} pinned images kept", flush=True)
+    if any(eviction.error is not None for eviction in evicted):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove the docker images no release needs, least recently used first")
+    parser.add_argument("--keep-releases", type=int, default=image_cache_keep_releases,
+                        help="most recent release files of the release directory whose images are kept")
+    parser.add_argument("--pin", action="append", default=[], help="also keep the images of this compose file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="show the cached images, least recently used first")
+
+    evict_parser = subparsers.add_parser("evict", help="remove the images that are not pinned")
+    evict_parser.add_argument("--free", help='stop once this is reclaimed, e.g. "20G" or "50%%" of the images '
+                                             '(by default every image that is not pinned is removed)')
+    evict_parser.add_argument("--dry-run", action="store_true", help="only show what would be removed")
+
+    parsed_args = parser.parse_args()
+    try:
+        if parsed_args.command == "list":
+            list_images(parsed_args)
+        else:
+            evict(parsed_args)
+    except (OSError, DockerError) as e:
+        print(f"Docker: {e}", flush=True)
+        sys.exit(1)
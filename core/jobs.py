@@ -0,0 +1,282 @@
+import codecs
+import os
+import re
+import select
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from config import default_job_timeout, job_stop_grace_period, job_timeouts
+from core.worker_pool import preload_usage
+
+
+@dataclass
+class JobResult:
+    script: str
+    args: List[str]
+    start_time: float
+    end_time: float
+    exit_code: int
+    user_cpu: float  # Seconds of user CPU time used by the job and its children
+    sys_cpu: float  # Seconds of system CPU time used by the job and its children
+    max_rss: int  # Peak resident set size in kilobytes (above the imports of the worker for a pooled job)
+    termination: str = "exit"  # "exit", "timeout" or "stopped"
+    leftovers: int = 0  # Processes of the job still running after it exited, killed by the ToolBox
+
+    @property
+    def wall_time(self) -> float:
+        return self.end_time - self.start_time
+
+
+def job_timeout(script: str) -> Optional[float]:
+    # Timeouts are configured by script file name (or job name, like "release install")
+    return job_timeouts.get(os.path.basename(script), default_job_timeout)
+
+
+def running_processes() -> Iterator[Tuple[int, int, int]]:
+    # (pid, parent pid, process group) of the processes running, zombies excluded
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue  # The process exited in the meantime
+        # The command name between parentheses may contain spaces, the fields after it do not
+        fields = stat[stat.rindex(")") + 2:].split()
+        if fields[0] != "Z":
+            yield int(entry), int(fields[1]), int(fields[2])
+
+
+def process_group_members(pgid: int) -> List[int]:
+    # Find the processes still running in a process group
+    return [pid for pid, _, group in running_processes() if group == pgid]
+
+
+def pipe_holders(inode: int) -> List[int]:
+    # Other processes with a pipe open (at either end), the ones of other users are not visible
+    pipe = f"pipe:[{inode}]"
+    holders = []
+    for pid, _, _ in running_processes():
+        if pid == os.getpid():
+            continue
+        try:
+            descriptors = os.listdir(f"/proc/{pid}/fd")
+        except OSError:
+            continue  # Exited in the meantime, or not ours
+        for descriptor in descriptors:
+            try:
+                if os.readlink(f"/proc/{pid}/fd/{descriptor}") == pipe:
+                    holders.append(pid)
+                    break
+            except OSError:
+                continue
+    return holders
+
+
+def signal_process_group(pgid: int, signal_number: int):
+    try:
+        os.killpg(pgid, signal_number)
+    except ProcessLookupError:
+        pass  # Every process of the group already exited
+    except PermissionError:
+        pass  # Only processes of other users (e.g. started with sudo) are left, sudo relays the signal itself
+
+
+def descendant_groups(pid: int) -> List[int]:
+    # Process groups of the descendants of a process that are not in its group, e.g. the steps of a pipeline, each
+    # in its own session: killing the group of the process would leave them running
+    processes = list(running_processes())
+    groups = []
+    parents = [pid]
+    while parents:
+        children = [(child, group) for child, parent, group in processes if parent in parents]
+        groups.extend(group for _, group in children if group != pid and group not in groups)
+        parents = [child for child, _ in children]
+    return groups
+
+
+class Job:
+    def __init__(
+        self,
+        argv: List[str],
+        script: Optional[str] = None,
+        args: Optional[List[str]] = None,
+        stdin_data: Optional[str] = None,
+        env: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        worker_pool=None,
+    ):
+        # script/args identify the job in the run history, by default the command itself.
+        # env holds extra environment variables on top of the ToolBox ones.
+        # worker_pool (a core.worker_pool.WorkerPool) runs python scripts in an interpreter started in advance.
+        self.argv = argv
+        self.script = script if script is not None else argv[0]
+        self.args = args if args is not None else argv[1:]
+        self.stdin_data = stdin_data
+        self.env = env
+        self.timeout = timeout
+        self.worker_pool = worker_pool
+
+        self.process = None
+        self.termination = "exit"
+        self.lock = threading.Lock()
+        self.finished = False
+        self.output_abandoned = threading.Event()
+
+    def run(self, on_output: Optional[Callable[[str], None]] = None) -> JobResult:
+        # Run the command to completion in its own process group, streaming its merged stdout/stderr line by line
+        start_time = time.time()
+        if self.worker_pool is not None and self.stdin_data is None:
+            self.process = self.worker_pool.start(self.argv, self.env)
+        if self.process is None:
+            self.process = self.popen()
+
+        # The job may have been stopped while it was starting
+        with self.lock:
+            stopped_while_starting = self.termination != "exit"
+        if stopped_while_starting:
+            threading.Thread(target=self.stop_processes, daemon=True).start()
+
+        timer = None
+        if self.timeout is not None:
+            timer = threading.Timer(self.timeout, self.terminate, args=("timeout",))
+            timer.daemon = True
+            timer.start()
+
+        # Read the output in another thread: children left behind may keep the pipe open after the job exits
+        output_pipe = os.fstat(self.process.stdout.fileno()).st_ino
+        reader = threading.Thread(target=self.read_output, args=(on_output,), daemon=True)
+        reader.start()
+
+        if self.stdin_data is not None:
+            try:
+                self.process.stdin.write(self.stdin_data)
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass  # The job exited without reading all its input
+
+        # Reap the process ourselves to get its resource usage (and the one of the children it waited for)
+        _, status, rusage = os.wait4(self.process.pid, 0)
+        self.process.returncode = os.waitstatus_to_exitcode(status)
+        end_time = time.time()
+
+        # A worker of the pool imported its modules before it was given the job, what they cost is not the script's
+        user_cpu, sys_cpu, max_rss = rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss
+        preload = preload_usage(self.process)
+        if preload is not None:
+            user_cpu = max(user_cpu - preload["user_cpu"], 0.0)
+            sys_cpu = max(sys_cpu - preload["sys_cpu"], 0.0)
+            max_rss = max(max_rss - preload["max_rss"], 0)
+
+        with self.lock:
+            self.finished = True
+        if timer is not None:
+            timer.cancel()
+
+        # Clean up what the job started and did not wait for (e.g. sudo rsync, tar)
+        leftovers = process_group_members(self.process.pid)
+        if leftovers:
+            self.stop_processes()
+
+        # A process that left the job's group (setsid, a daemonizing helper, sudo with use_pty) may still hold its
+        # output open: stop reading it after the grace period, and stop that process too
+        reader.join(job_stop_grace_period)
+        if reader.is_alive():
+            holders = [pid for pid in pipe_holders(output_pipe) if pid not in leftovers]
+            for pid in holders:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            leftovers += holders
+            self.output_abandoned.set()
+            reader.join()
+
+        return JobResult(
+            script=self.script,
+            args=self.args,
+            start_time=start_time,
+            end_time=end_time,
+            exit_code=self.process.returncode,
+            user_cpu=user_cpu,
+            sys_cpu=sys_cpu,
+            max_rss=max_rss,
+            termination=self.termination,
+            leftovers=len(leftovers),
+        )
+
+    def popen(self) -> subprocess.Popen:
+        return subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE if self.stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            env=dict(os.environ, **self.env) if self.env is not None else None,
+            start_new_session=True,
+        )
+
+    def read_output(self, on_output: Optional[Callable[[str], None]]):
+        # Read with a timeout rather than line by line, so that run() can give up on a pipe held open by a process
+        # that left the job. Lines end like in text mode: "\n", "\r\n" or "\r" (progress bars).
+        fd = self.process.stdout.fileno()
+        decoder = codecs.getincrementaldecoder(self.process.stdout.encoding)(errors="replace")
+        text = ""
+        while not self.output_abandoned.is_set():
+            if not select.select([fd], [], [], 0.1)[0]:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            # A "\r" at the end may be the first half of a "\r\n", it waits for the next read
+            *lines, text = re.split(r"\r\n|\r(?!\Z)|\n", text + decoder.decode(data))
+            for line in lines:
+                if on_output is not None:
+                    on_output(line)
+        *lines, text = re.split(r"\r\n|\r|\n", text + decoder.decode(b"", final=True))
+        for line in lines + ([text] if text else []):
+            if on_output is not None:
+                on_output(line)
+        self.process.stdout.close()
+
+    def stop(self):
+        self.terminate("stopped")
+
+    def terminate(self, reason: str):
+        # Ask the whole process group to terminate, then kill it if it is still there after the grace period
+        with self.lock:
+            if self.finished or self.termination != "exit":
+                return
+            self.termination = reason
+            if self.process is None:
+                return  # Not started yet, run() stops it as soon as it is
+        threading.Thread(target=self.stop_processes, daemon=True).start()
+
+    def stop_processes(self):
+        # Ask the job's process group to terminate, with the groups of its descendants that left it (e.g. the steps
+        # of a pipeline, each in its own session), then kill them if they are still there after the grace period.
+        # The groups are found before the signal: once a parent exits, its children are no longer its descendants.
+        groups = [self.process.pid] + descendant_groups(self.process.pid)
+        for group in groups:
+            signal_process_group(group, signal.SIGTERM)
+
+        deadline = time.monotonic() + job_stop_grace_period
+        while True:
+            processes = list(running_processes())
+            if any(group == self.process.pid for _, _, group in processes):
+                # Its processes may still start others while they stop
+                groups += [group for group in descendant_groups(self.process.pid) if group not in groups]
+            if not any(group in groups for _, _, group in processes):
+                return
+            if time.monotonic() >= deadline:
+                for group in groups:
+                    signal_process_group(group, signal.SIGKILL)
+                return
+            time.sleep(0.1)
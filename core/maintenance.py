@@ -0,0 +1,100 @@
+import argparse
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Optional
+
+from config import maintenance_health_timeout, maintenance_max_workers
+from core.docker import container_name, list_containers, restart_container
+from core.readiness import ContainerHealthProbe, ServiceNotReady, wait_until_ready
+
+
+@dataclass
+class RestartResult:
+    container_id: str
+    name: str
+    restart_time: float = 0.0  # Time spent in "docker restart"
+    ready_time: float = 0.0  # Time from the restart request until the container is healthy
+    status: str = "unknown"
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def restart_and_wait(container_id: str, health_timeout: float) -> RestartResult:
+    result = RestartResult(container_id=container_id, name=container_id)
+    start = time.monotonic()
+    try:
+        result.name = container_name(container_id)
+        restart_container(container_id)
+        result.restart_time = time.monotonic() - start
+
+        probe = ContainerHealthProbe(container_id)
+        wait_until_ready([probe], health_timeout)
+        result.status = probe.status()
+    except subprocess.CalledProcessError as e:
+        result.error = (e.stderr or e.output or str(e)).strip()
+    except ServiceNotReady as e:
+        result.error = str(e)
+    result.ready_time = time.monotonic() - start
+    return result
+
+
+def restart_containers(
+    name_filter: str, max_workers: int = maintenance_max_workers, health_timeout: float = maintenance_health_timeout
+) -> List[RestartResult]:
+    containers = list_containers(name_filter)
+    if not containers:
+        print(f'No container matching "{name_filter}" found', flush=True)
+        return []
+
+    print(f"Restarting {len(containers)} container(s) ({min(max_workers, len(containers))} at a time)", flush=True)
+
+    start = time.monotonic()
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(restart_and_wait, container, health_timeout) for container in containers]
+        # Report every container as soon as it is back, not in submission order
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result.ok:
+                print(
+                    f"  {result.name}: {result.status} after {result.ready_time:.1f} s "
+                    f"(restart {result.restart_time:.1f} s)",
+                    flush=True,
+                )
+            else:
+                print(f"  {result.name}: FAILED after {result.ready_time:.1f} s: {result.error}", flush=True)
+    elapsed = time.monotonic() - start
+
+    sequential = sum(result.ready_time for result in results)
+    print(f"Total downtime {elapsed:.1f} s (one after another: ~{sequential:.1f} s)", flush=True)
+    return results
+
+
+def main(args):
+    if args.command == "restart":
+        results = restart_containers(args.name, max_workers=args.workers, health_timeout=args.timeout)
+        if not results or not all(result.ok for result in results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ToolBox maintenance engine")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    restart_parser = subparsers.add_parser("restart", help="restart every container whose name matches NAME")
+    restart_parser.add_argument("name", help="container name filter, as in docker ps --filter name=NAME")
+    restart_parser.add_argument(
+        "--workers", type=int, default=maintenance_max_workers, help="containers restarted at the same time"
+    )
+    restart_parser.add_argument(
+        "--timeout", type=float, default=maintenance_health_timeout, help="seconds to wait for each container"
+    )
+
+    main(parser.parse_args())
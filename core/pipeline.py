@@ -0,0 +1,253 @@
+import argparse
+import json
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import pipeline_max_workers, pipeline_runs_directory
+from core.catalog import Script, find_script, script_command
+from core.jobs import Job, job_timeout
+from core.run_history import RunHistory
+
+
+class PipelineError(ValueError):
+    pass
+
+
+@dataclass
+class Step:
+    id: str
+    script: str  # Catalog reference, "<folder>/<name>" or "<python script name>"
+    args: List[str] = field(default_factory=list)
+    after: List[str] = field(default_factory=list)  # Steps that must succeed before this one starts
+    timeout: Optional[float] = None  # Seconds before the step is stopped, by default the one of its script
+
+
+@dataclass
+class Pipeline:
+    name: str
+    steps: List[Step]
+
+
+@dataclass
+class StepResult:
+    step_id: str
+    status: str  # "ok", "failed" or "skipped"
+    start: float = 0.0  # Seconds from the start of the pipeline
+    wall_time: float = 0.0
+    exit_code: Optional[int] = None
+
+
+def load_pipeline(path: Path) -> Pipeline:
+    with open(path, "r") as pipeline_file:
+        definition = json.load(pipeline_file)
+
+    steps = [Step(**step) for step in definition["steps"]]
+    pipeline = Pipeline(name=definition.get("name", Path(path).stem), steps=steps)
+
+    step_ids = [step.id for step in steps]
+    if len(set(step_ids)) != len(step_ids):
+        raise PipelineError(f"{path}: duplicated step ids")
+    for step in steps:
+        for dependency in step.after:
+            if dependency not in step_ids:
+                raise PipelineError(f"{path}: step {step.id} runs after unknown step {dependency}")
+
+    # Refuse cycles: repeatedly take out the steps whose dependencies are all taken out
+    remaining = {step.id: set(step.after) for step in steps}
+    while remaining:
+        ready = [step_id for step_id, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise PipelineError(f"{path}: steps {', '.join(sorted(remaining))} depend on each other")
+        for step_id in ready:
+            del remaining[step_id]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+    return pipeline
+
+
+def environment_name(step_id: str) -> str:
+    return "TOOLBOX_ARTIFACTS_" + re.sub(r"\W", "_", step_id).upper()
+
+
+def expand_argument(argument: str, step_directory: Path, run_directory: Path) -> str:
+    # "{artifacts}" is the artifact folder of the step, "{artifacts:<step id>}" the one of another step
+    argument = argument.replace("{artifacts}", str(step_directory))
+    return re.sub(r"\{artifacts:([^}]+)\}", lambda match: str(run_directory / match.group(1)), argument)
+
+
+class PipelineRun:
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        run_directory: Path,
+        on_output: Callable[[str], None],
+        history: Optional[RunHistory] = None,
+        max_workers: int = pipeline_max_workers,
+    ):
+        self.pipeline = pipeline
+        self.run_directory = run_directory
+        self.on_output = on_output
+        self.history = history
+        self.max_workers = max_workers
+
+        self.start_time = 0.0
+        self.stopping = False
+        self.running_jobs = set()
+        self.lock = threading.Lock()
+
+    def stop(self):
+        # Stop the running steps and do not start new ones
+        with self.lock:
+            self.stopping = True
+            running_jobs = list(self.running_jobs)
+        for job in running_jobs:
+            job.stop()
+
+    def run_step(self, step: Step, script: Script) -> StepResult:
+        # Every step gets its own artifact folder, and the ones of the steps it runs after
+        step_directory = self.run_directory / step.id
+        step_directory.mkdir(parents=True, exist_ok=True)
+        env = {"TOOLBOX_ARTIFACTS": str(step_directory)}
+        for dependency in step.after:
+            env[environment_name(dependency)] = str(self.run_directory / dependency)
+
+        args = [expand_argument(argument, step_directory, self.run_directory) for argument in step.args]
+        script_path = script.path.absolute()
+        timeout = step.timeout if step.timeout is not None else job_timeout(str(script_path))
+        job = Job(script_command(script_path, args), script=str(script_path), args=args, env=env, timeout=timeout)
+
+        with self.lock:
+            if self.stopping:
+                return StepResult(step.id, "skipped")
+            self.running_jobs.add(job)
+
+        start = time.time()
+        self.on_output(f"[{step.id}] started")
+        with open(step_directory / "output.log", "w") as log_file:
+            def output(line):
+                log_file.write(line + "\n")
+                self.on_output(f"[{step.id}] {line}")
+
+            try:
+                result = job.run(on_output=output)
+            except OSError as e:
+                output(f"Failed to start: {e}")
+                return StepResult(step.id, "failed", start - self.start_time, time.time() - start)
+            finally:
+                with self.lock:
+                    self.running_jobs.discard(job)
+
+        if self.history is not None:
+            self.history.record(result)
+
+        status = "ok" if result.exit_code == 0 and result.termination == "exit" else "failed"
+        ended = f"exit code {result.exit_code}" if result.termination == "exit" else result.termination
+        self.on_output(f"[{step.id}] {status} in {result.wall_time:.1f} s ({ended})")
+        return StepResult(step.id, status, start - self.start_time, result.wall_time, result.exit_code)
+
+    def run(self) -> List[StepResult]:
+        # Resolve every script before starting anything, so a typo does not leave the line half recovered
+        scripts = {step.id: find_script(step.script) for step in self.pipeline.steps}
+
+        self.start_time = time.time()
+        pending: Dict[str, Step] = {step.id: step for step in self.pipeline.steps}
+        results: Dict[str, StepResult] = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Skip the steps that come after a failed or skipped step
+                skipped_any = True
+                while skipped_any:
+                    skipped_any = False
+                    for step in list(pending.values()):
+                        failed = [dependency for dependency in step.after
+                                  if dependency in results and results[dependency].status != "ok"]
+                        if failed or self.stopping:
+                            reason = "pipeline stopped" if self.stopping else f"{', '.join(failed)} did not succeed"
+                            self.on_output(f"[{step.id}] skipped, {reason}")
+                            results[step.id] = StepResult(step.id, "skipped")
+                            del pending[step.id]
+                            skipped_any = True
+
+                # Start every step whose dependencies all succeeded, independent branches run concurrently
+                for step in list(pending.values()):
+                    if all(dependency in results for dependency in step.after):
+                        running[executor.submit(self.run_step, step, scripts[step.id])] = step
+                        del pending[step.id]
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    results[step.id] = future.result()
+
+        # Report the steps in the order of the definition
+        return [results[step.id] for step in self.pipeline.steps]
+
+
+def format_timings(results: List[StepResult], total_time: float) -> str:
+    width = max(len(result.step_id) for result in results)
+    lines = [f"{'Step':<{width}}  {'Status':<8} {'Start':>8} {'Duration':>9}"]
+    for result in results:
+        if result.status == "skipped":
+            lines.append(f"{result.step_id:<{width}}  {result.status:<8} {'-':>8} {'-':>9}")
+        else:
+            lines.append(f"{result.step_id:<{width}}  {result.status:<8} {result.start:>7.1f}s {result.wall_time:>8.1f}s")
+    sequential = sum(result.wall_time for result in results)
+    lines.append(f"Total {total_time:.1f} s (one step after another: ~{sequential:.1f} s)")
+    return "\n".join(lines)
+
+
+def main(args):
+    pipeline_path = Path(args.pipeline)
+    try:
+        pipeline = load_pipeline(pipeline_path)
+    except (OSError, KeyError, TypeError, PipelineError) as e:
+        print(f"Invalid pipeline {pipeline_path}: {e}", flush=True)
+        sys.exit(2)
+
+    run_directory = Path(pipeline_runs_directory) / f"{pipeline_path.stem}-{time.strftime('%Y%m%d-%H%M%S')}"
+    run_directory.mkdir(parents=True, exist_ok=True)
+    print(f"Running {pipeline.name} ({len(pipeline.steps)} steps), artifacts in {run_directory}", flush=True)
+
+    # Steps print from several threads, keep their lines whole
+    print_lock = threading.Lock()
+
+    def output(line):
+        with print_lock:
+            print(line, flush=True)
+
+    pipeline_run = PipelineRun(pipeline, run_directory, output, history=RunHistory(), max_workers=args.workers)
+    # The steps run in their own process groups: stopping the pipeline job must stop them too (the job killing the
+    # pipeline after its grace period kills their groups as well)
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: pipeline_run.stop())
+
+    start = time.time()
+    try:
+        results = pipeline_run.run()
+    except (ValueError, subprocess.CalledProcessError) as e:
+        print(f"Cannot run {pipeline.name}: {e}", flush=True)
+        sys.exit(2)
+
+    print(format_timings(results, time.time() - start), flush=True)
+    if any(result.status != "ok" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a pipeline of ToolBox scripts")
+    parser.add_argument("pipeline", help="pipeline definition (JSON)")
+    parser.add_argument("--workers", type=int, default=pipeline_max_workers, help="steps running at the same time")
+
+    main(parser.parse_args())
@@ -0,0 +1,201 @@
+import argparse
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from core.docker import container_logs, container_name, inspect_container, list_containers, parse_docker_time
+
+# Number of container log lines attached to the diagnostics of a failed probe
+DIAGNOSTIC_LOG_LINES = 20
+
+
+class ProbeFailed(Exception):
+    # Raised by a probe when the service can no longer become ready (e.g. the container exited)
+    pass
+
+
+class ServiceNotReady(Exception):
+    def __init__(self, message: str, diagnostics: str):
+        super().__init__(message)
+        self.diagnostics = diagnostics
+
+
+@dataclass
+class ContainerHealthProbe:
+    container_id: str
+    # Seconds a container without a healthcheck must have been running to be ready: running alone does not tell that
+    # the service inside is up
+    fallback_wait: float = 0.0
+
+    def __str__(self):
+        return f"container {self.container_id} health"
+
+    def check(self) -> bool:
+        state = inspect_container(self.container_id)["State"]
+        if state["Status"] in ("exited", "dead"):
+            raise ProbeFailed(f"container {state['Status']} (exit code {state.get('ExitCode')})")
+
+        # Containers without a healthcheck are ready once they have been running for fallback_wait seconds
+        health = state.get("Health", {}).get("Status")
+        if health is None:
+            return state["Running"] and time.time() - parse_docker_time(state["StartedAt"]) >= self.fallback_wait
+        return health == "healthy"
+
+    def status(self) -> str:
+        state = inspect_container(self.container_id)["State"]
+        if "Health" not in state and state["Running"] and self.fallback_wait:
+            return f"running, no healthcheck, waiting {self.fallback_wait:.0f} s after its start"
+        return state.get("Health", {}).get("Status") or state["Status"]
+
+    def diagnostics(self) -> str:
+        state = inspect_container(self.container_id)["State"]
+        lines = [f"status: {state['Status']}, health: {state.get('Health', {}).get('Status', 'no healthcheck')}"]
+
+        # Output of the last healthcheck run, if the container has one
+        health_log = state.get("Health", {}).get("Log") or []
+        if health_log:
+            lines.append(f"last healthcheck: {health_log[-1].get('Output', '').strip()}")
+
+        lines.append(f"last {DIAGNOSTIC_LOG_LINES} log lines:")
+        lines.append(container_logs(self.container_id, tail=DIAGNOSTIC_LOG_LINES).rstrip())
+        return "\n".join(lines)
+
+
+@dataclass
+class LogMarkerProbe:
+    container_id: str
+    marker: str
+
+    def __str__(self):
+        return f'"{self.marker}" in container {self.container_id} logs'
+
+    def check(self) -> bool:
+        # Only look at what the container logged since its last (re)start
+        started_at = inspect_container(self.container_id)["State"]["StartedAt"]
+        return self.marker in container_logs(self.container_id, since=started_at)
+
+    def status(self) -> str:
+        return "marker not logged yet"
+
+    def diagnostics(self) -> str:
+        return container_logs(self.container_id, tail=DIAGNOSTIC_LOG_LINES).rstrip()
+
+
+@dataclass
+class TcpPortProbe:
+    host: str
+    port: int
+    connect_timeout: float = 1.0
+    last_error: Optional[str] = None
+
+    def __str__(self):
+        return f"tcp port {self.host}:{self.port}"
+
+    def check(self) -> bool:
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.connect_timeout):
+                return True
+        except OSError as e:
+            self.last_error = str(e)
+            return False
+
+    def status(self) -> str:
+        return self.last_error or "not accepting connections"
+
+    def diagnostics(self) -> str:
+        return f"last connection error: {self.status()}"
+
+
+def wait_until_ready(
+    probes: list, timeout: float, initial_delay: float = 0.5, max_delay: float = 5.0, backoff: float = 2.0
+) -> float:
+    # Poll every probe until all of them are ready, backing off exponentially between rounds.
+    # Returns the seconds it took; raises ServiceNotReady with diagnostics on timeout or failure.
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = list(probes)
+    delay = initial_delay
+
+    while True:
+        try:
+            # A probe that reported ready once is not checked again
+            pending = [probe for probe in pending if not probe.check()]
+        except (ProbeFailed, subprocess.CalledProcessError) as e:
+            raise ServiceNotReady(f"service failed to start: {e}", collect_diagnostics(pending)) from e
+
+        if not pending:
+            return time.monotonic() - start
+
+        now = time.monotonic()
+        if now >= deadline:
+            waiting_for = ", ".join(f"{probe} ({probe.status()})" for probe in pending)
+            raise ServiceNotReady(f"not ready after {timeout:.0f} s, waiting for {waiting_for}",
+                                  collect_diagnostics(pending))
+
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * backoff, max_delay)
+
+
+def collect_diagnostics(probes: list) -> str:
+    sections = []
+    for probe in probes:
+        try:
+            sections.append(f"--- {probe} ---\n{probe.diagnostics()}")
+        except (OSError, subprocess.CalledProcessError) as e:
+            sections.append(f"--- {probe} ---\ndiagnostics unavailable: {e}")
+    return "\n".join(sections)
+
+
+def build_probes(args) -> List:
+    probes = []
+    if args.container is not None:
+        containers = list_containers(args.container)
+        if not containers:
+            raise ServiceNotReady(f'no container matching "{args.container}" found', "")
+        for container_id in containers:
+            probes.append(ContainerHealthProbe(container_id, args.fallback_wait))
+            if args.log_marker is not None:
+                probes.append(LogMarkerProbe(container_id, args.log_marker))
+
+    if args.port is not None:
+        host, _, port = args.port.rpartition(":")
+        probes.append(TcpPortProbe(host or "localhost", int(port)))
+    return probes
+
+
+def main(args):
+    try:
+        probes = build_probes(args)
+        if args.container is not None:
+            names = ", ".join(container_name(probe.container_id) for probe in probes
+                              if isinstance(probe, ContainerHealthProbe))
+            print(f"Waiting for {names} to be ready", flush=True)
+
+        elapsed = wait_until_ready(probes, args.timeout)
+        print(f"Ready after {elapsed:.1f} s", flush=True)
+    except ServiceNotReady as e:
+        print(f"NOT READY: {e}", flush=True)
+        if e.diagnostics:
+            print(e.diagnostics, flush=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wait until a service is ready")
+    parser.add_argument("container", nargs="?", help="container name filter, as in docker ps --filter name=NAME")
+    parser.add_argument("--log-marker", help="line the container logs once it is ready")
+    parser.add_argument("--port", help="[HOST:]PORT that must accept TCP connections")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before giving up")
+    parser.add_argument("--fallback-wait", type=float, default=0,
+                        help="seconds a container without a healthcheck must have been running to be ready")
+
+    arguments = parser.parse_args()
+    if arguments.container is None and arguments.port is None:
+        parser.error("give a container and/or --port to probe")
+    if arguments.log_marker is not None and arguments.container is None:
+        parser.error("--log-marker requires a container")
+
+    main(arguments)
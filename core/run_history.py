@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+from config import history_database
+from core.eta import SCHEMA as DURATIONS_SCHEMA, Prediction, load_prediction, percentile, update_durations
+from core.jobs import JobResult
+
+# Number of most recent runs used for the "recent" median, to spot scripts getting slower
+RECENT_RUNS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    script TEXT NOT NULL,
+    args TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    exit_code INTEGER NOT NULL,
+    wall_time REAL NOT NULL,
+    user_cpu REAL NOT NULL,
+    sys_cpu REAL NOT NULL,
+    max_rss INTEGER NOT NULL,
+    termination TEXT NOT NULL DEFAULT 'exit',
+    leftovers INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_by_script ON runs (script, start_time);
+"""
+
+# Columns added after the first version of the database, with their definition
+ADDED_COLUMNS = {
+    "termination": "TEXT NOT NULL DEFAULT 'exit'",
+    "leftovers": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+@dataclass
+class ScriptSummary:
+    script: str
+    runs: int
+    failures: int
+    timeouts: int
+    p50: float
+    p90: float
+    p99: float
+    recent_p50: float  # Median wall time of the last RECENT_RUNS runs
+    mean_cpu: float  # Mean user + system CPU seconds per run
+    max_rss: int  # Highest peak RSS of all runs, in kilobytes
+
+
+class RunHistory:
+    def __init__(self, path: str = history_database):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+            connection.executescript(DURATIONS_SCHEMA)
+
+            # Upgrade databases created by older versions of the ToolBox
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(runs)")]
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE runs ADD COLUMN {column} {definition}")
+
+    @contextmanager
+    def connect(self):
+        # One short-lived connection per operation, so the history can be used from any thread
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection:
+            with connection:
+                yield connection
+
+    def record(self, result: JobResult):
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO runs (script, args, start_time, end_time, exit_code, wall_time, user_cpu, sys_cpu, "
+                "max_rss, termination, leftovers) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    result.script,
+                    json.dumps(result.args),
+                    result.start_time,
+                    result.end_time,
+                    result.exit_code,
+                    result.wall_time,
+                    result.user_cpu,
+                    result.sys_cpu,
+                    result.max_rss,
+                    result.termination,
+                    result.leftovers,
+                ),
+            )
+            # Keep the duration model used for the ETA of the next runs up to date
+            update_durations(connection, result)
+
+    def predict(self, script: str, args: List[str]) -> Optional[Prediction]:
+        with self.connect() as connection:
+            return load_prediction(connection, script, args)
+
+    def manual_stop_time(self, script: str) -> Optional[float]:
+        # Median wall time of the runs an operator had to stop by hand, i.e. how long a stuck run lasts without timeout
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT wall_time FROM runs WHERE script = ? AND termination = 'stopped' ORDER BY wall_time", (script,)
+            ).fetchall()
+        if not rows:
+            return None
+        return percentile([row[0] for row in rows], 0.5)
+
+    def runs(self, script: Optional[str] = None, limit: int = 100) -> List[JobResult]:
+        # Most recent runs first
+        query = ("SELECT script, args, start_time, end_time, exit_code, user_cpu, sys_cpu, max_rss, termination, "
+                 "leftovers FROM runs")
+        parameters = ()
+        if script is not None:
+            query += " WHERE script = ?"
+            parameters = (script,)
+        query += " ORDER BY start_time DESC LIMIT ?"
+
+        with self.connect() as connection:
+            rows = connection.execute(query, parameters + (limit,)).fetchall()
+        return [JobResult(row[0], json.loads(row[1]), *row[2:]) for row in rows]
+
+    def summary(self) -> List[ScriptSummary]:
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT script, wall_time, exit_code, user_cpu + sys_cpu, max_rss, termination FROM runs "
+                "ORDER BY script, start_time"
+            ).fetchall()
+
+        # Group the runs by script, keeping them in chronological order
+        runs_by_script = {}
+        for script, wall_time, exit_code, cpu, max_rss, termination in rows:
+            runs_by_script.setdefault(script, []).append((wall_time, exit_code, cpu, max_rss, termination))
+
+        summaries = []
+        for script, runs in runs_by_script.items():
+            wall_times = sorted(run[0] for run in runs)
+            recent_wall_times = sorted(run[0] for run in runs[-RECENT_RUNS:])
+            summaries.append(
+                ScriptSummary(
+                    script=script,
+                    runs=len(runs),
+                    failures=sum(1 for run in runs if run[1] != 0),
+                    timeouts=sum(1 for run in runs if run[4] == "timeout"),
+                    p50=percentile(wall_times, 0.5),
+                    p90=percentile(wall_times, 0.9),
+                    p99=percentile(wall_times, 0.99),
+                    recent_p50=percentile(recent_wall_times, 0.5),
+                    mean_cpu=sum(run[2] for run in runs) / len(runs),
+                    max_rss=max(run[3] for run in runs),
+                )
+            )
+        return summaries
@@ -0,0 +1,239 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import disk_devices, sampler_intervals, sampler_timeout
+from core.disk_forecast import DiskForecast, DiskForecaster
+from core.disk_io import DiskIoSample, io_sample, mount_block_devices, read_diskstats
+from core.docker import container_states
+from core.docker_usage import DockerUsage, DockerUsageCache
+
+
+@dataclass(frozen=True)
+class DiskSample:
+    device: str
+    mount_point: str
+    mounted: bool = False
+    total: int = 0  # Bytes
+    used: int = 0
+    free: int = 0
+    responding: bool = True  # False while the mount point does not answer (e.g. a hung NFS share)
+    sample_time: float = 0.0  # When the values were read, older than the snapshot when not responding
+
+    @property
+    def used_fraction(self) -> float:
+        return self.used / self.total if self.total else 0.0
+
+
+@dataclass(frozen=True)
+class MemorySample:
+    total: int = 0  # Bytes
+    available: int = 0
+    swap_total: int = 0
+    swap_free: int = 0
+
+
+@dataclass(frozen=True)
+class ContainerSample:
+    name: str
+    state: str  # "running", "exited", "restarting", ...
+
+
+@dataclass(frozen=True)
+class SystemSnapshot:
+    # Published as a whole and never modified: widgets can keep it and read it from any thread
+    time: float = 0.0
+    disks: Tuple[DiskSample, ...] = ()
+    disk_io: Tuple[DiskIoSample, ...] = ()  # Only for the devices mounted on a block device
+    forecasts: Tuple[DiskForecast, ...] = ()  # Only for the mounted devices that answer
+    memory: Optional[MemorySample] = None
+    cpu_percent: Optional[float] = None
+    load: Optional[Tuple[float, float, float]] = None
+    containers: Optional[Tuple[ContainerSample, ...]] = None  # None when docker does not answer
+    docker_usage: Optional[DockerUsage] = None  # Last reading, up to docker_usage_ttl seconds old
+    errors: Dict[str, str] = field(default_factory=dict)  # Last error of each kind of data, if it failed
+
+
+def read_memory() -> MemorySample:
+    values = {}
+    with open("/proc/meminfo", "r") as meminfo_file:
+        for line in meminfo_file:
+            name, value = line.split(":", 1)
+            values[name] = int(value.split()[0]) * 1024  # Given in kB
+    return MemorySample(values["MemTotal"], values["MemAvailable"], values["SwapTotal"], values["SwapFree"])
+
+
+def read_cpu_times() -> Tuple[int, int]:
+    # Busy and total jiffies of all the CPUs since boot
+    with open("/proc/stat", "r") as stat_file:
+        fields = [int(value) for value in stat_file.readline().split()[1:]]
+    idle = fields[3] + fields[4]  # idle + iowait
+    total = sum(fields[:8])  # Without guest times, already counted in user and nice
+    return total - idle, total
+
+
+class MountProbe:
+    # Reads the usage of a mount point in its own thread: statvfs on a hung mount blocks in the kernel and cannot be
+    # interrupted, so the sampler only waits for it up to sampler_timeout, and never starts a second read on a mount
+    # point whose previous read is still stuck
+    def __init__(self, device: str, mount_point: str):
+        self.device = device
+        self.mount_point = mount_point
+        self.sample = DiskSample(device, mount_point)
+        self.thread: Optional[threading.Thread] = None
+        self.done = threading.Event()
+        self.stuck = False
+
+    def read(self):
+        try:
+            usage = shutil.disk_usage(self.mount_point) if os.path.exists(self.mount_point) else None
+        except OSError:
+            usage = None  # e.g. not readable by the ToolBox user, shown as not mounted
+        if usage is not None:
+            self.sample = DiskSample(self.device, self.mount_point, True, usage.total, usage.used, usage.free,
+                                     sample_time=time.time())
+        else:
+            self.sample = DiskSample(self.device, self.mount_point, sample_time=time.time())
+        self.done.set()
+
+    def start(self):
+        # Still stuck in the previous read: do not wait for it again
+        self.stuck = self.thread is not None and not self.done.is_set()
+        if not self.stuck:
+            self.done.clear()
+            self.thread = threading.Thread(target=self.read, name=f"sampler {self.mount_point}", daemon=True)
+            self.thread.start()
+
+    def result(self, deadline: float) -> DiskSample:
+        if not self.stuck and self.done.wait(max(0.0, deadline - time.monotonic())):
+            return self.sample
+        # Still stuck: keep showing the last values read
+        return replace(self.sample, responding=False)
+
+
+class SystemSampler:
+    def __init__(self, intervals: Dict[str, float] = None, timeout: float = sampler_timeout):
+        self.intervals = dict(sampler_intervals if intervals is None else intervals)
+        self.timeout = timeout
+        self.probes = [MountProbe(device, mount_point) for device, mount_point in disk_devices.items()]
+        self.cpu_times: Optional[Tuple[int, int]] = None
+        self.disk_counters = {}  # Last counters read for each device, with the time they were read
+        self.forecaster = DiskForecaster()
+        self.docker_usage = DockerUsageCache()
+
+        self.snapshot = SystemSnapshot()
+        self.subscribers: List[Callable[[SystemSnapshot], None]] = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def subscribe(self, callback: Callable[[SystemSnapshot], None]):
+        # The callback is called from the sampler thread with every new snapshot
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def latest(self) -> SystemSnapshot:
+        with self.lock:
+            return self.snapshot
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="system sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def sample_disks(self) -> dict:
+        # Read every mount point at the same time, a hung one only delays the others once
+        for probe in self.probes:
+            probe.start()
+        deadline = time.monotonic() + self.timeout
+        disks = tuple(probe.result(deadline) for probe in self.probes)
+        forecasts = tuple(self.forecaster.update(disk.device, disk.sample_time, disk.used, disk.total, disk.free)
+                          for disk in disks if disk.mounted and disk.responding)
+        return {"disks": disks, "forecasts": forecasts}
+
+    def sample_disk_io(self) -> dict:
+        # Mounts change (e.g. the backup disk plugged in), so find the block devices again at every sample
+        now = time.monotonic()
+        stats = read_diskstats()
+        samples = []
+        counters = {}
+        for device, device_number in mount_block_devices(disk_devices).items():
+            if device_number not in stats:
+                continue
+            block_device, after = stats[device_number]
+            counters[device] = (block_device, after, now)
+            if device in self.disk_counters and self.disk_counters[device][0] == block_device:
+                _, before, before_time = self.disk_counters[device]
+                sample = io_sample(device, block_device, before, after, now - before_time)
+                if sample is not None:
+                    samples.append(sample)
+        self.disk_counters = counters
+        return {"disk_io": tuple(samples)}
+
+    def sample_memory(self) -> dict:
+        return {"memory": read_memory()}
+
+    def sample_cpu(self) -> dict:
+        busy, total = read_cpu_times()
+        previous, self.cpu_times = self.cpu_times, (busy, total)
+        if previous is None or total == previous[1]:
+            return {}  # Needs two readings
+        return {"cpu_percent": 100.0 * (busy - previous[0]) / (total - previous[1])}
+
+    def sample_load(self) -> dict:
+        return {"load": os.getloadavg()}
+
+    def sample_containers(self) -> dict:
+        states = container_states(timeout=self.timeout)
+        return {"containers": tuple(ContainerSample(name, state) for name, state in states)}
+
+    def sample_docker_usage(self) -> dict:
+        # Never waits for docker: the cache is read again in its own thread once it is too old
+        usage = self.docker_usage.get()
+        if self.docker_usage.error is not None:
+            # Reported with the errors of the other kinds of data, the last reading that worked is kept
+            raise OSError(self.docker_usage.error)
+        return {"docker_usage": usage} if usage is not None else {}
+
+    def run(self):
+        samplers = {
+            "disks": self.sample_disks,
+            "disk_io": self.sample_disk_io,
+            "memory": self.sample_memory,
+            "cpu": self.sample_cpu,
+            "load": self.sample_load,
+            "containers": self.sample_containers,
+            "docker_usage": self.sample_docker_usage,
+        }
+        next_times = {name: 0.0 for name in samplers if self.intervals.get(name)}
+
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            changes = {}
+            errors = dict(self.snapshot.errors)
+            for name, next_time in next_times.items():
+                if now < next_time:
+                    continue
+                next_times[name] = now + self.intervals[name]
+                try:
+                    changes.update(samplers[name]())
+                    errors.pop(name, None)
+                except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+                    errors[name] = str(e)
+                    if name == "containers":
+                        changes["containers"] = None
+
+            if changes or errors != self.snapshot.errors:
+                with self.lock:
+                    self.snapshot = replace(self.snapshot, time=time.time(), errors=errors, **changes)
+                    snapshot, subscribers = self.snapshot, list(self.subscribers)
+                for callback in subscribers:
+                    callback(snapshot)
+
+            self.stop_event.wait(max(0.0, min(next_times.values()) - time.monotonic()) if next_times else 1.0)
@@ -0,0 +1,215 @@
+import argparse
+import importlib
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from config import worker_pool_size, worker_preload_modules
+
+
+def runs_in_worker(argv: List[str]) -> bool:
+    # Only "python <script>.py ..." commands, as built by core.catalog.script_command
+    return len(argv) >= 2 and argv[0] == sys.executable and argv[1].endswith(".py")
+
+
+def start_worker() -> subprocess.Popen:
+    # Started like the jobs: own session (so the job can be stopped with its process group), merged output, and
+    # unbuffered so the output of the script is streamed as it is printed. The worker reports the resources its
+    # imports used on a pipe of its own, the job subtracts them from its resource usage.
+    report_read, report_write = os.pipe()
+    try:
+        worker = subprocess.Popen(
+            [sys.executable, "-u", "-m", "core.worker_pool", "worker", "--report-fd", str(report_write)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            start_new_session=True,
+            pass_fds=(report_write,),
+        )
+    except OSError:
+        os.close(report_read)
+        raise
+    finally:
+        os.close(report_write)
+    worker.preload_report = report_read
+    return worker
+
+
+def close_report(worker: subprocess.Popen):
+    if getattr(worker, "preload_report", None) is not None:
+        os.close(worker.preload_report)
+        worker.preload_report = None
+
+
+def preload_usage(process: subprocess.Popen) -> Optional[dict]:
+    # Resources used by the imports of a worker before it ran its script (user_cpu, sys_cpu, max_rss), None for a
+    # process that was not started by the pool. Read once the process exited.
+    if getattr(process, "preload_report", None) is None:
+        return None
+    chunks = []
+    while True:
+        chunk = os.read(process.preload_report, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    close_report(process)
+    try:
+        return json.loads(b"".join(chunks))
+    except ValueError:
+        return None  # It exited before its imports were done
+
+
+class WorkerPool:
+    # Python interpreters started in advance, each waiting on its stdin for the one script it will run
+    def __init__(self, size: int = worker_pool_size):
+        self.size = size
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+    def fill(self):
+        with self.lock:
+            # Forget the workers that exited while waiting (e.g. killed by hand)
+            for worker in self.idle:
+                if worker.poll() is not None:
+                    close_report(worker)
+            self.idle = deque(worker for worker in self.idle if worker.poll() is None)
+            missing = self.size - len(self.idle)
+            for _ in range(missing):
+                self.idle.append(start_worker())
+
+    def start(self, argv: List[str], env: Optional[dict] = None) -> Optional[subprocess.Popen]:
+        # Run the python script of argv in a waiting worker, None when the command cannot run in one
+        if not runs_in_worker(argv):
+            return None
+
+        with self.lock:
+            worker = None
+            while self.idle and worker is None:
+                candidate = self.idle.popleft()
+                if candidate.poll() is None:
+                    worker = candidate
+                else:
+                    close_report(candidate)
+        # Replace the worker in the background, starting an interpreter is what the pool saves to the job
+        threading.Thread(target=self.fill, daemon=True).start()
+        if worker is None:
+            return None
+
+        try:
+            worker.stdin.write(json.dumps({"argv": argv[1:], "env": env}) + "\n")
+            worker.stdin.close()
+        except BrokenPipeError:
+            close_report(worker)
+            return None  # It exited in the meantime, the job is started the usual way
+        # Nothing else is written to its input
+        worker.stdin = None
+        return worker
+
+    def close(self):
+        # The waiting workers exit when their input is closed
+        with self.lock:
+            for worker in self.idle:
+                worker.stdin.close()
+                close_report(worker)
+            self.idle.clear()
+
+
+def run_worker(report_fd: Optional[int] = None):
+    # Runs in the waiting interpreter: import what the scripts use, then wait for the script to run
+    os.environ.setdefault("MPLBACKEND", "Agg")  # The scripts run without a display
+    for module in worker_preload_modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass  # Not installed here, the script imports it (or fails) itself
+
+    # What the imports cost, not to be counted in the run history of the script
+    if report_fd is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        with os.fdopen(report_fd, "w") as report:
+            json.dump({"user_cpu": usage.ru_utime, "sys_cpu": usage.ru_stime, "max_rss": usage.ru_maxrss}, report)
+
+    request = sys.stdin.readline()
+    if not request:
+        return  # The pool was closed
+    request = json.loads(request)
+
+    # The script gets no input, like the jobs started without one
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    # Run the script as "python <script> <args>" would
+    if request["env"]:
+        os.environ.update(request["env"])
+    script = request["argv"][0]
+    sys.argv = request["argv"]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    runpy.run_path(script, run_name="__main__")
+
+
+def first_output_latency(argv: List[str], pool: Optional[WorkerPool]) -> float:
+    # Seconds from asking for the job (the click) to its first line of output
+    start = time.monotonic()
+    process = pool.start(argv) if pool is not None else None
+    if process is None:
+        process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, text=True, start_new_session=True)
+    process.stdout.readline()
+    latency = time.monotonic() - start
+    process.stdout.read()
+    process.wait()
+    close_report(process)
+    return latency
+
+
+def benchmark(args):
+    from core.eta import percentile
+
+    argv = [sys.executable, args.script] + args.args
+    pool = WorkerPool(size=1)
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        cold.append(first_output_latency(argv, None))
+
+        # Let the replacement worker finish its imports, as it would between two clicks
+        pool.fill()
+        time.sleep(args.warmup)
+        warm.append(first_output_latency(argv, pool))
+    pool.close()
+
+    for name, latencies in (("new interpreter", cold), ("waiting worker", warm)):
+        latencies.sort()
+        print(f"{name:<16} first output after p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+              f"p90 {percentile(latencies, 0.9) * 1000:.0f} ms ({len(latencies)} runs)", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Python interpreters waiting to run the ToolBox python scripts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = subparsers.add_parser("worker", help="wait for a script on stdin (started by the pool)")
+    worker_parser.add_argument("--report-fd", type=int, help="file descriptor to write the cost of the imports to")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="compare the latency to the first line of output")
+    benchmark_parser.add_argument("--runs", type=int, default=10)
+    benchmark_parser.add_argument("--warmup", type=float, default=2.0, help="seconds left to a worker to start")
+    benchmark_parser.add_argument("script")
+    benchmark_parser.add_argument("args", nargs=argparse.REMAINDER)
+
+    parsed_args = parser.parse_args()
+    if parsed_args.command == "worker":
+        run_worker(parsed_args.report_fd)
+    else:
+        benchmark(parsed_args)
@@ -2,8 +2,10 @@
 
 echo "Cleaning disk, please wait..."
 
-find /ramdisk -mindepth 1 ! -regex '^./ramdisk/background\(/.*\)?' -delete
+# The background folder is kept, everything else is deleted by several threads
+TOOLBOX_DIRECTORY="$(cd "$(dirname "$0")/../.." && pwd)"
+(cd "$TOOLBOX_DIRECTORY" && python3 -m core.disk_cleaner clean /ramdisk --exclude /background)
 ./installation/restart_sapiens_acquisition.sh
 
 echo ""
-echo "Disk cleaned"
\ No newline at end of file
+echo "Disk cleaned"
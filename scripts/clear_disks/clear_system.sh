@@ -1,9 +1,15 @@
 #!/bin/bash
 
-echo "Cleaning disk, please wait... (only unused docker images will be cleaned)"
+echo "Cleaning disk, please wait... (only the docker images no recent release needs will be removed)"
 echo ""
 
-docker system prune -a -f
+# The images of the installed release and of the most recent release files are kept, the others are removed least
+# recently used first, with the space each one freed
+TOOLBOX_DIRECTORY="$(cd "$(dirname "$0")/../.." && pwd)"
+(cd "$TOOLBOX_DIRECTORY" && python3 -m core.image_cache evict)
+docker container prune -f
+docker network prune -f
+docker builder prune -f
 
 echo ""
-echo "Disk cleaned"
\ No newline at end of file
+echo "Disk cleaned"
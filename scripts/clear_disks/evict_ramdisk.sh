@@ -0,0 +1,10 @@
+#!/bin/bash
+
+echo "Deleting the oldest acquisitions until the ramdisk is 60% full, please wait..."
+
+# The recent acquisitions and the background folder are kept
+TOOLBOX_DIRECTORY="$(cd "$(dirname "$0")/../.." && pwd)"
+(cd "$TOOLBOX_DIRECTORY" && python3 -m core.disk_eviction /ramdisk --budget 60% --exclude /background)
+
+echo ""
+echo "Disk cleaned"
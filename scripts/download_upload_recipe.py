@@ -3,17 +3,32 @@
 ##################################################
 __NAME__ = f'Delvitech Recipe Conveyor'
 __DESCRIPTION__ = 'lightweight utility to download, upload, and export in JSON format Neith Recipes.'
-__VERSION_ = 'v1.0.4'
+__VERSION_ = 'v1.5.3'
 __AUTHOR__ = 'Matteo Riva'
 ##################################################
 ## Usage: call this script from terminal, read tutorial by calling it with the --help flag.
 ##################################################
 
 import os
+import sys
+import glob
 import json
+import time
+import base64
+import fnmatch
 import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # optional, parses and writes large Recipes several times faster than json
+except ImportError:
+    orjson = None
 
 ##################################################
 ############## MUTABLE PARAMETERS ################
@@ -22,26 +37,173 @@ import requests
 PROTO_SCHEME = 'http://'
 PORT = 3000
 
+CONNECT_TIMEOUT = 5  # seconds to open a connection to a Neith host
+READ_TIMEOUT = 60  # seconds to wait for an answer of a Neith host
+RETRIES = 3  # attempts after a failed connection or a 502/503/504 answer
+WORKERS = 8  # Recipes transferred at the same time by the bulk modes
+RECIPE_FILE = 'recipe_id*_v*.json'  # files uploaded from a folder, as named by save_recipe_to_path
+CHUNK_SIZE = 1024 * 1024  # bytes written at a time when a Recipe is saved as the host sends it
+
+TOKEN_CACHE = '~/.toolbox/neith_tokens.json'  # access tokens kept between runs, shared with run_inspection.py
+TOKEN_MARGIN = 60  # seconds before its expiry a cached token is not used anymore
+
+SYNC_STATE = '~/.toolbox/recipe_sync.json'  # Recipes already synchronized, by pair of hosts
+
 ##################################################
-################## UTIL FUNCS ####################
+################## TOKEN CACHE ###################
 ##################################################
 
-def login(ip, user, password, verbose):
-    auth_dict = {"username": user, "password": password}
+# Tokens are kept between runs, by host and user, until shortly before the expiry written in them (the "exp" claim
+# of the JWT): a job started again right away does not log in again. The file is only readable by its owner.
 
-    r_login = requests.post(f'{PROTO_SCHEME}{ip}:{PORT}/v1/auth/login', json=auth_dict)
-    login_token = r_login.json()['access_token']
+def token_expiry(token):
+    # Expiry of a JWT as a timestamp, None when it cannot be read
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+def is_token_entry(entry):
+    return isinstance(entry, dict) and isinstance(entry.get('token'), str) \
+        and isinstance(entry.get('expires'), (int, float))
+
+def read_token_cache():
+    # Only the well-formed entries: one edited by hand or left by another version is a cache miss
+    try:
+        with open(os.path.expanduser(TOKEN_CACHE), 'r') as infile:
+            cache = json.load(infile)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return {key: entry for key, entry in cache.items() if is_token_entry(entry)}
+
+def write_token_cache(cache):
+    # Written to a temporary file first, so a run reading it at the same time never sees half a cache. Two runs
+    # writing it at the same time can lose a token, which only costs a login.
+    path = os.path.expanduser(TOKEN_CACHE)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}'
+    with os.fdopen(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as outfile:
+        json.dump(cache, outfile)
+    os.replace(temporary_path, path)
+
+def get_cached_token(ip, user):
+    entry = read_token_cache().get(f'{user}@{ip}:{PORT}')
+    if entry is None or entry['expires'] - TOKEN_MARGIN < time.time():
+        return None
+    return entry['token']
+
+def cache_token(ip, user, token):
+    expires = token_expiry(token)
+    now = time.time()
+    cache = {key: entry for key, entry in read_token_cache().items() if entry['expires'] > now}
+    if expires is not None:
+        cache[f'{user}@{ip}:{PORT}'] = {'token': token, 'expires': expires}
+    try:
+        write_token_cache(cache)
+    except OSError as e:
+        print(f'Could not cache the access token: {e}')
+
+def forget_token(ip, user):
+    cache = read_token_cache()
+    if cache.pop(f'{user}@{ip}:{PORT}', None) is not None:
+        try:
+            write_token_cache(cache)
+        except OSError:
+            pass
 
-    if verbose:
-        print(f'ACCESS_TOKEN for {ip}: {login_token}')
+##################################################
+################## UTIL FUNCS ####################
+##################################################
 
-    return login_token
+class NeithClient:
+    # One Neith host: a single session keeps the connections alive between the requests, and one token (cached
+    # between runs) is used by all of them
+    def __init__(self, ip, user, password, timeout=READ_TIMEOUT, retries=RETRIES, verbose=False, pool_size=10):
+        self.ip = ip
+        self.url = f'{PROTO_SCHEME}{ip}:{PORT}'
+        self.user = user
+        self.password = password
+        self.timeout = (CONNECT_TIMEOUT, timeout)
+        self.verbose = verbose
+        self.token = None
+        self.lock = threading.Lock()  # a single login at a time for the bulk transfers
+
+        # Only idempotent requests are sent again after a failed answer, an upload is never duplicated
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount(PROTO_SCHEME, adapter)
+
+    def login(self, refresh=False):
+        token = None if refresh else get_cached_token(self.ip, self.user)
+        cached = token is not None
+        if not cached:
+            auth_dict = {"username": self.user, "password": self.password}
+
+            r_login = self.session.post(f'{self.url}/v1/auth/login', json=auth_dict, timeout=self.timeout)
+            r_login.raise_for_status()
+            token = r_login.json()['access_token']
+            cache_token(self.ip, self.user, token)
+        self.token = token
+
+        if self.verbose:
+            print(f'ACCESS_TOKEN for {self.ip}{" (cached)" if cached else ""}: {self.token}')
+
+        return self.token
+
+    def authenticate(self, rejected_token=None):
+        # The token to use, logging in again if it is the one the host just rejected (unless another thread did)
+        with self.lock:
+            if self.token is None:
+                self.login()
+            elif self.token == rejected_token:
+                forget_token(self.ip, self.user)
+                self.login(refresh=True)
+            return self.token
+
+    def request(self, method, endpoint, **kwargs):
+        headers = {}
+        if 'json' in kwargs:
+            kwargs['data'] = dump_json(kwargs.pop('json'))
+        if 'data' in kwargs:
+            headers['Content-Type'] = 'application/json'
+
+        token = self.authenticate()
+        for attempt in range(2):
+            headers['Cookie'] = f'access_token={token}'
+            response = self.session.request(method, f'{self.url}{endpoint}', headers=headers, timeout=self.timeout,
+                                            **kwargs)
+            if response.status_code != 401 or attempt == 1:
+                return response
+
+            # Expired early or revoked (e.g. the host was reinstalled): log in again and send it once more
+            response.close()
+            token = self.authenticate(rejected_token=token)
+
+    def close(self):
+        self.session.close()
 
 def sanitize_path(path):
     path = os.path.expanduser(path)
     path = os.path.normpath(path)
     return path
 
+def load_json(data):
+    # Neith answers in UTF-8: the bytes are parsed as they are, without guessing their charset first (which reads
+    # through the whole thumbnail and background images of a Recipe)
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dump_json(obj, indent=False):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
 def check_response(response):
     is_good_response = 'pcba_descriptor' in response
     if is_good_response:
@@ -53,102 +215,445 @@ def check_response(response):
 
 ##################################################
 
-def delete_recipe_from_ip(ip, token, recipe_id):
-    print(f'Deleting Recipe from {ip}... ', end='', flush=True)
+def delete_recipe_from_ip(client, recipe_id):
+    print(f'Deleting Recipe from {client.ip}... ', end='', flush=True)
 
-    auth_header = {'Cookie': f'access_token={token}'}
-    r_delete_recipe = requests.delete(url=f'{PROTO_SCHEME}{ip}:{PORT}/v1/recipe/{recipe_id}',
-                                      headers=auth_header)
+    r_delete_recipe = client.request('DELETE', f'/v1/recipe/{recipe_id}')
 
     if r_delete_recipe.ok:
         print(f'done :)')
     else:
         print('failed :(')
-        print(f'Something went wrong, target ({ip}) response:\n{r_delete_recipe}')
-
-def get_recipe_from_ip(ip, token, recipe_id, recipe_ver):
-    print(f'Downloading Recipe from {ip}... ', end='', flush=True)
+        print(f'Something went wrong, target ({client.ip}) response:\n{r_delete_recipe}')
 
-    auth_header = {'Cookie': f'access_token={token}'}
-    r_get_recipe = requests.get(url=f'{PROTO_SCHEME}{ip}:{PORT}/v1/recipe/{recipe_id}/{recipe_ver}',
-                                headers=auth_header)
+def get_recipe_from_ip(client, recipe_id, recipe_ver):
+    print(f'Downloading Recipe from {client.ip}... ', end='', flush=True)
 
-    r_get_recipe.encoding = r_get_recipe.apparent_encoding
-    response = r_get_recipe.json()
+    r_get_recipe = client.request('GET', f'/v1/recipe/{recipe_id}/{recipe_ver}')
+    response = load_json(r_get_recipe.content)
 
     if not check_response(response):
-        print(f'Something went wrong, target ({ip}) response:\n{response}')
+        print(f'Something went wrong, target ({client.ip}) response:\n{response}')
 
     return response
 
 def get_recipe_from_path(path):
     path = sanitize_path(path)
-    with open(path, 'r') as infile:
-        recipe = json.load(infile)
+    with open(path, 'rb') as infile:
+        recipe = load_json(infile.read())
     return recipe
 
 ##################################################
 
-def save_recipe_to_ip(ip, token, recipe):
-    print(f'Uploading recipe to {ip}... ', end='', flush=True)
+def save_recipe_to_ip(client, recipe):
+    print(f'Uploading recipe to {client.ip}... ', end='', flush=True)
 
-    auth_header = {'Cookie': f'access_token={token}'}
-    r_save_recipe = requests.post(url=f'{PROTO_SCHEME}{ip}:{PORT}/v1/recipe/',
-                                  headers=auth_header,
-                                  json=recipe)
-    r_save_recipe.encoding = r_save_recipe.apparent_encoding
-    response = r_save_recipe.json()
+    r_save_recipe = client.request('POST', '/v1/recipe/', json=recipe)
+    response = load_json(r_save_recipe.content)
 
     if check_response(response):
         print(f"New RecipeID: {response['pcba_descriptor']['id']}, Version: {response['pcba_descriptor']['version']}, Name: {response['pcba_descriptor']['recipe_name']}")
+        return True
     else:
-        print(f'Something went wrong, target ({ip}) response:\n{response}')
-
-def save_recipe_to_path(path, recipe):
-    recipe_id = recipe['pcba_descriptor']['id']
-    recipe_ver = recipe['pcba_descriptor']['version']
+        print(f'Something went wrong, target ({client.ip}) response:\n{response}')
+        return False
 
+def recipe_path(path, recipe_id, recipe_ver):
     path = os.path.join(path, f'recipe_id{recipe_id}_v{recipe_ver}.json')
-    path = sanitize_path(path)
+    return sanitize_path(path)
+
+def save_recipe_to_path(path, recipe):
+    path = recipe_path(path, recipe['pcba_descriptor']['id'], recipe['pcba_descriptor']['version'])
 
     print(f'Saving Recipe to "{path}"... ', end='', flush=True)
     try:
-        with open(path, 'w') as outfile:
-            json.dump(recipe, outfile, indent=2)
+        with open(path, 'wb') as outfile:
+            outfile.write(dump_json(recipe, indent=True))
         print(f'done :)')
+        return True
     except Exception as e:
         print(f'failed :(\n{e}')
+        return False
+
+def download_recipe_to_path(client, recipe_id, recipe_ver, path):
+    # Writes the Recipe to its file as the host sends it, without parsing it: used when it is saved unchanged.
+    # Returns the path of the file.
+    path = recipe_path(path, recipe_id, recipe_ver)
+    marker = b'"pcba_descriptor"'
+
+    with client.request('GET', f'/v1/recipe/{recipe_id}/{recipe_ver}', stream=True) as r_get_recipe:
+        if not r_get_recipe.ok:
+            raise ValueError(f'target ({client.ip}) response: {r_get_recipe.status_code} {r_get_recipe.text[:200]}')
+
+        # Written next to the file first: an interrupted transfer never leaves half a Recipe behind
+        is_recipe = False
+        tail = b''
+        with open(f'{path}.part', 'wb') as outfile:
+            for chunk in r_get_recipe.iter_content(CHUNK_SIZE):
+                outfile.write(chunk)
+                is_recipe = is_recipe or marker in tail + chunk
+                tail = chunk[-len(marker):]
+
+    if not is_recipe:
+        os.remove(f'{path}.part')
+        raise ValueError(f'target ({client.ip}) response is not a Recipe')
+    os.replace(f'{path}.part', path)
+    return path
+
+def save_recipe_from_ip_to_path(client, recipe_id, recipe_ver, path):
+    file_path = recipe_path(path, recipe_id, recipe_ver)
+    print(f'Downloading Recipe from {client.ip} to "{file_path}"... ', end='', flush=True)
+    try:
+        download_recipe_to_path(client, recipe_id, recipe_ver, path)
+        print(f'done :)')
+        return True
+    except (ValueError, OSError) as e:
+        print(f'failed :(\n{e}')
+        return False
 
 ##################################################
 
 def rename_recipe(recipe, new_name):
     new_name = new_name.replace('~name~', recipe['pcba_descriptor']['recipe_name'])
+    new_name = new_name.replace('~id~', str(recipe['pcba_descriptor']['id']))
+    new_name = new_name.replace('~version~', str(recipe['pcba_descriptor']['version']))
     recipe['pcba_descriptor']['recipe_name'] = new_name
     return recipe
 
 ##################################################
+################### BULK MODES ###################
+##################################################
+
+def parse_ids(ids):
+    # '1-500,600' -> {1, ..., 500, 600}
+    recipe_ids = set()
+    for part in ids.split(','):
+        first, _, last = part.partition('-')
+        recipe_ids.update(range(int(first), int(last or first) + 1))
+    return recipe_ids
+
+def list_recipes_from_ip(client):
+    # Descriptor of the latest version of every Recipe of the host, {id: pcba_descriptor}
+    r_list_recipes = client.request('GET', '/v1/recipe/')
+    r_list_recipes.raise_for_status()
+
+    latest = {}
+    for entry in load_json(r_list_recipes.content):
+        descriptor = entry.get('pcba_descriptor', entry)
+        if descriptor['version'] > latest.get(descriptor['id'], {}).get('version', 0):
+            latest[descriptor['id']] = descriptor
+    return latest
+
+def upload_recipe(client, recipe):
+    # save_recipe_to_ip without the messages, returns the descriptor of the new Recipe
+    r_save_recipe = client.request('POST', '/v1/recipe/', json=recipe)
+    response = load_json(r_save_recipe.content)
+
+    if 'pcba_descriptor' not in response:
+        raise ValueError(f'target ({client.ip}) response: {response}')
+    return response['pcba_descriptor']
+
+def is_recipe_folder(path):
+    # A folder or a glob of Recipe files, instead of a single file
+    return os.path.isdir(sanitize_path(path)) or any(char in path for char in '*?[')
+
+def find_recipe_files(path):
+    # The recipe_id*_v*.json files of a folder, or matched by a glob
+    path = os.path.expanduser(path)
+    pattern = os.path.join(path, '*') if os.path.isdir(path) else path
+    return sorted(file for file in glob.glob(pattern)
+                  if fnmatch.fnmatch(os.path.basename(file), RECIPE_FILE) and os.path.isfile(file))
+
+def run_transfers(transfer, items, workers, label):
+    # Runs transfer(item) for all the items, at most `workers` at the same time, with a line per finished transfer.
+    # Returns {item: result} for the transfers that worked and {item: error} for the others.
+    done, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(transfer, item): item for item in items}
+        for count, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                done[item] = future.result()
+                print(f'[{count}/{len(futures)}] {label(item)} done :)', flush=True)
+            except (requests.RequestException, ValueError, KeyError, OSError) as e:
+                failed[item] = e
+                print(f'[{count}/{len(futures)}] {label(item)} failed :( {e}', flush=True)
+    return done, failed
+
+def print_failures(failed, label):
+    for item, error in sorted(failed.items()):
+        print(f'  {label(item)}: {error}')
+
+def export_recipes(client, path, recipe_ids, all_versions, workers):
+    # Downloads the latest version (or all the versions) of the Recipes of the host into path, all of them when
+    # recipe_ids is None. Returns whether every Recipe was saved.
+    start_time = time.monotonic()
+    print(f'Listing Recipes of {client.ip}... ', end='', flush=True)
+    latest = list_recipes_from_ip(client)
+    print(f'{len(latest)} found')
+
+    # Requested IDs the host does not have are failed exports, not silently left out
+    missing = []
+    if recipe_ids is not None:
+        missing = sorted(set(recipe_ids) - set(latest))
+        latest = {recipe_id: descriptor for recipe_id, descriptor in latest.items() if recipe_id in recipe_ids}
+    if all_versions:
+        versions = [(recipe_id, version) for recipe_id, descriptor in latest.items()
+                    for version in range(1, descriptor['version'] + 1)]
+    else:
+        versions = [(recipe_id, descriptor['version']) for recipe_id, descriptor in latest.items()]
+
+    path = sanitize_path(path)
+    os.makedirs(path, exist_ok=True)
+
+    def export(item):
+        download_recipe_to_path(client, *item, path)
+
+    label = lambda item: f'recipe_id{item[0]}_v{item[1]}' if item[1] is not None else f'recipe_id{item[0]}'
+    done, failed = run_transfers(export, sorted(versions), workers, label)
+    for recipe_id in missing:
+        failed[(recipe_id, None)] = error = ValueError(f'Recipe {recipe_id} not found on {client.ip}')
+        print(f'{label((recipe_id, None))} failed :( {error}', flush=True)
+
+    print(f'Exported {len(done)} of {len(versions) + len(missing)} Recipes from {client.ip} to "{path}" in '
+          f'{time.monotonic() - start_time:.1f}s, {len(failed)} failed{":" if failed else ""}')
+    print_failures(failed, label)
+    return not failed
+
+def import_recipes(client, path, new_name, manifest_path, workers):
+    # Uploads the Recipe files of a folder (or glob), optionally renamed, and writes a manifest with the new id of
+    # each Recipe. Returns whether every Recipe was uploaded.
+    start_time = time.monotonic()
+    files = find_recipe_files(path)
+    if not files:
+        print(f'No {RECIPE_FILE} file found in "{path}"')
+        return False
+
+    def upload(file):
+        recipe = get_recipe_from_path(file)
+        if 'pcba_descriptor' not in recipe:
+            raise ValueError('not a Recipe, pcba_descriptor is missing')
+        origin = dict(recipe['pcba_descriptor'])
+        if new_name is not None:
+            recipe = rename_recipe(recipe, new_name)
+        return origin, upload_recipe(client, recipe)
+
+    label = os.path.basename
+    done, failed = run_transfers(upload, files, workers, label)
+
+    manifest = {
+        'to_ip': client.ip,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'recipes': [{'file': file,
+                     'id': origin['id'],
+                     'version': origin['version'],
+                     'new_id': descriptor['id'],
+                     'new_version': descriptor['version'],
+                     'recipe_name': descriptor['recipe_name']} for file, (origin, descriptor) in sorted(done.items())],
+        'failed': [{'file': file, 'error': str(error)} for file, error in sorted(failed.items())],
+    }
+    with open(manifest_path, 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+
+    print(f'Imported {len(done)} of {len(files)} Recipes to {client.ip} in {time.monotonic() - start_time:.1f}s, '
+          f'{len(failed)} failed{":" if failed else ""}')
+    print_failures(failed, label)
+    print(f'New Recipe IDs written to "{manifest_path}"')
+    return not failed
+
+def updated_time(descriptor):
+    # pcba_descriptor.lastUpdated as a timestamp, 0 when it is missing
+    try:
+        return datetime.fromisoformat(descriptor['lastUpdated'].replace('Z', '+00:00')).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return 0.0
+
+def recipes_by_name(client):
+    # Most recently updated Recipe of the host for each name, {recipe_name: pcba_descriptor}
+    recipes = {}
+    for descriptor in list_recipes_from_ip(client).values():
+        other = recipes.get(descriptor['recipe_name'])
+        if other is None or (updated_time(descriptor), descriptor['version']) > (updated_time(other), other['version']):
+            recipes[descriptor['recipe_name']] = descriptor
+    return recipes
+
+def read_sync_state():
+    try:
+        with open(os.path.expanduser(SYNC_STATE), 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def write_sync_state(state):
+    path = os.path.expanduser(SYNC_STATE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}'
+    with open(temporary_path, 'w') as outfile:
+        json.dump(state, outfile, indent=2)
+    os.replace(temporary_path, path)
+
+def compare_recipes(source, target, synced):
+    # What to do with each Recipe name of the source, {recipe_name: (change, id of its copy on the target)}, the
+    # change being 'missing' or 'newer' (to transfer) or 'same'. synced holds, by name, the source Recipe last
+    # transferred (or found up to date) and its copy on the target: as long as neither changed, the Recipe is not
+    # compared again.
+    target_ids = {descriptor['id'] for descriptor in target.values()}
+    changes = {}
+    for name, descriptor in source.items():
+        origin = [descriptor['id'], descriptor['version'], descriptor.get('lastUpdated')]
+        entry = synced.get(name)
+        if entry is not None and entry['target_id'] in target_ids:
+            changes[name] = ('same' if entry['source'] == origin else 'newer', entry['target_id'])
+        elif name not in target:
+            changes[name] = ('missing', None)
+        else:
+            # Versions are counted per host (an upload starts at 1): they only tell which one is newer when neither
+            # Recipe has a last update time
+            copy = target[name]
+            if updated_time(descriptor) or updated_time(copy):
+                newer = updated_time(descriptor) > updated_time(copy)
+            else:
+                newer = descriptor['version'] > copy['version']
+            changes[name] = ('newer' if newer else 'same', copy['id'])
+    return changes
+
+def transfer_recipe(src_client, trg_client, descriptor):
+    # Sends the Recipe to the target as the source sends it, without parsing it. Returns the new pcba_descriptor.
+    r_get_recipe = src_client.request('GET', f'/v1/recipe/{descriptor["id"]}/{descriptor["version"]}')
+    if not r_get_recipe.ok or b'"pcba_descriptor"' not in r_get_recipe.content:
+        raise ValueError(f'source ({src_client.ip}) response: {r_get_recipe.status_code} {r_get_recipe.text[:200]}')
+
+    r_save_recipe = trg_client.request('POST', '/v1/recipe/', data=r_get_recipe.content)
+    response = load_json(r_save_recipe.content)
+    if 'pcba_descriptor' not in response:
+        raise ValueError(f'target ({trg_client.ip}) response: {response}')
+    return response['pcba_descriptor']
+
+def sync_recipes(src_client, trg_client, dry_run, workers):
+    # Transfers the Recipes of the source that the target does not have, or has in an older state, comparing them by
+    # name, version and lastUpdated. Returns whether every transfer worked.
+    start_time = time.monotonic()
+    print(f'Listing Recipes of {src_client.ip} and {trg_client.ip}... ', end='', flush=True)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        source_listing = executor.submit(recipes_by_name, src_client)
+        target_listing = executor.submit(recipes_by_name, trg_client)
+        source, target = source_listing.result(), target_listing.result()
+    print(f'{len(source)} and {len(target)} found')
+
+    state = read_sync_state()
+    pair = f'{src_client.ip}:{PORT} -> {trg_client.ip}:{PORT}'
+    synced = state.get(pair, {})
+    changes = compare_recipes(source, target, synced)
+
+    to_transfer = sorted(name for name, (change, _) in changes.items() if change != 'same')
+    for name in to_transfer:
+        descriptor = source[name]
+        line = f'{changes[name][0]:<8} {name} (id {descriptor["id"]} v{descriptor["version"]}, ' \
+               f'updated {descriptor.get("lastUpdated", "never")})'
+        if name in target:
+            copy = target[name]
+            line += f', on {trg_client.ip}: id {copy["id"]} v{copy["version"]}, ' \
+                    f'updated {copy.get("lastUpdated", "never")}'
+        print(line)
+    print(f'{len(changes) - len(to_transfer)} Recipes up to date, {len(to_transfer)} to transfer')
+
+    if dry_run:
+        return True
+
+    def transfer(name):
+        return transfer_recipe(src_client, trg_client, source[name])
+
+    done, failed = run_transfers(transfer, to_transfer, workers, str)
+
+    # Remembered, so the next sync does not compare or transfer them again
+    for name, (change, target_id) in changes.items():
+        descriptor = source[name]
+        if name in done:
+            target_id = done[name]['id']
+        elif change != 'same':
+            continue
+        synced[name] = {'source': [descriptor['id'], descriptor['version'], descriptor.get('lastUpdated')],
+                        'target_id': target_id}
+    state[pair] = {name: entry for name, entry in synced.items() if name in source}
+    write_sync_state(state)
+
+    print(f'Synchronized {len(done)} of {len(to_transfer)} Recipes from {src_client.ip} to {trg_client.ip} in '
+          f'{time.monotonic() - start_time:.1f}s, {len(failed)} failed{":" if failed else ""}')
+    print_failures(failed, str)
+    return not failed
+
+##################################################
+
+def connect(args, ip):
+    usr, pwd = args.credentials.split(':')
+    return NeithClient(ip=ip,
+                       user=usr,
+                       password=pwd,
+                       timeout=args.timeout,
+                       retries=args.retries,
+                       verbose=args.verbose,
+                       pool_size=args.workers)
 
 def main(args):
+    # One client per host: the same host is logged in once, whether it is the origin or the target
+    src_client = None
+    if args.from_ip is not None:
+        src_client = connect(args, args.from_ip)
+
+    # Bulk export of many Recipes
+    if args.all or args.ids is not None:
+        if not export_recipes(client=src_client,
+                              path=args.to_path,
+                              recipe_ids=args.ids,
+                              all_versions=args.all_versions,
+                              workers=args.workers):
+            sys.exit(1)
+        return
+
+    # Synchronization of the Recipes of two hosts
+    if args.sync:
+        if not sync_recipes(src_client=src_client,
+                            trg_client=connect(args, args.to_ip),
+                            dry_run=args.dry_run,
+                            workers=args.workers):
+            sys.exit(1)
+        return
+
+    # Bulk import of a folder of Recipes
+    if args.from_path is not None and is_recipe_folder(args.from_path):
+        manifest_path = getattr(args, 'manifest', None)
+        if manifest_path is None:
+            manifest_path = f'import_{args.to_ip}_{time.strftime("%Y%m%d-%H%M%S")}.json'
+        if not import_recipes(client=connect(args, args.to_ip),
+                              path=args.from_path,
+                              new_name=args.rename,
+                              manifest_path=sanitize_path(manifest_path),
+                              workers=args.workers):
+            sys.exit(1)
+        return
+
+    # Save the Recipe as it is sent, without reading it, when it only goes to a file
+    if args.from_ip is not None and args.to_path is not None and args.rename is None and args.to_ip is None:
+        saved = save_recipe_from_ip_to_path(client=src_client,
+                                            recipe_id=args.id,
+                                            recipe_ver=args.version,
+                                            path=args.to_path)
+
+        # Optionally remove Recipe ID (all versions), once it is safe on disk
+        if saved and args.delete_origin:
+            delete_recipe_from_ip(client=src_client,
+                                  recipe_id=args.id)
+        return
+
     # Retrieve Recipe from path/IP
     if args.from_path is not None:
         recipe = get_recipe_from_path(path=args.from_path)
+        saved = True
     else:
-        usr, pwd = args.credentials.split(':')
-        src_login_token = login(ip=args.from_ip,
-                                user=usr,
-                                password=pwd,
-                                verbose=args.verbose)
-
-        recipe = get_recipe_from_ip(ip=args.from_ip,
-                                    token=src_login_token,
+        recipe = get_recipe_from_ip(client=src_client,
                                     recipe_id=args.id,
                                     recipe_ver=args.version)
-
-        # Optionally remove Recipe ID (all versions)
-        if args.delete_origin:
-            delete_recipe_from_ip(ip=args.from_ip,
-                                  token=src_login_token,
-                                  recipe_id=args.id)
+        saved = 'pcba_descriptor' in recipe
 
     # Optionally change Recipe name
     if args.rename is not None:
@@ -157,28 +662,31 @@ def main(args):
 
     # Save Recipe to path
     if args.to_path is not None:
-        save_recipe_to_path(path=args.to_path,
-                            recipe=recipe)
+        saved = save_recipe_to_path(path=args.to_path,
+                                    recipe=recipe) and saved
 
     # Save Recipe to IP
     if args.to_ip is not None:
         if args.from_ip == args.to_ip:
-            trg_login_token = src_login_token
+            trg_client = src_client
         else:
-            usr, pwd = args.credentials.split(':')
-            trg_login_token = login(ip=args.to_ip,
-                                    user=usr,
-                                    password=pwd,
-                                    verbose=args.verbose)
+            trg_client = connect(args, args.to_ip)
 
-        save_recipe_to_ip(ip=args.to_ip,
-                          token=trg_login_token,
-                          recipe=recipe)
+        saved = save_recipe_to_ip(client=trg_client,
+                                  recipe=recipe) and saved
+
+    # Optionally remove Recipe ID (all versions), once it was retrieved and saved everywhere it was asked to
+    if args.delete_origin:
+        if saved:
+            delete_recipe_from_ip(client=src_client,
+                                  recipe_id=args.id)
+        else:
+            print(f'Recipe {args.id} kept on {args.from_ip}: it could not be retrieved or saved')
 
 if __name__ == '__main__':
     class SaneFormatter(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter): pass
     parser = argparse.ArgumentParser(prog=__NAME__,
-                                     usage='download_upload_recipe.py [-h] [--credentials CREDENTIALS] (--from-path FROM_PATH | --from-ip FROM_IP --id ID [--version VERSION] [--delete-origin]) [--rename NEW_NAME] [--to-path TO_PATH] [--to-ip TO_IP] [--verbose]',
+                                     usage='download_upload_recipe.py [-h] [--credentials CREDENTIALS] (--from-path FROM_PATH | --from-ip FROM_IP [--id ID] [--version VERSION] [--all] [--ids IDS] [--all-versions] [--sync] [--dry-run] [--delete-origin]) [--rename NEW_NAME] [--to-path TO_PATH] [--to-ip TO_IP] [--timeout TIMEOUT] [--retries RETRIES] [--workers WORKERS] [--manifest MANIFEST] [--verbose]',
                                      description=f'{__NAME__} ({__VERSION_}), maintained by {__AUTHOR__}.\n{__DESCRIPTION__}',
                                      epilog='example usage:\ndownload_upload_recipe.py --id=42\n\t\t\t  --from-ip=172.16.14.14\n\t\t\t  --to-ip=172.16.14.12\n\t\t\t  --to-path=/home/delvitech/recipes/\n ',
                                      formatter_class=SaneFormatter)
@@ -191,12 +699,31 @@ if __name__ == '__main__':
                         type=int,
                         help="Recipe version to be retrieved. Use only with --from-ip argument.",
                         default=1)
+    parser.add_argument('--all',
+                        action='store_true',
+                        default=False,
+                        help="export every Recipe of FROM_IP to TO_PATH (latest versions only, unless --all-versions).")
+    parser.add_argument('--ids',
+                        type=parse_ids,
+                        help="export these Recipe IDs of FROM_IP to TO_PATH, e.g. '1-500,600'.")
+    parser.add_argument('--all-versions',
+                        action='store_true',
+                        default=False,
+                        help="export every version of the Recipes, not only the latest one. Use only with --all or --ids.")
+    parser.add_argument('--sync',
+                        action='store_true',
+                        default=False,
+                        help="send to TO_IP the Recipes of FROM_IP it does not have, or has in an older version (by name, version and last update).")
+    parser.add_argument('--dry-run',
+                        action='store_true',
+                        default=False,
+                        help="only show what --sync would transfer.")
     parser.add_argument('--rename',
-                        help="new name for retrieved Recipe. You can use '~name~' to get the current Recipe name. Use format 'user/recipe_name' to store it in a folder in Neith.",)
+                        help="new name for retrieved Recipe. You can use '~name~', '~id~' and '~version~' to get the current Recipe name, ID and version. Use format 'user/recipe_name' to store it in a folder in Neith.",)
 
     in_recipe = parser.add_mutually_exclusive_group(required=True)
     in_recipe.add_argument('--from-path',
-                           help="file path to retrieve the Recipe from.")
+                           help="file path to retrieve the Recipe from, or a folder (or a glob) of recipe_id*_v*.json files to upload them all to TO_IP.")
 
     in_recipe.add_argument('--from-ip',
                            help="IP address to retrieve the Recipe from. Must specify ID and VERSION.")
@@ -210,6 +737,25 @@ if __name__ == '__main__':
                         default='admin:password',
                         help="user and password to login in Neith. Must have the format 'user:password'.")
 
+    parser.add_argument('--timeout',
+                        type=float,
+                        default=READ_TIMEOUT,
+                        help="seconds to wait for an answer of a Neith host before giving up.")
+
+    parser.add_argument('--retries',
+                        type=int,
+                        default=RETRIES,
+                        help="attempts after a failed connection or an unavailable Neith host.")
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=WORKERS,
+                        help="Recipes transferred at the same time by --all, --ids, --sync and a FROM_PATH folder.")
+
+    parser.add_argument('--manifest',
+                        default=argparse.SUPPRESS,
+                        help="file to write the new IDs of the Recipes uploaded from a FROM_PATH folder to, import_<TO_IP>_<time>.json if not given.")
+
     parser.add_argument('--verbose',
                         action='store_true',
                         default=False,
@@ -223,11 +769,46 @@ if __name__ == '__main__':
     # Parse arguments and check compatibility
     args = parser.parse_args()
 
-    if args.from_ip is not None and args.id is None:
-        parser.error("--from-ip requires --id")
+    bulk_export = args.all or args.ids is not None
+
+    if args.from_ip is not None and args.id is None and not bulk_export and not args.sync:
+        parser.error("--from-ip requires --id, --all, --ids or --sync")
+
+    if args.sync:
+        if args.from_ip is None or args.to_ip is None or args.from_ip == args.to_ip:
+            parser.error("--sync requires --from-ip and a different --to-ip")
+        if bulk_export or args.id is not None or args.rename is not None or args.to_path is not None \
+                or args.delete_origin:
+            parser.error("--sync cannot be used with --id, --all, --ids, --rename, --to-path or --delete-origin")
+    elif args.dry_run:
+        parser.error("--dry-run requires --sync")
+
+    if bulk_export:
+        if args.all and args.ids is not None:
+            parser.error("--all and --ids cannot be used together")
+        if args.from_ip is None or args.to_path is None:
+            parser.error("--all and --ids require --from-ip and --to-path")
+        if args.id is not None or args.rename is not None or args.to_ip is not None or args.delete_origin:
+            parser.error("--all and --ids cannot be used with --id, --rename, --to-ip or --delete-origin")
+
+    if args.from_path is not None and is_recipe_folder(args.from_path):
+        if args.to_ip is None or args.to_path is not None:
+            parser.error("a FROM_PATH folder can only be uploaded to --to-ip")
+    elif hasattr(args, 'manifest'):
+        parser.error("--manifest requires a FROM_PATH folder")
+
+    if args.all_versions and not bulk_export:
+        parser.error("--all-versions requires --all or --ids")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
 
     if args.delete_origin and args.from_ip is None:
         parser.error("--delete-origin requires --from-ip")
 
-    main(args)
+    try:
+        main(args)
+    except requests.RequestException as e:
+        print(f'failed :(\nCould not reach Neith: {e}')
+        sys.exit(1)
 
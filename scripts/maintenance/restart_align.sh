@@ -1,12 +1,9 @@
 #!/bin/bash
 
-list=$(docker ps -aqf "name=align")
+cd "$(dirname "$0")/../.." || exit 1
 
 echo "Restarting all the aligns containers"
 
-for res in $list
-do
-   docker restart $res
-done
+python3 -u -m core.maintenance restart align || exit 1
 
-echo "All aligns restarted"
\ No newline at end of file
+echo "All aligns restarted"
@@ -1,7 +1,7 @@
 #!/bin/bash
 
-res=$(docker ps -aqf "name=calibration")
+cd "$(dirname "$0")/../.." || exit 1
 
 echo "Restarting calibration container"
-docker restart $res
+python3 -u -m core.maintenance restart calibration || exit 1
 echo "Calibration restarted"
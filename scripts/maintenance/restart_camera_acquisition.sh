@@ -15,5 +15,8 @@ sudo ~/work/acq_microservice/drivers/daxpylh/load_driver
 echo "Acquisition restarted"
 docker start $res
 
-sleep 60
+# Return as soon as the microservice is healthy instead of sleeping a fixed minute. It has no readiness signal of its
+# own (no healthcheck, startup line or port known here): without a healthcheck, wait the minute after its start as before
+cd "$(dirname "$0")/../.." || exit 1
+python3 -u -m core.readiness acq_microservice --fallback-wait 60 --timeout 180 || exit 1
 echo "Done"
@@ -1,7 +1,7 @@
 #!/bin/bash
 
-res=$(docker ps -aqf "name=hardware")
+cd "$(dirname "$0")/../.." || exit 1
 
 echo "Restarting hardware container"
-docker restart $res
+python3 -u -m core.maintenance restart hardware || exit 1
 echo "Hardware restarted"
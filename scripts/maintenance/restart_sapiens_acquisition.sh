@@ -1,7 +1,7 @@
 #!/bin/bash
 
-res=$(docker ps -aqf "name=acquisition")
+cd "$(dirname "$0")/../.." || exit 1
 
 echo "Restarting sapiens-acquisition container"
-docker restart $res
+python3 -u -m core.maintenance restart acquisition || exit 1
 echo "Acquisition restarted"
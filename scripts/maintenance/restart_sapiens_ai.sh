@@ -1,12 +1,9 @@
 #!/bin/bash
 
-list=$(docker ps -aqf "name=sapiens-ai")
+cd "$(dirname "$0")/../.." || exit 1
 
 echo "Restarting all the sapiens-ai containers"
 
-for res in $list
-do
-   docker restart $res
-done
+python3 -u -m core.maintenance restart sapiens-ai || exit 1
 
-echo "All sapiens-ai restarted"
\ No newline at end of file
+echo "All sapiens-ai restarted"
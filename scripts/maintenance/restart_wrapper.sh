@@ -1,7 +1,7 @@
 #!/bin/bash
 
-res=$(docker ps -aqf "name=wrapper")
+cd "$(dirname "$0")/../.." || exit 1
 
 echo "Restarting Wrapper container"
-docker restart $res
+python3 -u -m core.maintenance restart wrapper || exit 1
 echo "Wrapper restarted"
@@ -3,13 +3,16 @@
 ##################################################
 __NAME__ = f'Delvitech Inspection Runner'
 __DESCRIPTION__ = 'utility to run a recipe multiple times continuosly'
-__VERSION_ = 'v1.0.0'
+__VERSION_ = 'v1.1.1'
 __AUTHOR__ = 'LT'
 ##################################################
 ## Usage: call this script from terminal, read tutorial by calling it with the --help flag.
 ##################################################
 
 import os
+import json
+import time
+import base64
 import argparse
 import subprocess
 import threading
@@ -32,17 +35,93 @@ PORT = 3000
 ie_container = "134_inspection-engine_1"
 acq_container = "134_acq_microservice_1"
 
+TOKEN_CACHE = '~/.toolbox/neith_tokens.json'  # access tokens kept between runs, shared with download_upload_recipe.py
+TOKEN_MARGIN = 60  # seconds before its expiry a cached token is not used anymore
+
+##################################################
+################## TOKEN CACHE ###################
+##################################################
+
+# Tokens are kept between runs, by host and user, until shortly before the expiry written in them (the "exp" claim
+# of the JWT): a job started again right away does not log in again. The file is only readable by its owner.
+
+def token_expiry(token):
+    # Expiry of a JWT as a timestamp, None when it cannot be read
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+def is_token_entry(entry):
+    return isinstance(entry, dict) and isinstance(entry.get('token'), str) \
+        and isinstance(entry.get('expires'), (int, float))
+
+def read_token_cache():
+    # Only the well-formed entries: one edited by hand or left by another version is a cache miss
+    try:
+        with open(os.path.expanduser(TOKEN_CACHE), 'r') as infile:
+            cache = json.load(infile)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return {key: entry for key, entry in cache.items() if is_token_entry(entry)}
+
+def write_token_cache(cache):
+    # Written to a temporary file first, so a run reading it at the same time never sees half a cache. Two runs
+    # writing it at the same time can lose a token, which only costs a login.
+    path = os.path.expanduser(TOKEN_CACHE)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}'
+    with os.fdopen(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as outfile:
+        json.dump(cache, outfile)
+    os.replace(temporary_path, path)
+
+def get_cached_token(ip, user):
+    entry = read_token_cache().get(f'{user}@{ip}:{PORT}')
+    if entry is None or entry['expires'] - TOKEN_MARGIN < time.time():
+        return None
+    return entry['token']
+
+def cache_token(ip, user, token):
+    expires = token_expiry(token)
+    now = time.time()
+    cache = {key: entry for key, entry in read_token_cache().items() if entry['expires'] > now}
+    if expires is not None:
+        cache[f'{user}@{ip}:{PORT}'] = {'token': token, 'expires': expires}
+    try:
+        write_token_cache(cache)
+    except OSError as e:
+        print(f'Could not cache the access token: {e}')
+
+def forget_token(ip, user):
+    cache = read_token_cache()
+    if cache.pop(f'{user}@{ip}:{PORT}', None) is not None:
+        try:
+            write_token_cache(cache)
+        except OSError:
+            pass
+
 ##################################################
 ################## UTIL FUNCS ####################
 ##################################################
 
-def login(ip, user, password, verbose):
+def login(ip, user, password, verbose, refresh=False):
+    login_token = None if refresh else get_cached_token(ip, user)
+    if login_token:
+        if verbose:
+            print(f'ACCESS_TOKEN for {ip} (cached): {login_token}')
+        return login_token
+
     auth_dict = {"username": user, "password": password}
 
     r_login = requests.post(f'{PROTO_SCHEME}{ip}:{PORT}/v1/auth/login', json=auth_dict)
     if r_login.status_code == 200:
         login_token = r_login.json().get('access_token')
         if login_token:
+            cache_token(ip, user, login_token)
             if verbose:
                 print(f'ACCESS_TOKEN for {ip}: {login_token}')
             return login_token
@@ -82,7 +161,8 @@ def check_response(response):
 #     sio.disconnect()  # Disconnect from the socket when inspection is complete
 
 
-def run_inspection(ip, token, recipe_id, recipe_ver, number_of_runs):
+def run_inspection(ip, token, recipe_id, recipe_ver, number_of_runs, credentials=None):
+    # Returns the token to use for the next runs: a new one when the host rejected this one and credentials are given
     if token:
         auth_header = {'Authorization': f'Bearer {token}'}
         url = f'{PROTO_SCHEME}{ip}:{PORT}/v1/inspection/draft/pcba/{recipe_id}/{recipe_ver}?prefix=lt_'
@@ -117,6 +197,14 @@ def run_inspection(ip, token, recipe_id, recipe_ver, number_of_runs):
             # Send the request to start the inspection
             r_run_recipe = requests.post(url, headers=auth_header, json=payload)
 
+            if r_run_recipe.status_code == 401 and credentials is not None:
+                # Expired early or revoked (e.g. the host was reinstalled): log in again and send it once more
+                forget_token(ip, credentials[0])
+                token = login(ip, *credentials, verbose=False, refresh=True)
+                if token:
+                    auth_header = {'Authorization': f'Bearer {token}'}
+                    r_run_recipe = requests.post(url, headers=auth_header, json=payload)
+
             if r_run_recipe.status_code == 200:
                 # You can extract any information from the response here if needed
                 response_data = r_run_recipe.json()
@@ -135,6 +223,8 @@ def run_inspection(ip, token, recipe_id, recipe_ver, number_of_runs):
     else:
         print('No valid authentication token available. Authentication may have failed.')
 
+    return token
+
 def get_container_logs(container_name):
     try:
         # Define the 'docker logs' command
@@ -215,7 +305,8 @@ def main(args):
         print(f"Starting inspection run {run + 1} of {args.times}")
 
         # Run the inspection
-        run_inspection(ip=args.from_ip, token=src_login_token, recipe_id=args.id, recipe_ver=args.version, number_of_runs=1)
+        src_login_token = run_inspection(ip=args.from_ip, token=src_login_token, recipe_id=args.id,
+                                         recipe_ver=args.version, number_of_runs=1, credentials=(usr, pwd))
 
         ie_logs = get_container_logs(ie_container)
         if "INSPECTION END STEP" in ie_logs:
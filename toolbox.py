@@ -0,0 +1,285 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# The catalog and the scripts expect to run from the ToolBox directory, like the GUI (e.g. from cron)
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Folder of the catalog, the one of core.catalog.SCRIPTS_DIRECTORY. The catalog module (and its dataclasses, regular
+# expressions and subprocess imports) is only loaded by the commands needing it: "list" runs from cron and over ssh.
+SCRIPTS_DIRECTORY = "scripts"
+
+# Exit codes of "run" when the job did not end by itself, as timeout(1) and a SIGTERM would
+EXIT_TIMEOUT = 124
+EXIT_STOPPED = 143
+
+
+def format_argument(argument) -> str:
+    from core.catalog import Argument, ArgumentType
+
+    if not isinstance(argument, Argument):
+        # OrArgumentGroup of RequiredArgumentGroups
+        return "(" + " | ".join(" ".join(format_argument(arg) for arg in group.arguments)
+                                for group in argument.arguments) + ")"
+    text = f"{argument.name_repr} {argument.value_name}" if argument.value_name else argument.name_repr
+    if argument.argument_type in (ArgumentType.OPTIONAL, ArgumentType.OPTIONAL_WITH_VALUE):
+        return f"[{text}]"
+    return text
+
+
+def list_scripts(args):
+    # Only file names: parsing the usage of every python script would run them
+    entries = sorted(os.scandir(SCRIPTS_DIRECTORY), key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_file() and entry.name.endswith(".py"):
+            print(entry.name[:-len(".py")])
+    for folder in entries:
+        if not folder.is_dir():
+            continue
+        for name in sorted(os.listdir(folder.path)):
+            stem, extension = os.path.splitext(name)
+            if extension in (".sh", ".json"):
+                print(f"{folder.name}/{stem}")
+
+
+def load_script(reference: str):
+    # The usage of a python script is read from its --help: one that cannot show it is reported like an unknown one
+    from core.catalog import find_script
+
+    try:
+        return find_script(reference)
+    except subprocess.CalledProcessError as e:
+        # The last line of a traceback is the error, e.g. a missing module
+        error = e.stderr.strip().splitlines()[-1] if e.stderr and e.stderr.strip() else f"exit code {e.returncode}"
+        raise ValueError(f"Cannot read the usage of {reference}: {error}")
+
+
+def show_script(args):
+    from core.catalog import Argument
+
+    script = load_script(args.script)
+    print(f"{script.name} ({script.path})")
+    if script.version or script.author:
+        print(f"version {script.version}, maintained by {script.author}")
+    if script.args:
+        print("usage: " + " ".join(format_argument(argument) for argument in script.args))
+        for argument in script.args:
+            arguments = [argument] if isinstance(argument, Argument) else \
+                [arg for group in argument.arguments for arg in group.arguments]
+            for arg in arguments:
+                default = f" (default: {arg.default_value})" if arg.default_value else ""
+                print(f"  {arg.name_repr:<20} {arg.description or ''}{default}")
+
+
+def check_arguments(script, script_args) -> bool:
+    from core.catalog import validate_arguments
+
+    errors = validate_arguments(script, script_args)
+    for error in errors:
+        print(f"{script.path.name}: {error}", file=sys.stderr)
+    return not errors
+
+
+def validate_script(args):
+    script = load_script(args.script)
+    if not check_arguments(script, args.args):
+        sys.exit(2)
+    print("ok")
+
+
+def exit_status(result) -> int:
+    if result is None:
+        return 1  # The job could not start
+    if result.termination == "timeout":
+        print(f"Timed out after {result.wall_time:.1f} s", file=sys.stderr)
+        return EXIT_TIMEOUT
+    if result.termination == "stopped":
+        print(f"Stopped after {result.wall_time:.1f} s", file=sys.stderr)
+        return EXIT_STOPPED
+    return result.exit_code
+
+
+def follow_job(client, job_id: int) -> int:
+    # Print the output of a daemon job until it ends, and return its exit status
+    from core.daemon import result_from_message
+
+    for event in client.subscribe(job_id).events():
+        if event["event"] == "snapshot":
+            if not event["jobs"]:
+                raise ValueError(f"Unknown job {job_id}")
+            job = event["jobs"][0]
+            for line in job["lines"]:
+                print(line, flush=True)
+            if not job["running"]:
+                return exit_status(result_from_message(job["result"]))
+        elif event["event"] == "output":
+            print(event["line"], flush=True)
+        elif event["event"] == "finished":
+            return exit_status(result_from_message(event["job"]["result"]))
+
+
+def run_in_daemon(args, argv, script_path):
+    from core.daemon import SCRIPT_TIMEOUT, DaemonClient
+
+    client = DaemonClient()
+    timeout = SCRIPT_TIMEOUT if args.timeout is None else args.timeout or None
+    job_id = client.start_job(argv, script=script_path, args=args.args, timeout=timeout)
+    if args.detach:
+        print(f"Started job {job_id}, follow it with: toolbox.py attach {job_id}")
+        return
+
+    # Ctrl+C or a SIGTERM stops the job, as when it runs in this process
+    signal.signal(signal.SIGINT, lambda signal_number, frame: client.stop_job(job_id))
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: client.stop_job(job_id))
+    sys.exit(follow_job(client, job_id))
+
+
+def run_script(args):
+    from core.catalog import script_command
+    from core.jobs import Job, job_timeout
+    from core.run_history import RunHistory
+
+    script = load_script(args.script)
+    if not args.no_validate and not check_arguments(script, args.args):
+        sys.exit(2)
+
+    script_path = str(script.path.absolute())
+    if args.daemon or args.detach:
+        run_in_daemon(args, script_command(script_path, args.args), script_path)
+        return
+
+    timeout = args.timeout if args.timeout is not None else job_timeout(script_path)
+    job = Job(script_command(script_path, args.args), script=script_path, args=args.args,
+              timeout=timeout if timeout else None)
+
+    # Ctrl+C or a SIGTERM from cron/ssh stops the job and everything it started
+    signal.signal(signal.SIGINT, lambda signal_number, frame: job.stop())
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: job.stop())
+
+    try:
+        result = job.run(on_output=lambda line: print(line, flush=True))
+    except OSError as e:
+        print(f"Failed to start {script_path}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if not args.no_history:
+        RunHistory().record(result)
+    sys.exit(exit_status(result))
+
+
+def list_jobs(args):
+    from core.daemon import DaemonClient
+
+    for job in DaemonClient(start_daemon=False).jobs():
+        if job["running"]:
+            state = f"running for {time.time() - job['start_time']:.0f} s"
+        elif job["result"] is None:
+            state = "failed to start"
+        else:
+            state = f"{job['result']['termination']}, exit code {job['result']['exit_code']}"
+        print(f"{job['id']:>4}  {os.path.basename(job['script']):<30} {state:<30} {' '.join(job['args'])}")
+
+
+def attach_job(args):
+    from core.daemon import DaemonClient
+
+    try:
+        sys.exit(follow_job(DaemonClient(start_daemon=False), args.job))
+    except KeyboardInterrupt:
+        # Only stop following it, the job keeps running in the daemon
+        print(f"Detached from job {args.job}", file=sys.stderr)
+
+
+def stop_job(args):
+    from core.daemon import DaemonClient
+
+    if not DaemonClient(start_daemon=False).stop_job(args.job):
+        print(f"Job {args.job} is not running", file=sys.stderr)
+        sys.exit(1)
+
+
+def show_history(args):
+    from core.run_history import RunHistory
+
+    print(f"{'Script':<40} {'Runs':>5} {'Failed':>6} {'p50 (s)':>8} {'p90 (s)':>8} {'p99 (s)':>8}")
+    for summary in RunHistory().summary():
+        print(f"{os.path.basename(summary.script):<40} {summary.runs:>5} {summary.failures:>6} "
+              f"{summary.p50:>8.1f} {summary.p90:>8.1f} {summary.p99:>8.1f}")
+
+
+def show_autoclean(args):
+    from core.autoclean import AutocleanHistory
+    from core.disk_scanner import format_size
+
+    print(f"{'Started':<20} {'Disk':<10} {'Before':>6} {'After':>6} {'Freed':>10} {'Time (s)':>9}  Result")
+    for action in AutocleanHistory().actions(device=args.device, limit=args.limit):
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(action.start_time))
+        before = action.used_before / action.total if action.total else 0.0
+        after = action.used_after / action.total if action.total else 0.0
+        freed = format_size(action.bytes_freed) if action.bytes_freed >= 0 else "-" + format_size(-action.bytes_freed)
+        print(f"{started:<20} {action.device:<10} {before:>6.0%} {after:>6.0%} {freed:>10} {action.duration:>9.1f}  "
+              f"{action.termination}, exit code {action.exit_code}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ToolBox scripts without the GUI")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="list the scripts of the catalog")
+    list_parser.set_defaults(function=list_scripts)
+
+    show_parser = subparsers.add_parser("show", help="show the arguments of a script")
+    show_parser.add_argument("script", help='"<folder>/<name>" or the name of a python script')
+    show_parser.set_defaults(function=show_script)
+
+    validate_parser = subparsers.add_parser("validate", help="check arguments against the usage of a script")
+    validate_parser.add_argument("script", help='"<folder>/<name>" or the name of a python script')
+    validate_parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the script")
+    validate_parser.set_defaults(function=validate_script)
+
+    run_parser = subparsers.add_parser("run", help="run a script, streaming its output")
+    run_parser.add_argument("--timeout", type=float, help="seconds before the job is stopped (0 for none), "
+                                                          "by default the one configured for the script")
+    run_parser.add_argument("--no-validate", action="store_true", help="do not check the arguments first")
+    run_parser.add_argument("--no-history", action="store_true", help="do not record the run in the history")
+    run_parser.add_argument("--daemon", action="store_true", help="run the job in the ToolBox daemon, where it "
+                                                                  "keeps running if the connection is lost")
+    run_parser.add_argument("--detach", action="store_true", help="run the job in the daemon and return at once")
+    run_parser.add_argument("script", help='"<folder>/<name>" or the name of a python script')
+    run_parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the script")
+    run_parser.set_defaults(function=run_script)
+
+    history_parser = subparsers.add_parser("history", help="show the wall time percentiles of the scripts")
+    history_parser.set_defaults(function=show_history)
+
+    autoclean_parser = subparsers.add_parser("autoclean", help="show the disk cleanings the daemon started by itself")
+    autoclean_parser.add_argument("--device", help="only the cleanings of this disk (system, ramdisk, backup)")
+    autoclean_parser.add_argument("--limit", type=int, default=20, help="number of cleanings shown")
+    autoclean_parser.set_defaults(function=show_autoclean)
+
+    jobs_parser = subparsers.add_parser("jobs", help="list the jobs of the ToolBox daemon")
+    jobs_parser.set_defaults(function=list_jobs)
+
+    attach_parser = subparsers.add_parser("attach", help="follow the output of a job of the daemon")
+    attach_parser.add_argument("job", type=int, help="job number, see the jobs command")
+    attach_parser.set_defaults(function=attach_job)
+
+    stop_parser = subparsers.add_parser("stop", help="stop a job of the daemon")
+    stop_parser.add_argument("job", type=int, help="job number, see the jobs command")
+    stop_parser.set_defaults(function=stop_job)
+
+    parsed_args = parser.parse_args()
+    try:
+        parsed_args.function(parsed_args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    except (ConnectionError, FileNotFoundError) as e:
+        print(f"Cannot reach the ToolBox daemon: {e}", file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        # The output was piped to a command that exited early, like head
+        sys.stderr.close()